@@ -1,13 +1,34 @@
+import bz2
+import gzip
+import lzma
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-from datetime import datetime
-from os import scandir, mkdir, makedirs, remove, replace
-from os.path import join, exists, isdir, abspath
-from shutil import copy
-from typing import Union
+from datetime import datetime, timedelta
+from hashlib import blake2b
+from json import dump, load
+from os import scandir, listdir, mkdir, makedirs, remove, replace, cpu_count, stat
+from os.path import join, exists, isdir, abspath, basename, getsize
+from pathlib import Path
+from sqlite3 import Error, connect
+from time import perf_counter, sleep
+from typing import Callable, Dict, List, Tuple, Union
 
 from database import all_databases
 
 CFG_PATH = join('.config', 'backup.conf')
+CATALOG_NAME = 'catalog.json'
+CHANGES_NAME = 'changes.json'
+INDEX_NAME = 'index.json'
+RETENTION_TIERS = ['hourly', 'daily', 'weekly', 'monthly']
+
+# The compression codecs, with the extension of their files and the range of their compression levels
+CODECS = {'gzip': ('.gz', 0, 9), 'bz2': ('.bz2', 1, 9), 'lzma': ('.xz', 0, 9)}
+_BLOCK_SIZE = 1 << 20
+_HEADER = b'SQLite format 3\0'
+# The date format of backup filenames. Older backups have no microseconds, and some have unpadded hours and minutes,
+# which the older format also parses
+_NAME_DATE = '%Y-%m-%d-%H-%M-%S-%f'
+_OLD_NAME_DATE = '%Y-%m-%d-%H-%M-%S'
 
 
 def _create_backup_config():
@@ -16,8 +37,10 @@ def _create_backup_config():
     """
     parser = ConfigParser()
     parser.add_section('Settings')
-    settings = {'last backup': 'Never', 'enabled': True, 'interval': '72', 'number of backups': '3',
-                'location': 'Backup'}
+    settings = {'last backup': 'Never', 'enabled': 'yes', 'interval': '72', 'number of backups': '3',
+                'location': 'Backup', 'pages per step': '256', 'step pause': '0.005', 'compression': 'none',
+                'compression level': '6', 'hash changes': 'no', 'change threshold': '0', 'growth threshold': '0',
+                'keep hourly': '0', 'keep daily': '0', 'keep weekly': '0', 'keep monthly': '0'}
     for option in settings.keys():
         parser.set('Settings', option, settings[option])
     if not exists('.config'):
@@ -28,11 +51,12 @@ def _create_backup_config():
 
 
 def backup_required():
-    """Checks if a backup is required
+    """Checks if a backup is required: when the backup interval has passed, when a database has no backups, or when a
+    database has changed by more than the change or growth threshold since its last backup
 
     :return: bool
     """
-    if backup_enabled():
+    if backup_enabled() == 'yes':
         if not last_backup():
             return True
 
@@ -41,49 +65,554 @@ def backup_required():
 
         now = datetime.now().replace(second=59, microsecond=999999)
         last = last_backup()
-        delta = (now - last).seconds / 3600
+        delta = (now - last).total_seconds() / 3600
         if delta > backup_interval():
             return True
 
-        root = backup_location()
-        dirs = list(scandir(root))
-        for d in dirs:
-            if len(d) == 0:
+        transactions, growth = change_threshold(), growth_threshold()
+        for name, path in all_databases().items():
+            if not list_backups(name):
                 return True
+            if transactions or growth:
+                changes = database_changes(name, path, hashing=False)
+                if transactions and changes['transactions'] is not None and changes['transactions'] >= transactions:
+                    return True
+                if growth and changes['growth'] >= growth * 1024:
+                    return True
 
     return False
 
 
-def run_backup():
-    """Creates a new backup for each database in the config file
+class Signature:
+    """The size and modification time of a database file, the change counter in its header, which sqlite increments
+    whenever a transaction changes a database in rollback journal mode, and the modification time of its write-ahead
+    log, which changes whenever a transaction changes a database in WAL mode"""
+
+    def __init__(self, size: int, mtime: int, counter: int, wal: bool, wal_mtime: int = -1):
+        self.size = size
+        self.mtime = mtime
+        self.counter = counter
+        self.wal = wal
+        self.wal_mtime = wal_mtime
+
+    @classmethod
+    def read(cls, path: str) -> 'Signature':
+        status = stat(path)
+        with open(path, 'rb') as f:
+            header = f.read(100)
+        if not header.startswith(_HEADER):
+            return cls(status.st_size, status.st_mtime_ns, -1, False)
+        wal = header[18] == 2
+        wal_mtime = stat(path + '-wal').st_mtime_ns if wal and exists(path + '-wal') else -1
+        return cls(status.st_size, status.st_mtime_ns, int.from_bytes(header[24:28], 'big'), wal, wal_mtime)
+
+    def to_list(self) -> list:
+        return [self.size, self.mtime, self.counter, self.wal, self.wal_mtime]
+
+    def __eq__(self, other):
+        return isinstance(other, Signature) and self.to_list() == other.to_list()
+
+
+def database_signature(path: str) -> Signature:
+    """Reads the signature of a database while holding a shared lock, so that no transaction is being committed
+
+    :param path: a str representing the location of the database
+    :return: a Signature
+    """
+    connection = connect(Path(abspath(path)).as_uri() + '?mode=ro', uri=True, isolation_level=None)
+    try:
+        connection.execute('BEGIN')
+        connection.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        return Signature.read(path)
+    finally:
+        connection.close()
+
+
+def database_hash(path: str) -> str:
+    """Hashes a database file together with its write-ahead log, if it has one
+
+    :param path: a str representing the location of the database
+    :return: a str representing the hash
+    """
+    hasher = blake2b(digest_size=16)
+    for file in [path, path + '-wal']:
+        if exists(file):
+            with open(file, 'rb') as f:
+                for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+                    hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _database_bytes(path: str) -> int:
+    return getsize(path) + (getsize(path + '-wal') if exists(path + '-wal') else 0)
+
+
+def _read_changes(name: str) -> dict:
+    path = join(backup_location(), name, CHANGES_NAME)
+    if not exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return load(f)
+
+
+def _write_changes(name: str, state: dict):
+    _write_record(name, CHANGES_NAME, state)
+
+
+def database_changes(name: str, path: str, hashing: bool = None) -> dict:
+    """Compares a database with its state at its last backup. The size, modification time and change counter of the
+    file, and the modification time of its write-ahead log, are compared first. If they differ and hashing is enabled,
+    the contents are hashed as well, so that a file that was only touched does not count as changed. If a database has
+    backups but no record of its state, as after an upgrade, its current state is recorded as the baseline for the
+    change and growth thresholds
+
+    :param name: the name of the database
+    :param path: a str representing the location of the database
+    :param hashing: a bool indicating whether to hash the contents. Defaults to the 'hash changes' setting
+    :return: a dict with the keys 'changed' (a bool), 'transactions' (the number of transactions committed since the
+    last backup, or None if they cannot be counted from the change counter, as in WAL mode), 'growth' (the change in
+    size in bytes), 'signature' (a Signature), 'hash' (a str, or None if it was not computed) and 'bytes' (the size of
+    the database and its write-ahead log)
+    """
+    hashing = hashing if hashing is not None else hash_changes() == 'yes'
+    state = _read_changes(name)
+    signature = database_signature(path)
+    size = _database_bytes(path)
+    changes = {'changed': True, 'transactions': None, 'growth': size, 'signature': signature, 'hash': None,
+               'bytes': size}
+    if not state:
+        if hashing:
+            changes['hash'] = database_hash(path)
+        if list_backups(name):
+            # Backups made before changes were recorded: the current state becomes the baseline that later changes
+            # are measured against, while the database still counts as changed until it is backed up
+            _write_changes(name, {'signature': signature.to_list(), 'hash': changes['hash'], 'bytes': size,
+                                  'baseline': True})
+            changes['growth'] = 0
+        return changes
+    last = Signature(*state['signature'])
+    changes['growth'] = abs(size - state['bytes'])
+    if not signature.wal and not last.wal and signature.counter >= 0 and last.counter >= 0:
+        changes['transactions'] = (signature.counter - last.counter) % (1 << 32)
+    if state.get('baseline'):
+        # The state of the database at its last backup is unknown, so it counts as changed
+        if hashing:
+            changes['hash'] = database_hash(path)
+    elif signature == last:
+        changes['changed'] = False
+        changes['hash'] = state.get('hash')
+    elif hashing:
+        changes['hash'] = database_hash(path)
+        changes['changed'] = changes['hash'] != state.get('hash')
+    return changes
+
+
+def backup_skips(name: str) -> dict:
+    """Gets the record of the backups of a database that were skipped because it had not changed
+
+    :param name: the name of the database
+    :return: a dict with the keys 'skipped' (the number of backups skipped since the last backup), 'last skipped' (a
+    datetime, or None) and 'last backup' (a datetime, or None)
+    """
+    state = _read_changes(name)
+    skipped, backed_up = state.get('last skipped'), state.get('backed up')
+    return {'skipped': state.get('skipped', 0), 'last skipped': datetime.fromisoformat(skipped) if skipped else None,
+            'last backup': datetime.fromisoformat(backed_up) if backed_up else None}
+
+
+class _Restarted(Exception):
+    pass
+
+
+def backup_database(source: str, destination: str, pages: int = None, pause: float = None, max_restarts: int = 3,
+                    progress: Callable[[int, int], None] = None):
+    """Copies a database with the sqlite backup API, 'pages' pages at a time with a pause after each step, so that the
+    application can keep writing to it. The source is opened read-only. The copy is a consistent snapshot: in WAL
+    mode, a read transaction is held for the whole copy, which does not block writers; otherwise the copy restarts
+    when another connection writes to the source, and after 'max_restarts' steps that make no progress it is finished
+    in a single step. The copy is written next to the destination and only moved into place once it is complete
+
+    :param source: a str representing the location of the database
+    :param destination: a str representing the location of the copy
+    :param pages: the number of pages copied per step. Defaults to the 'pages per step' setting
+    :param pause: the number of seconds to pause after each step, and before retrying a step while the source is
+    locked. Defaults to the 'step pause' setting
+    :param max_restarts: the number of steps without progress before the copy is finished in one step
+    :param progress: a callable that receives the number of pages remaining and the total number of pages after
+    each step
+    """
+    pages = pages if pages is not None else pages_per_step()
+    pause = pause if pause is not None else step_pause()
+    partial = destination + '.part'
+    state = {'remaining': None, 'restarts': 0}
+
+    def step(status: int, remaining: int, total: int):
+        if state['remaining'] is not None and remaining >= state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > max_restarts:
+                raise _Restarted()
+        state['remaining'] = remaining
+        if progress:
+            progress(remaining, total)
+        if remaining and pause:
+            sleep(pause)
+
+    def report(status: int, remaining: int, total: int):
+        if progress:
+            progress(remaining, total)
+
+    src = connect(Path(abspath(source)).as_uri() + '?mode=ro', uri=True, isolation_level=None)
+    try:
+        if src.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            src.execute('BEGIN')
+            src.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        dst = connect(partial)
+        try:
+            try:
+                src.backup(dst, pages=pages, progress=step, sleep=pause)
+            except _Restarted:
+                src.backup(dst, pages=-1, progress=report, sleep=pause)
+        finally:
+            dst.close()
+    except BaseException:
+        if exists(partial):
+            remove(partial)
+        raise
+    finally:
+        src.close()
+    replace(partial, destination)
+
+
+def _open_compressed(path: str, mode: str, codec: str, level: int = None):
+    if codec == 'gzip':
+        return gzip.open(path, mode, compresslevel=level) if level is not None else gzip.open(path, mode)
+    if codec == 'bz2':
+        return bz2.open(path, mode, compresslevel=level) if level is not None else bz2.open(path, mode)
+    return lzma.open(path, mode, preset=level) if level is not None and 'w' in mode else lzma.open(path, mode)
+
+
+def _codec_of(path: str) -> Union[str, None]:
+    for codec, (extension, _, _) in CODECS.items():
+        if path.endswith(extension):
+            return codec
+    return None
+
+
+def compress_backup(source: str, destination: str, codec: str, level: int = None):
+    """Compresses a file one block at a time. The compressors release the GIL, so files can be compressed in parallel
+    by several threads
+
+    :param source: a str representing the location of the file
+    :param destination: a str representing the location of the compressed file
+    :param codec: one of 'gzip', 'bz2' or 'lzma'
+    :param level: the compression level. Defaults to the codec's default
+    """
+    partial = destination + '.part'
+    try:
+        with open(source, 'rb') as src, _open_compressed(partial, 'wb', codec, level) as dst:
+            for block in iter(lambda: src.read(_BLOCK_SIZE), b''):
+                dst.write(block)
+    except BaseException:
+        if exists(partial):
+            remove(partial)
+        raise
+    replace(partial, destination)
+
+
+def restore_backup(backup: str, destination: str):
+    """Restores a database from a backup, decompressing it one block at a time if it is compressed. The restored file
+    is written next to the destination and only replaces it once it is complete
+
+    :param backup: a str representing the location of the backup
+    :param destination: a str representing the location of the restored database
+    """
+    codec = _codec_of(backup)
+    partial = destination + '.part'
+    try:
+        with (_open_compressed(backup, 'rb', codec) if codec else open(backup, 'rb')) as src, \
+                open(partial, 'wb') as dst:
+            for block in iter(lambda: src.read(_BLOCK_SIZE), b''):
+                dst.write(block)
+    except BaseException:
+        if exists(partial):
+            remove(partial)
+        raise
+    replace(partial, destination)
+
+
+def _backup_one(source: str, destination: str, codec: str, level: int) -> dict:
+    """Copies a database and compresses the copy, timing both steps"""
+    start = perf_counter()
+    if codec == 'none':
+        backup_database(source, destination)
+        return {'file': basename(destination), 'created': datetime.now().isoformat(), 'codec': codec, 'level': None,
+                'size': getsize(destination), 'stored': getsize(destination), 'ratio': 1.0,
+                'copy seconds': perf_counter() - start, 'compress seconds': 0.0}
+    copy = destination + '.copy'
+    backup_database(source, copy)
+    copied = perf_counter()
+    try:
+        destination += CODECS[codec][0]
+        compress_backup(copy, destination, codec, level)
+        size, stored = getsize(copy), getsize(destination)
+    finally:
+        remove(copy)
+    return {'file': basename(destination), 'created': datetime.now().isoformat(), 'codec': codec, 'level': level,
+            'size': size, 'stored': stored, 'ratio': size / stored if stored else 0.0,
+            'copy seconds': copied - start, 'compress seconds': perf_counter() - copied}
+
+
+def backup_catalog(name: str) -> List[dict]:
+    """Gets the record of each backup of a database that still exists, oldest first. Each record is a dict with the
+    keys 'file', 'created', 'codec', 'level', 'size' (of the database), 'stored' (the size of the backup), 'ratio',
+    'copy seconds' and 'compress seconds'
+
+    :param name: the name of the database
+    :return: a list of dicts
+    """
+    db_directory = join(backup_location(), name)
+    path = join(db_directory, CATALOG_NAME)
+    if not exists(path):
+        return []
+    with open(path, 'r') as f:
+        records = load(f)
+    return [x for x in records if exists(join(db_directory, x['file']))]
+
+
+def _write_catalog(name: str, records: List[dict]):
+    _write_record(name, CATALOG_NAME, records)
 
+
+def backup_time(name: str, filename: str) -> Union[datetime, None]:
+    """Parses the time a backup was made from its filename
+
+    :param name: the name of the database
+    :param filename: the filename of the backup
+    :return: a datetime, or None if the filename does not contain a time
+    """
+    stem = filename[len(name) + 1:]
+    codec = _codec_of(stem)
+    if codec:
+        stem = stem[:-len(CODECS[codec][0])]
+    for date_format in [_NAME_DATE, _OLD_NAME_DATE]:
+        try:
+            return datetime.strptime(stem, date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def _backup_name(name: str, db_directory: str, time: datetime) -> str:
+    """Names a new backup after the time it was made. If a backup with that name exists, as when the clock has not
+    advanced since the last backup, the time is moved forward a microsecond at a time until the name is free"""
+    extensions = [''] + [x[0] for x in CODECS.values()]
+    while True:
+        new = name + '_' + time.strftime(_NAME_DATE)
+        if not any(exists(join(db_directory, new + x)) for x in extensions):
+            return new
+        time += timedelta(microseconds=1)
+
+
+def _read_index() -> dict:
+    path = join(backup_location(), INDEX_NAME)
+    if not exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return load(f)
+
+
+def _write_index(index: dict):
+    path = join(backup_location(), INDEX_NAME)
+    with open(path + '.part', 'w') as f:
+        dump(index, f)
+    replace(path + '.part', path)
+
+
+def _directory_state(db_directory: str) -> List[int]:
+    """Gets the modification time of a directory and the number of files in it. The count catches a file added within
+    the same tick of the modification time"""
+    return [stat(db_directory).st_mtime_ns, len(listdir(db_directory))]
+
+
+def _write_record(name: str, filename: str, data):
+    """Writes a JSON file to the directory of a database. The write changes the modification time of the directory
+    but adds no backup, so an index that was current before the write is kept current"""
+    db_directory = join(backup_location(), name)
+    before = _directory_state(db_directory)
+    path = join(db_directory, filename)
+    with open(path + '.part', 'w') as f:
+        dump(data, f, indent=1)
+    replace(path + '.part', path)
+    index = _read_index()
+    entry = index.get(name)
+    if entry and entry.get('state') == before:
+        entry['state'] = _directory_state(db_directory)
+        _write_index(index)
+
+
+def backup_index(name: str, index: dict = None) -> Dict[str, float]:
+    """Gets the backups of a database from the index in the backup location, which stores the time of each backup,
+    parsed once from its filename (or, if the filename does not contain one, taken from its modification time). The
+    directory of the database is only scanned again when its modification time or the number of files in it has
+    changed, and only the filenames that are not indexed yet are parsed. Catalog and change records are written
+    through _write_record, which keeps the index current
+
+    :param name: the name of the database
+    :param index: the loaded index, which is updated in place instead of being read and written
+    :return: a dict of timestamps, keyed by filename
+    """
+    db_directory = join(backup_location(), name)
+    if not exists(db_directory):
+        return {}
+    loaded = index if index is not None else _read_index()
+    entry = loaded.get(name, {'state': None, 'backups': {}})
+    state = _directory_state(db_directory)
+    if entry.get('state') == state:
+        return entry['backups']
+    backups = {}
+    with scandir(db_directory) as scan:
+        for x in scan:
+            if x.name in entry['backups']:
+                backups[x.name] = entry['backups'][x.name]
+            elif x.name.startswith(name + '_') and not x.name.endswith(('.part', '.copy')) and x.is_file():
+                time = backup_time(name, x.name)
+                backups[x.name] = time.timestamp() if time else x.stat().st_mtime
+    loaded[name] = {'state': state, 'backups': backups}
+    if index is None:
+        _write_index(loaded)
+    return backups
+
+
+def list_backups(name: str) -> List[str]:
+    """Gets the backups of a database, oldest first. Backups are ordered by the time in their filenames, or by their
+    modification time if the filename does not contain one
+
+    :param name: the name of the database
+    :return: a list of str representing the locations of the backups
+    """
+    db_directory = join(backup_location(), name)
+    backups = backup_index(name)
+    return [join(db_directory, x) for x in sorted(backups, key=lambda x: (backups[x], x))]
+
+
+def _periods(time: datetime) -> Dict[str, tuple]:
+    """Gets the hour, day, ISO week and month a backup belongs to"""
+    return {'hourly': (time.year, time.month, time.day, time.hour), 'daily': (time.year, time.month, time.day),
+            'weekly': time.isocalendar()[:2], 'monthly': (time.year, time.month)}
+
+
+def plan_retention(backups: Dict[str, float], last: int, tiers: Dict[str, int]) -> Tuple[List[str], List[str]]:
+    """Decides which backups a grandfather-father-son policy keeps, in a single pass from the newest backup to the
+    oldest. The newest 'last' backups are kept, and for each tier, the newest backup in each of the most recent
+    periods that have a backup, up to the number of periods of the tier. The newest backup is always kept
+
+    :param backups: a dict of timestamps, keyed by filename
+    :param last: the number of most recent backups to keep
+    :param tiers: a dict with the number of periods to keep for each of RETENTION_TIERS
+    :return: the filenames to keep and the filenames to delete, newest first
+    """
+    seen: Dict[str, set] = {tier: set() for tier in RETENTION_TIERS}
+    keep, delete = [], []
+    for i, filename in enumerate(sorted(backups, key=lambda x: (backups[x], x), reverse=True)):
+        kept = i < max(last, 1)
+        for tier, period in _periods(datetime.fromtimestamp(backups[filename])).items():
+            if period not in seen[tier] and len(seen[tier]) < tiers.get(tier, 0):
+                seen[tier].add(period)
+                kept = True
+        (keep if kept else delete).append(filename)
+    return keep, delete
+
+
+def prune_backups(name: str, last: int = None, tiers: Dict[str, int] = None) -> List[str]:
+    """Removes the backups of a database that the retention policy does not keep, along with their records in the
+    catalog. The backups to delete are worked out from the index, so no backup is read or examined, and then removed
+    together
+
+    :param name: the name of the database
+    :param last: the number of most recent backups to keep. Defaults to 'number of backups' in the config file
+    :param tiers: a dict with the number of hours, days, weeks and months to keep a backup for. Defaults to the tiers
+    in the config file
+    :return: the filenames of the removed backups
+    """
+    last = number_of_backups() if last is None else last
+    tiers = retention_tiers() if tiers is None else tiers
+    index = _read_index()
+    backups = backup_index(name, index)
+    _, delete = plan_retention(backups, last, tiers)
+    db_directory = join(backup_location(), name)
+    for filename in delete:
+        try:
+            remove(join(db_directory, filename))
+        except FileNotFoundError:
+            pass
+        del backups[filename]
+    if delete:
+        index[name]['state'] = _directory_state(db_directory)
+    _write_index(index)
+    if delete:
+        catalog = join(db_directory, CATALOG_NAME)
+        if exists(catalog):
+            removed = set(delete)
+            with open(catalog, 'r') as f:
+                records = load(f)
+            _write_catalog(name, [x for x in records if x['file'] not in removed])
+    return delete
+
+
+def run_backup(force: bool = False):
+    """Creates a new backup for each database in the config file that has changed since its last backup, compressed
+    with the codec set in the config file. The databases are backed up and compressed concurrently by a pool of
+    threads, and each backup is recorded in the catalog of its database. Unchanged databases are skipped, and the skip
+    is recorded
+
+    :param force: a bool indicating whether to back up databases that have not changed
     :return: either a 1 indicating successful backup or an error code
     """
     databases = all_databases()
     directory = backup_location()
+    codec = compression()
+    level = compression_level()
     if not exists(directory):
         makedirs(directory)
     try:
+        jobs: Dict[str, str] = {}
+        changes: Dict[str, dict] = {}
         for name in databases.keys():
             db_directory = join(directory, name)
             if not exists(db_directory):
                 mkdir(db_directory)
-            backups = list(scandir(db_directory))
-            num = number_of_backups()
-            backups.sort()
-            while len(backups) > num:
-                oldest = backups.pop(-1)
-                remove(oldest)
-            now = datetime.now().strftime('%Y-%m-%d-%-H-%-M-%S')
-            new = name + '_' + now
-            destination = join(db_directory, new)
-            copy(databases[name], destination)
+            changes[name] = database_changes(name, databases[name])
+            if not force and not changes[name]['changed'] and list_backups(name):
+                state = _read_changes(name)
+                # The database may only have been touched, so its signature is stored to avoid hashing it again
+                state['signature'] = changes[name]['signature'].to_list()
+                state['hash'] = changes[name]['hash']
+                state['skipped'] = state.get('skipped', 0) + 1
+                state['last skipped'] = datetime.now().isoformat()
+                _write_changes(name, state)
+                continue
+            jobs[name] = join(db_directory, _backup_name(name, db_directory, datetime.now()))
+        with ThreadPoolExecutor(max_workers=max(min(len(jobs), cpu_count() or 1), 1)) as pool:
+            futures = {name: pool.submit(_backup_one, databases[name], destination, codec, level)
+                       for name, destination in jobs.items()}
+        num, tiers = number_of_backups(), retention_tiers()
+        for name, future in futures.items():
+            record = future.result()
+            _write_catalog(name, [x for x in backup_catalog(name) if x['file'] != record['file']] + [record])
+            change = changes[name]
+            _write_changes(name, {'signature': change['signature'].to_list(), 'hash': change['hash'],
+                                  'bytes': change['bytes'], 'backed up': datetime.now().isoformat(), 'skipped': 0,
+                                  'last skipped': None})
+            # Only remove old backups once the new one exists
+            prune_backups(name, num, tiers)
         last_backup(datetime.now())
         return 1
     except PermissionError as err:
         return err
     except FileNotFoundError as err:
         return err
+    except Error as err:
+        return err
 
 
 def move_backup(new: str):
@@ -195,12 +724,179 @@ def backup_location(path: str = None):
     p = ConfigParser()
     p.read(CFG_PATH)
     if path is None:
-        v = p['Filesystem']['location']
+        v = p['Settings']['location']
         return abspath(v)
     elif exists(path) and isdir(path):
-        p['Filesystem']['location'] = abspath(path)
+        p['Settings']['location'] = abspath(path)
         with open(CFG_PATH, 'w') as f:
             p.write(f)
             f.close()
     else:
         raise IOError('Not a valid path to a directory')
+
+
+def pages_per_step(pages: int = None):
+    """If pages is supplied, edits the 'pages per step' field in the config file. Otherwise, returns the field
+
+    :param pages: an int indicating the number of database pages copied per step of a backup, or -1 for all of them
+    :return: an int indicating the number of database pages copied per step of a backup
+    """
+    if not exists(CFG_PATH):
+        _create_backup_config()
+    p = ConfigParser()
+    p.read(CFG_PATH)
+    if type(pages) == int:
+        p['Settings']['pages per step'] = str(pages)
+        with open(CFG_PATH, 'w') as f:
+            p.write(f)
+            f.close()
+    elif pages is None:
+        return p.getint('Settings', 'pages per step', fallback=256)
+
+
+def step_pause(seconds: Union[float, int] = None):
+    """If seconds is supplied, edits the 'step pause' field in the config file. Otherwise, returns the field
+
+    :param seconds: a float indicating the number of seconds to pause between steps of a backup
+    :return: a float indicating the number of seconds to pause between steps of a backup
+    """
+    if not exists(CFG_PATH):
+        _create_backup_config()
+    p = ConfigParser()
+    p.read(CFG_PATH)
+    if type(seconds) in [float, int]:
+        p['Settings']['step pause'] = str(seconds)
+        with open(CFG_PATH, 'w') as f:
+            p.write(f)
+            f.close()
+    elif seconds is None:
+        return p.getfloat('Settings', 'step pause', fallback=0.005)
+
+
+def compression(codec: str = None):
+    """If codec is supplied, edits the 'compression' field in the config file. Otherwise, returns the field
+
+    :param codec: a str indicating the codec backups are compressed with: 'none', 'gzip', 'bz2' or 'lzma'
+    :return: a str indicating the codec backups are compressed with
+    """
+    if not exists(CFG_PATH):
+        _create_backup_config()
+    p = ConfigParser()
+    p.read(CFG_PATH)
+    if codec is None:
+        return p.get('Settings', 'compression', fallback='none')
+    elif codec == 'none' or codec in CODECS.keys():
+        p['Settings']['compression'] = codec
+        with open(CFG_PATH, 'w') as f:
+            p.write(f)
+            f.close()
+    else:
+        raise KeyError('\'{}\' is not a valid codec. Allowed codecs are {}'.format(codec, ['none'] + list(CODECS)))
+
+
+def compression_level(level: int = None):
+    """If level is supplied, edits the 'compression level' field in the config file. Otherwise, returns the field,
+    limited to the range of the codec
+
+    :param level: an int indicating the compression level, from 0 (fastest) to 9 (smallest)
+    :return: an int indicating the compression level
+    """
+    if not exists(CFG_PATH):
+        _create_backup_config()
+    p = ConfigParser()
+    p.read(CFG_PATH)
+    if type(level) == int:
+        p['Settings']['compression level'] = str(level)
+        with open(CFG_PATH, 'w') as f:
+            p.write(f)
+            f.close()
+    elif level is None:
+        v = p.getint('Settings', 'compression level', fallback=6)
+        _, low, high = CODECS.get(compression(), (None, 0, 9))
+        return min(max(v, low), high)
+
+
+def hash_changes(option: str = None):
+    """If option is supplied, edits the 'hash changes' switch in the config file. Otherwise, returns its status
+
+    :param option: a str: 'yes' indicates that a database whose signature changed is hashed to confirm the change
+    :return: a str indicating whether changes are confirmed by hashing
+    """
+    if not exists(CFG_PATH):
+        _create_backup_config()
+    p = ConfigParser()
+    p.read(CFG_PATH)
+    if option in ['yes', 'no']:
+        p['Settings']['hash changes'] = option
+        with open(CFG_PATH, 'w') as f:
+            p.write(f)
+            f.close()
+    elif option is None:
+        return p.get('Settings', 'hash changes', fallback='no')
+
+
+def change_threshold(transactions: int = None):
+    """If transactions is supplied, edits the 'change threshold' field in the config file. Otherwise, returns the field
+
+    :param transactions: an int indicating the number of transactions committed to a database after which a backup is
+    required before the interval has passed, or 0 to disable
+    :return: an int indicating the number of transactions after which a backup is required
+    """
+    if not exists(CFG_PATH):
+        _create_backup_config()
+    p = ConfigParser()
+    p.read(CFG_PATH)
+    if type(transactions) == int:
+        p['Settings']['change threshold'] = str(transactions)
+        with open(CFG_PATH, 'w') as f:
+            p.write(f)
+            f.close()
+    elif transactions is None:
+        return p.getint('Settings', 'change threshold', fallback=0)
+
+
+def growth_threshold(kilobytes: int = None):
+    """If kilobytes is supplied, edits the 'growth threshold' field in the config file. Otherwise, returns the field
+
+    :param kilobytes: an int indicating the change in the size of a database, in KB, after which a backup is required
+    before the interval has passed, or 0 to disable
+    :return: an int indicating the change in size, in KB, after which a backup is required
+    """
+    if not exists(CFG_PATH):
+        _create_backup_config()
+    p = ConfigParser()
+    p.read(CFG_PATH)
+    if type(kilobytes) == int:
+        p['Settings']['growth threshold'] = str(kilobytes)
+        with open(CFG_PATH, 'w') as f:
+            p.write(f)
+            f.close()
+    elif kilobytes is None:
+        return p.getint('Settings', 'growth threshold', fallback=0)
+
+
+def retention_tiers(tiers: Dict[str, int] = None):
+    """If tiers is supplied, edits the 'keep hourly', 'keep daily', 'keep weekly' and 'keep monthly' fields in the
+    config file. Otherwise, returns the fields. Besides the newest 'number of backups' backups, the newest backup of
+    each of that many of the most recent hours, days, weeks and months is kept
+
+    :param tiers: a dict with an int for any of 'hourly', 'daily', 'weekly' and 'monthly', or 0 to disable the tier
+    :return: a dict with an int for each tier
+    """
+    if not exists(CFG_PATH):
+        _create_backup_config()
+    p = ConfigParser()
+    p.read(CFG_PATH)
+    if type(tiers) == dict:
+        for tier, number in tiers.items():
+            if tier not in RETENTION_TIERS:
+                raise KeyError('\'{}\' is not a valid retention tier. Allowed tiers are {}'.format(tier,
+                                                                                               RETENTION_TIERS))
+            if type(number) != int or number < 0:
+                raise ValueError('The number of backups kept for a tier must be a non-negative int')
+            p['Settings']['keep ' + tier] = str(number)
+        with open(CFG_PATH, 'w') as f:
+            p.write(f)
+            f.close()
+    elif tiers is None:
+        return {tier: p.getint('Settings', 'keep ' + tier, fallback=0) for tier in RETENTION_TIERS}
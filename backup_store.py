@@ -0,0 +1,268 @@
+"""Classes and functions for the incremental backup store. Each database file is split into fixed-size chunks, which
+are stored once under the hash of their contents, and each snapshot is a JSON manifest listing the chunks of the file.
+Sqlite changes a database in place, one page at a time, so a snapshot only stores the chunks holding pages that changed
+since any earlier snapshot, and a snapshot of an unchanged database stores nothing but its manifest"""
+from datetime import datetime
+from hashlib import blake2b
+from json import dump, load
+from os import makedirs, remove, replace, scandir
+from os.path import abspath, basename, exists, join
+from typing import List, Set, Tuple, Union
+
+from backup import Signature, backup_database, backup_location, database_signature, last_backup, \
+    number_of_backups
+from database import all_databases
+
+MANIFEST_VERSION = 1
+# A multiple of every sqlite page size, so that a changed page only ever changes one chunk
+CHUNK_SIZE = 1 << 18
+
+
+class Snapshot:
+    """A manifest of the backup store"""
+
+    def __init__(self, path: str):
+        self._path = path
+        with open(path, 'r') as f:
+            self._manifest: dict = load(f)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def database(self) -> str:
+        return self._manifest['database']
+
+    @property
+    def created(self) -> datetime:
+        return datetime.fromisoformat(self._manifest['created'])
+
+    @property
+    def size(self) -> int:
+        return self._manifest['size']
+
+    @property
+    def hash(self) -> str:
+        """The hash of the whole file"""
+        return self._manifest['hash']
+
+    @property
+    def chunk_size(self) -> int:
+        return self._manifest['chunk size']
+
+    @property
+    def chunks(self) -> List[str]:
+        return self._manifest['chunks']
+
+    @property
+    def signature(self) -> Signature:
+        return Signature(*self._manifest['signature'])
+
+    @property
+    def new_bytes(self) -> int:
+        """The number of bytes of chunks this snapshot added to the store"""
+        return self._manifest['new bytes']
+
+
+def store_location() -> str:
+    """Gets the location of the backup store, inside the backup location
+
+    :return: a str
+    """
+    return join(backup_location(), 'store')
+
+
+def _chunk_path(store: str, chunk: str) -> str:
+    return join(store, 'chunks', chunk[:2], chunk)
+
+
+def _snapshot_directory(store: str, name: str) -> str:
+    return join(store, 'snapshots', name)
+
+
+def _put_chunk(store: str, chunk: str, data: bytes) -> bool:
+    path = _chunk_path(store, chunk)
+    if exists(path):
+        return False
+    makedirs(join(store, 'chunks', chunk[:2]), exist_ok=True)
+    with open(path + '.part', 'wb') as f:
+        f.write(data)
+    replace(path + '.part', path)
+    return True
+
+
+def _store_file(path: str, store: str, chunk_size: int) -> Tuple[List[str], str, int, int]:
+    """Splits a file into chunks and adds the chunks that are not in the store yet
+
+    :return: the chunk hashes, the hash of the whole file, its size and the number of bytes added to the store
+    """
+    chunks, size, added = [], 0, 0
+    whole = blake2b()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(chunk_size), b''):
+            whole.update(data)
+            chunk = blake2b(data, digest_size=20).hexdigest()
+            chunks.append(chunk)
+            size += len(data)
+            if _put_chunk(store, chunk, data):
+                added += len(data)
+    return chunks, whole.hexdigest(), size, added
+
+
+def list_snapshots(name: str, store: str = None) -> List[Snapshot]:
+    """Gets the snapshots of a database, oldest first
+
+    :param name: the name of the database
+    :param store: the location of the backup store. Defaults to the store in the backup location
+    :return: a list of Snapshots
+    """
+    directory = _snapshot_directory(store if store else store_location(), name)
+    if not exists(directory):
+        return []
+    with scandir(directory) as scan:
+        snapshots = [Snapshot(x.path) for x in scan if x.name.endswith('.json')]
+    snapshots.sort(key=lambda x: x.created)
+    return snapshots
+
+
+def snapshot_database(name: str, path: str, store: str = None, chunk_size: int = CHUNK_SIZE,
+                      attempts: int = 3) -> Snapshot:
+    """Adds a snapshot of a database to the backup store. If the size, modification time and change counter of the
+    file are the same as at its last snapshot, the chunks of that snapshot are reused without reading the file.
+    Otherwise, a database in rollback journal mode is read directly and its change counter is compared, under a shared
+    lock, before and after reading, so that writers are never blocked; if it changed, the read is retried. A database
+    in WAL mode, or one that changed during every attempt, is first copied with backup_database
+
+    :param name: the name of the database
+    :param path: a str representing the location of the database
+    :param store: the location of the backup store. Defaults to the store in the backup location
+    :param chunk_size: the size of the chunks in bytes. Changing it means no chunks are shared with earlier snapshots
+    :param attempts: the number of direct reads to try before copying the database
+    :return: the new Snapshot
+    """
+    store = store if store else store_location()
+    directory = _snapshot_directory(store, name)
+    makedirs(directory, exist_ok=True)
+    previous = list_snapshots(name, store)
+    previous = previous[-1] if previous else None
+
+    signature = database_signature(path)
+    if previous is not None and previous.signature == signature and signature.counter >= 0 \
+            and previous.chunk_size == chunk_size:
+        chunks, whole, size, added = previous.chunks, previous.hash, previous.size, 0
+    else:
+        stored = None
+        for _ in range(attempts if not signature.wal else 0):
+            stored = _store_file(path, store, chunk_size)
+            after = database_signature(path)
+            if after == signature:
+                break
+            signature, stored = after, None
+        if stored is None:
+            copy = join(store, '{}.copy'.format(name))
+            backup_database(path, copy)
+            try:
+                stored = _store_file(copy, store, chunk_size)
+            finally:
+                remove(copy)
+        chunks, whole, size, added = stored
+
+    now = datetime.now()
+    manifest = {'version': MANIFEST_VERSION, 'database': name, 'source': abspath(path),
+                'created': now.isoformat(), 'chunk size': chunk_size, 'size': size, 'hash': whole,
+                'signature': signature.to_list(), 'new bytes': added, 'chunks': chunks}
+    destination = join(directory, '{}_{}.json'.format(name, now.strftime('%Y-%m-%d-%H-%M-%S-%f')))
+    with open(destination + '.part', 'w') as f:
+        dump(manifest, f)
+    replace(destination + '.part', destination)
+    return Snapshot(destination)
+
+
+def restore_snapshot(snapshot: Union[Snapshot, str], destination: str, store: str = None):
+    """Rebuilds a database file from a snapshot. The file is checked against the hash in the manifest before it
+    replaces the destination
+
+    :param snapshot: a Snapshot or the location of its manifest
+    :param destination: a str representing the location of the restored file
+    :param store: the location of the backup store. Defaults to the store in the backup location
+    """
+    snapshot = snapshot if isinstance(snapshot, Snapshot) else Snapshot(snapshot)
+    store = store if store else store_location()
+    partial = destination + '.part'
+    whole = blake2b()
+    try:
+        with open(partial, 'wb') as f:
+            for chunk in snapshot.chunks:
+                with open(_chunk_path(store, chunk), 'rb') as c:
+                    data = c.read()
+                whole.update(data)
+                f.write(data)
+        if whole.hexdigest() != snapshot.hash:
+            raise IOError('The restored file does not match snapshot \'{}\''.format(basename(snapshot.path)))
+    except BaseException:
+        if exists(partial):
+            remove(partial)
+        raise
+    replace(partial, destination)
+
+
+def prune_snapshots(name: str, keep: int, store: str = None) -> List[str]:
+    """Removes all but the newest 'keep' snapshots of a database. Their chunks stay in the store until
+    collect_garbage is called
+
+    :param name: the name of the database
+    :param keep: the number of snapshots to keep
+    :param store: the location of the backup store. Defaults to the store in the backup location
+    :return: the paths of the removed manifests
+    """
+    snapshots = list_snapshots(name, store)
+    removed = [x.path for x in snapshots[:max(len(snapshots) - keep, 0)]]
+    for path in removed:
+        remove(path)
+    return removed
+
+
+def collect_garbage(store: str = None) -> int:
+    """Removes the chunks that no snapshot refers to
+
+    :param store: the location of the backup store. Defaults to the store in the backup location
+    :return: the number of bytes freed
+    """
+    store = store if store else store_location()
+    used: Set[str] = set()
+    snapshots = join(store, 'snapshots')
+    if exists(snapshots):
+        with scandir(snapshots) as scan:
+            names = [x.name for x in scan if x.is_dir()]
+        for name in names:
+            for snapshot in list_snapshots(name, store):
+                used.update(snapshot.chunks)
+    freed = 0
+    chunks = join(store, 'chunks')
+    if not exists(chunks):
+        return freed
+    with scandir(chunks) as prefixes:
+        for prefix in [x.path for x in prefixes if x.is_dir()]:
+            with scandir(prefix) as scan:
+                unused = [x for x in scan if x.name not in used]
+            for entry in unused:
+                freed += entry.stat().st_size
+                remove(entry.path)
+    return freed
+
+
+def run_incremental_backup(store: str = None) -> List[Snapshot]:
+    """Adds a snapshot of each database in the config file to the backup store, keeps the newest 'number of backups'
+    snapshots of each and removes the chunks that are no longer used
+
+    :param store: the location of the backup store. Defaults to the store in the backup location
+    :return: the new Snapshots
+    """
+    snapshots = []
+    for name, path in all_databases().items():
+        snapshots.append(snapshot_database(name, path, store))
+        prune_snapshots(name, number_of_backups(), store)
+    collect_garbage(store)
+    last_backup(datetime.now())
+    return snapshots
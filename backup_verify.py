@@ -0,0 +1,163 @@
+"""Functions for verifying backups and restoring verified backups. Each backup is checked with 'PRAGMA quick_check' or
+'PRAGMA integrity_check' in a pool of worker processes, decompressing it first if needed, and the result is recorded in
+a manifest in the backup directory of its database. A backup whose size and modification time have not changed since
+it passed a check is not checked again, so verifying after every backup only checks the new backups"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from json import load
+from os import cpu_count, remove, replace, stat
+from os.path import basename, exists, join
+from pathlib import Path
+from sqlite3 import connect
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, Iterable, List, Union
+
+from backup import _codec_of, _write_record, backup_location, list_backups, restore_backup
+from database import all_databases
+
+VERIFICATION_NAME = 'verification.json'
+CHECK_MODES = ['quick', 'full']
+
+# The number of problems kept from the output of a check
+_MAX_ERRORS = 20
+
+
+def _check(path: str, full: bool) -> List[str]:
+    connection = connect(Path(path).as_uri() + '?mode=ro&immutable=1', uri=True)
+    try:
+        pragma = 'integrity_check' if full else 'quick_check'
+        return [x[0] for x in connection.execute('PRAGMA {}({})'.format(pragma, _MAX_ERRORS))]
+    finally:
+        connection.close()
+
+
+def verify_backup(path: str, full: bool = False) -> dict:
+    """Checks one backup. Compressed backups are decompressed to a temporary file first
+
+    :param path: a str representing the location of the backup
+    :param full: a bool indicating whether to run 'integrity_check' rather than the faster 'quick_check'
+    :return: a dict with the keys 'file', 'size', 'mtime', 'mode', 'ok', 'errors', 'checked' and 'seconds'
+    """
+    start = perf_counter()
+    status = stat(path)
+    result = {'file': basename(path), 'size': status.st_size, 'mtime': status.st_mtime_ns,
+              'mode': CHECK_MODES[full], 'ok': False, 'errors': [], 'checked': datetime.now().isoformat()}
+    try:
+        if _codec_of(path):
+            with TemporaryDirectory() as directory:
+                copy = join(directory, 'backup')
+                restore_backup(path, copy)
+                errors = _check(copy, full)
+        else:
+            errors = _check(path, full)
+        result['ok'] = errors == ['ok']
+        result['errors'] = [] if result['ok'] else errors
+    except Exception as error:
+        result['errors'] = [str(error)]
+    result['seconds'] = perf_counter() - start
+    return result
+
+
+def _manifest_path(name: str) -> str:
+    return join(backup_location(), name, VERIFICATION_NAME)
+
+
+def verification_manifest(name: str) -> Dict[str, dict]:
+    """Gets the latest check of each backup of a database that still exists
+
+    :param name: the name of the database
+    :return: a dict of the results of verify_backup, keyed by filename
+    """
+    path = _manifest_path(name)
+    if not exists(path):
+        return {}
+    with open(path, 'r') as f:
+        manifest: Dict[str, dict] = load(f)
+    directory = join(backup_location(), name)
+    return {k: v for k, v in manifest.items() if exists(join(directory, k))}
+
+
+def _write_manifest(name: str, manifest: Dict[str, dict]):
+    _write_record(name, VERIFICATION_NAME, manifest)
+
+
+def _is_current(result: dict, path: str, full: bool) -> bool:
+    """Checks whether a passed check still applies to a backup"""
+    if not result or not result['ok'] or (full and result['mode'] != 'full'):
+        return False
+    status = stat(path)
+    return result['size'] == status.st_size and result['mtime'] == status.st_mtime_ns
+
+
+def verify_backups(names: Iterable[str] = None, full: bool = False, recheck: bool = False,
+                   workers: int = None) -> Dict[str, Dict[str, dict]]:
+    """Checks the backups of the databases in a pool of processes and records the results in the manifest of each
+    database. Backups that passed an equally thorough check and have not changed since are skipped
+
+    :param names: the names of the databases. Defaults to every database in the config file
+    :param full: a bool indicating whether to run 'integrity_check' rather than the faster 'quick_check'
+    :param recheck: a bool indicating whether to check backups that have already passed
+    :param workers: the number of processes. Defaults to the number of processors
+    :return: a dict of manifests, keyed by database name
+    """
+    names = list(names) if names is not None else list(all_databases().keys())
+    manifests = {name: verification_manifest(name) for name in names}
+    pending = [(name, path) for name in names for path in list_backups(name)
+               if recheck or not _is_current(manifests[name].get(basename(path)), path, full)]
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(workers or cpu_count() or 1, len(pending))) as pool:
+            futures = [(name, pool.submit(verify_backup, path, full)) for name, path in pending]
+            for name, future in futures:
+                result = future.result()
+                manifests[name][result['file']] = result
+    for name in {x[0] for x in pending}:
+        _write_manifest(name, manifests[name])
+    return manifests
+
+
+def latest_verified(name: str) -> Union[str, None]:
+    """Finds the newest backup of a database that passed its last check and has not changed since
+
+    :param name: the name of the database
+    :return: a str representing the location of the backup, or None if no backup is verified
+    """
+    manifest = verification_manifest(name)
+    for path in reversed(list_backups(name)):
+        result = manifest.get(basename(path))
+        if result and _is_current(result, path, result['mode'] == 'full'):
+            return path
+    return None
+
+
+def restore_verified(name: str, backup: str = None, destination: str = None) -> str:
+    """Replaces a database with a verified backup. The backup is decompressed or copied next to the database and then
+    swapped into place with os.replace, so the database is never left half-written. Journal files left by the
+    replaced database are removed first, so that sqlite does not apply them to the restored one. The database should
+    not be open while it is restored
+
+    :param name: the name of the database
+    :param backup: a str representing the location of the backup. Defaults to the newest verified backup
+    :param destination: a str representing the location of the database. Defaults to its location in the config file
+    :return: a str representing the location of the backup that was restored
+    """
+    if backup is None:
+        backup = latest_verified(name)
+        if backup is None:
+            raise FileNotFoundError('No verified backup of \'{}\' exists'.format(name))
+    else:
+        result = verification_manifest(name).get(basename(backup))
+        if not result or not _is_current(result, backup, result['mode'] == 'full'):
+            raise ValueError('\'{}\' has not been verified since it last changed'.format(basename(backup)))
+    if destination is None:
+        databases = all_databases()
+        if name not in databases:
+            raise KeyError('\'{}\' is not listed as a database'.format(name))
+        destination = databases[name]
+    staged = destination + '.restore'
+    restore_backup(backup, staged)
+    for suffix in ['-journal', '-wal', '-shm']:
+        if exists(destination + suffix):
+            remove(destination + suffix)
+    replace(staged, destination)
+    return backup
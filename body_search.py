@@ -0,0 +1,289 @@
+"""Functions for searching entry bodies with a trigram index. The index is an FTS5 table using the trigram tokenizer
+over the 'bodies' table, kept up to date by SQL triggers. Substring, regex and fuzzy searches first ask the index for
+the entries that contain the right trigrams, then verify only those candidates"""
+from collections import Counter
+from functools import lru_cache
+from re import compile as compile_regex, error as RegexError, Pattern
+from sqlite3 import Connection, OperationalError, sqlite_version_info
+from typing import List, Optional, Tuple
+
+TRIGRAM_TABLE = 'body_trigrams'
+
+_TABLE = 'CREATE VIRTUAL TABLE IF NOT EXISTS body_trigrams USING fts5(body, content=\'bodies\', ' \
+         'content_rowid=\'entry_id\', tokenize=\'trigram\')'
+
+_ADD_BODY = 'INSERT INTO body_trigrams(rowid, body) VALUES(NEW.entry_id, NEW.body);'
+_REMOVE_BODY = 'INSERT INTO body_trigrams(body_trigrams, rowid, body) VALUES(\'delete\', OLD.entry_id, OLD.body);'
+
+_TRIGGERS = {
+    'body_trigrams_insert': 'AFTER INSERT ON bodies BEGIN {} END'.format(_ADD_BODY),
+    'body_trigrams_delete': 'AFTER DELETE ON bodies BEGIN {} END'.format(_REMOVE_BODY),
+    'body_trigrams_update': 'AFTER UPDATE OF body ON bodies BEGIN {} {} END'.format(_REMOVE_BODY, _ADD_BODY)
+}
+
+# Characters with a special meaning in a regular expression
+_SPECIAL = set('.^$*+?{}[]()|\\')
+# Escaped characters that stand for themselves
+_ESCAPED_LITERALS = set('.^$*+?{}[]()|\\-/#&~ \'"')
+
+
+def has_trigram_index(connection: Connection) -> bool:
+    """Checks whether the trigram index and its triggers have been installed in the database
+
+    :param connection: an sqlite connection to a jurnl database
+    :return: True if the index and all triggers exist, else False
+    """
+    names = {x[0] for x in connection.execute('SELECT name FROM sqlite_master WHERE type IN (\'table\', \'trigger\')')}
+    return TRIGRAM_TABLE in names and names.issuperset(_TRIGGERS.keys())
+
+
+def trigram_index_supported() -> bool:
+    """Checks whether the sqlite library has the FTS5 trigram tokenizer, which was added in sqlite 3.34"""
+    return sqlite_version_info >= (3, 34, 0)
+
+
+def install_trigram_index(connection: Connection) -> bool:
+    """Creates the trigram index and the triggers that maintain it, then indexes the existing bodies. Does nothing if
+    they are already installed, or if the sqlite library is older than 3.34 or was built without FTS5; searches then
+    fall back to scanning the bodies
+
+    :param connection: an sqlite connection to a jurnl database
+    :return: True if the index is installed, else False
+    """
+    if has_trigram_index(connection):
+        return True
+    if not trigram_index_supported():
+        return False
+    try:
+        with connection:
+            connection.execute(_TABLE)
+            for name, body in _TRIGGERS.items():
+                connection.execute('CREATE TRIGGER IF NOT EXISTS {} {}'.format(name, body))
+    except OperationalError:
+        # FTS5 is not compiled in
+        return False
+    rebuild_trigram_index(connection)
+    return True
+
+
+def rebuild_trigram_index(connection: Connection):
+    """Re-indexes every body from the 'bodies' table
+
+    :param connection: an sqlite connection to a jurnl database
+    """
+    with connection:
+        connection.execute('INSERT INTO body_trigrams(body_trigrams) VALUES(\'rebuild\')')
+
+
+def _phrase(text: str) -> str:
+    return '"{}"'.format(text.replace('"', '""'))
+
+
+def _escape_like(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def substring_condition(expression: str, text: str, trigrams: bool = True,
+                        correlated: bool = False) -> Tuple[str, list]:
+    """Builds an SQL condition matching the entries whose bodies contain the text, ignoring case. Text of three or
+    more characters is looked up in the trigram index; shorter text, or any text when there is no index, becomes an
+    escaped LIKE pattern. A correlated condition tests only the body of the entry given by the expression, which is
+    cheaper than a lookup in the index when a single entry is being tested
+
+    :param expression: an SQL expression giving the entry id
+    :param text: the str to search for
+    :param trigrams: a bool indicating whether the database has the trigram index
+    :param correlated: a bool indicating whether to test only the body of the entry given by the expression
+    :return: the condition and its parameters
+    """
+    pattern = ['%{}%'.format(_escape_like(text))]
+    if correlated:
+        return 'EXISTS (SELECT 1 FROM bodies b WHERE b.entry_id = {} AND b.body LIKE ? ESCAPE \'\\\')' \
+            .format(expression), pattern
+    if len(text) >= 3 and trigrams:
+        return '{} IN (SELECT rowid FROM body_trigrams WHERE body_trigrams MATCH ?)'.format(expression), [_phrase(text)]
+    return '{} IN (SELECT entry_id FROM bodies WHERE body LIKE ? ESCAPE \'\\\')'.format(expression), pattern
+
+
+def substring_search(connection: Connection, text: str) -> List[int]:
+    """Finds the entries whose bodies contain the text, ignoring case. Text of three or more characters is looked up
+    in the trigram index; shorter text falls back to scanning the bodies
+
+    :param connection: an sqlite connection to a jurnl database
+    :param text: the str to search for
+    :return: a list of matching entry ids, in ascending order
+    """
+    if not text:
+        return [x[0] for x in connection.execute('SELECT entry_id FROM bodies ORDER BY entry_id')]
+    condition, params = substring_condition('entry_id', text, has_trigram_index(connection))
+    c = connection.execute('SELECT entry_id FROM bodies WHERE {} ORDER BY entry_id'.format(condition), params)
+    return [x[0] for x in c]
+
+
+@lru_cache(maxsize=64)
+def _compiled(pattern: str) -> Pattern:
+    return compile_regex(pattern)
+
+
+def _regexp(pattern: str, value: Optional[str]) -> bool:
+    return value is not None and _compiled(pattern).search(value) is not None
+
+
+def register_regexp(connection: Connection):
+    """Registers a REGEXP function on the connection, so that 'X REGEXP Y' is true when the Python regular
+    expression Y matches somewhere in X
+
+    :param connection: an sqlite connection
+    """
+    connection.create_function('REGEXP', 2, _regexp, deterministic=True)
+
+
+def required_literals(pattern: str) -> List[str]:
+    """Finds runs of literal characters that every match of the regular expression must contain. The analysis is
+    conservative: anything inside a group, character class or optional repetition is ignored, and a pattern with a
+    top-level alternation or verbose flag has no required literals
+
+    :param pattern: a str representing a Python regular expression
+    :return: a list of str
+    """
+    runs, run = [], ''
+    depth, i = 0, 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            i += 2
+            if depth == 0 and escaped in _ESCAPED_LITERALS:
+                run += escaped
+            else:
+                runs.append(run)
+                run = ''
+            continue
+        i += 1
+        if char == '[':
+            # Skip the class, including a leading ']' or '^]' and escaped characters
+            if pattern[i:i + 1] == '^':
+                i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+            runs.append(run)
+            run = ''
+        elif char == '(':
+            if pattern[i:i + 1] == '?' and depth == 0:
+                flags = pattern[i + 1:pattern.find(')', i)]
+                if 'x' in flags.split(':')[0]:
+                    return []
+            depth += 1
+            runs.append(run)
+            run = ''
+        elif char == ')':
+            depth = max(depth - 1, 0)
+            run = ''
+        elif char == '|' and depth == 0:
+            return []
+        elif char in '*?{':
+            # The preceding character may be absent
+            run = run[:-1]
+            runs.append(run)
+            run = ''
+            if char == '{':
+                i = pattern.find('}', i) + 1 or len(pattern)
+            elif pattern[i:i + 1] in ['?', '+']:
+                i += 1
+        elif char == '+':
+            runs.append(run)
+            run = ''
+            if pattern[i:i + 1] in ['?', '+']:
+                i += 1
+        elif char in _SPECIAL:
+            runs.append(run)
+            run = ''
+        elif depth == 0:
+            run += char
+    runs.append(run)
+    return [x for x in runs if x]
+
+
+def regex_search(connection: Connection, pattern: str, ignore_case: bool = False) -> List[int]:
+    """Finds the entries whose bodies match the regular expression. Literal runs of three or more characters that
+    every match must contain are looked up in the trigram index, and the expression is only run against those
+    candidates
+
+    :param connection: an sqlite connection to a jurnl database
+    :param pattern: a str representing a Python regular expression
+    :param ignore_case: a bool indicating whether the match should ignore case
+    :return: a list of matching entry ids, in ascending order
+    """
+    if ignore_case:
+        pattern = '(?i)' + pattern
+    try:
+        _compiled(pattern)
+    except RegexError as e:
+        raise ValueError('\'{}\' is not a valid regular expression: {}'.format(pattern, e))
+    register_regexp(connection)
+    literals = [x for x in required_literals(pattern) if len(x) >= 3]
+    if literals and has_trigram_index(connection):
+        c = connection.execute('SELECT rowid FROM body_trigrams WHERE body_trigrams MATCH ? AND body REGEXP ? '
+                               'ORDER BY rowid', (' AND '.join(_phrase(x) for x in literals), pattern))
+    else:
+        c = connection.execute('SELECT entry_id FROM bodies WHERE body REGEXP ? ORDER BY entry_id', (pattern,))
+    return [x[0] for x in c]
+
+
+def edit_distance(pattern: str, text: str, max_distance: int = None) -> int:
+    """Finds the smallest number of insertions, deletions and substitutions that turn the pattern into some substring
+    of the text (Sellers' algorithm)
+
+    :param pattern: the str to look for
+    :param text: the str to look in
+    :param max_distance: if supplied, the search stops as soon as a substring within this distance is found
+    :return: an int representing the distance
+    """
+    m = len(pattern)
+    column = list(range(m + 1))
+    best = m
+    for char in text:
+        previous, column[0] = column[0], 0
+        for i in range(1, m + 1):
+            current = column[i]
+            column[i] = min(current + 1, column[i - 1] + 1, previous + (pattern[i - 1] != char))
+            previous = current
+        if column[m] < best:
+            best = column[m]
+            if max_distance is not None and best <= max_distance:
+                break
+    return best
+
+
+def fuzzy_search(connection: Connection, text: str, max_distance: int = 1) -> List[int]:
+    """Finds the entries whose bodies contain the text with at most 'max_distance' edits, ignoring case. Each edit can
+    remove at most three of the text's trigrams, so only entries that share enough trigrams with the text are
+    checked. When the text is too short for that bound to exclude anything, every body is checked
+
+    :param connection: an sqlite connection to a jurnl database
+    :param text: the str to search for
+    :param max_distance: the maximum number of insertions, deletions and substitutions
+    :return: a list of matching entry ids, in ascending order
+    """
+    text = text.lower()
+    if max_distance < 0:
+        raise ValueError('The maximum distance cannot be negative')
+    if max_distance == 0:
+        return substring_search(connection, text)
+    trigrams = {text[i:i + 3] for i in range(len(text) - 2)}
+    needed = len(trigrams) - 3 * max_distance
+    if needed > 0 and has_trigram_index(connection):
+        hits = Counter()
+        for trigram in trigrams:
+            hits.update(x[0] for x in connection.execute('SELECT rowid FROM body_trigrams WHERE body_trigrams MATCH ?',
+                                                         (_phrase(trigram),)))
+        candidates = sorted(x for x, n in hits.items() if n >= needed)
+        rows = (connection.execute('SELECT entry_id, body FROM bodies WHERE entry_id=?', (x,)).fetchone()
+                for x in candidates)
+    else:
+        rows = connection.execute('SELECT entry_id, body FROM bodies ORDER BY entry_id')
+    return [entry_id for entry_id, body in rows
+            if body is not None and edit_distance(text, body.lower(), max_distance) <= max_distance]
@@ -0,0 +1,175 @@
+"""Functions for the bulk entry format, in which a whole journal is a single newline-delimited JSON (NDJSON) file with
+one entry per line. Attachments are either embedded as base64 or written as sidecar files next to the NDJSON file.
+Files are read and written one line at a time, so their size is not limited by memory"""
+from base64 import b64decode, b64encode
+from datetime import datetime
+from json import dumps, loads
+from os import makedirs
+from os.path import abspath, basename, commonpath, join, realpath
+from sqlite3 import Connection
+from typing import IO, Iterable, Iterator, List, Tuple, Union
+
+BULK_EXTENSION = 'ndjson'
+FORMAT_NAME = 'jurnl-ndjson'
+FORMAT_VERSION = 1
+ATTACHMENT_MODES = ['base64', 'sidecar']
+
+# The date format of '.mjef' files, also accepted when reading
+_MJEF_DATE = '%Y%m%d%H%M'
+
+
+def _sidecar_directory(path: str) -> str:
+    return path + '.attachments'
+
+
+def _encode_date(date) -> Union[str, None]:
+    if date is None or isinstance(date, str):
+        return date
+    return date.isoformat(sep=' ')
+
+
+def decode_date(value) -> Union[datetime, None]:
+    """Decodes an ISO 8601 date, or a date in the minute-resolution format of older '.mjef' files
+
+    :param value: a str, or None
+    :return: a datetime, or None if the value is empty
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, _MJEF_DATE)
+
+
+def header() -> str:
+    """The first line of a bulk file"""
+    return dumps({'format': FORMAT_NAME, 'version': FORMAT_VERSION})
+
+
+def encode_entry(date, body: str, tags: Iterable[str], attachments: Iterable[Tuple[str, bytes]] = (),
+                 mode: str = 'base64', sidecar: str = None, prefix: str = '') -> str:
+    """Encodes one entry as a line of the bulk format, without the trailing newline
+
+    :param date: a datetime or an ISO 8601 str representing the creation date
+    :param body: the body of the entry
+    :param tags: the tags of the entry
+    :param attachments: (filename, bytes) tuples
+    :param mode: 'base64' to embed attachments, or 'sidecar' to write them to files in 'sidecar'
+    :param sidecar: the directory sidecar files are written to
+    :param prefix: the name of the sidecar subdirectory for this entry, such as the entry id
+    :return: a str
+    """
+    if mode not in ATTACHMENT_MODES:
+        raise KeyError('\'{}\' is not a valid attachment mode. Allowed modes are {}'.format(mode, ATTACHMENT_MODES))
+    encoded = []
+    for name, data in attachments:
+        if mode == 'base64':
+            encoded.append({'name': name, 'data': b64encode(data).decode('ascii')})
+        else:
+            # Each entry gets its own directory, so attachments keep their filenames
+            relative = join(str(prefix), basename(name))
+            makedirs(join(sidecar, str(prefix)), exist_ok=True)
+            with open(join(sidecar, relative), 'wb') as f:
+                f.write(data)
+            encoded.append({'name': name, 'path': join(basename(sidecar), relative)})
+    tags = [x for x in tags if x and x != '(UNTAGGED)']
+    return dumps({'date': _encode_date(date), 'body': body or '', 'tags': tags, 'attachments': encoded},
+                 ensure_ascii=False)
+
+
+def _sidecar_path(directory: str, sidecar: str, path: str) -> str:
+    """Resolves a sidecar path from a bulk file, refusing paths that lead outside the sidecar directory"""
+    resolved = realpath(join(directory, path))
+    root = realpath(sidecar if sidecar else directory)
+    if commonpath([resolved, root]) != root:
+        raise ValueError('Attachment \'{}\' is outside the sidecar directory'.format(path))
+    return resolved
+
+
+def decode_entry(line: str, directory: str = '', sidecar: str = None) -> Union[dict, None]:
+    """Decodes one line of the bulk format into an entry for writer_functions.create_entries. Embedded attachments
+    become (filename, bytes) tuples and sidecar attachments become absolute paths
+
+    :param line: a str
+    :param directory: the directory of the bulk file, which sidecar paths are relative to
+    :param sidecar: the sidecar directory of the bulk file. Sidecar paths that lead outside it are refused; if it is
+    not supplied, paths that lead outside 'directory' are refused
+    :return: a dict, or None if the line is blank or the header
+    """
+    line = line.strip()
+    if not line:
+        return None
+    content = loads(line)
+    if not isinstance(content, dict):
+        raise ValueError('Expected a JSON object')
+    if content.get('format') == FORMAT_NAME:
+        if content.get('version', FORMAT_VERSION) > FORMAT_VERSION:
+            raise ValueError('Bulk format version {} is not supported'.format(content['version']))
+        return None
+    tags = content.get('tags') or []
+    if isinstance(tags, str):
+        tags = tags.split('|')
+    attachments = []
+    for attachment in content.get('attachments') or []:
+        if isinstance(attachment, str):
+            attachments.append(_sidecar_path(directory, sidecar, attachment))
+        elif 'data' in attachment:
+            attachments.append((attachment['name'], b64decode(attachment['data'])))
+        else:
+            attachments.append(_sidecar_path(directory, sidecar, attachment['path']))
+    return {'date': decode_date(content.get('date')), 'body': content.get('body') or '',
+            'tags': tuple(x for x in tags if x), 'attachments': tuple(attachments)}
+
+
+def read_entries(file: IO[str], directory: str = '', lines: bool = False) -> Iterator[tuple]:
+    """Reads entries from an open bulk file one line at a time. Lines that cannot be decoded are yielded as the
+    exception raised while decoding them, so that one bad line does not stop the rest of the file from being read.
+    Sidecar attachments must be inside the sidecar directory of the file, if the file has a name, or else inside
+    'directory'
+
+    :param file: a text file opened for reading
+    :param directory: the directory of the bulk file, which sidecar paths are relative to
+    :param lines: a bool indicating whether to include the text of each line
+    :return: an iterator of (line number, entry or exception) tuples, or of (line number, line, entry or exception)
+    tuples if 'lines' is True
+    """
+    name = getattr(file, 'name', None)
+    sidecar = _sidecar_directory(abspath(name)) if isinstance(name, str) else None
+    for number, line in enumerate(file, 1):
+        try:
+            entry = decode_entry(line, directory, sidecar)
+        except (ValueError, KeyError, TypeError) as error:
+            entry = error
+        if entry is not None:
+            yield (number, line, entry) if lines else (number, entry)
+
+
+def dump_entries(connection: Connection, path: str, ids: Iterable[int] = None, mode: str = 'base64') -> int:
+    """Writes entries from the database to a bulk file
+
+    :param connection: an sqlite connection to a jurnl database
+    :param path: a str representing the bulk file to write
+    :param ids: the entries to write, in order. Defaults to every entry, ordered by creation date
+    :param mode: 'base64' to embed attachments, or 'sidecar' to write them next to the bulk file
+    :return: the number of entries written
+    """
+    if ids is None:
+        ids = [x[0] for x in connection.execute('SELECT entry_id FROM dates ORDER BY created, entry_id')]
+    sidecar = _sidecar_directory(path)
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as file:
+        file.write(header() + '\n')
+        for journal_id in ids:
+            row = connection.execute('SELECT d.created, b.body FROM bodies b LEFT JOIN dates d ON d.entry_id = '
+                                     'b.entry_id WHERE b.entry_id=?', (journal_id,)).fetchone()
+            if row is None:
+                continue
+            tags = [x[0] for x in connection.execute('SELECT tag FROM tags WHERE entry_id=? ORDER BY tag',
+                                                     (journal_id,))]
+            attachments: List[Tuple[str, bytes]] = connection.execute(
+                'SELECT filename, file FROM attachments WHERE entry_id=? ORDER BY added, att_id',
+                (journal_id,)).fetchall()
+            file.write(encode_entry(row[0], row[1], tags, attachments, mode, sidecar, journal_id) + '\n')
+            count += 1
+    return count
@@ -2,10 +2,24 @@
 from configparser import ConfigParser
 from os import scandir, replace, getcwd, mkdir, remove
 from os.path import exists, isfile, isdir, basename, join
-from sqlite3 import connect, DatabaseError
+from sqlite3 import connect, DatabaseError, Connection
+
+from body_search import install_trigram_index
+from stats_tables import install_stats_tables
 
 CFG_PATH = join('.config', 'databases.conf')
 
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS dates_created ON dates(created)',
+    'CREATE INDEX IF NOT EXISTS dates_last_edit ON dates(last_edit)',
+    'CREATE INDEX IF NOT EXISTS dates_last_access ON dates(last_access)',
+    'CREATE INDEX IF NOT EXISTS tags_entry ON tags(entry_id, tag)',
+    'CREATE INDEX IF NOT EXISTS tags_tag ON tags(tag, entry_id)',
+    'CREATE INDEX IF NOT EXISTS attachments_entry ON attachments(entry_id)',
+    'CREATE INDEX IF NOT EXISTS relations_child ON relations(child)',
+    'CREATE INDEX IF NOT EXISTS relations_parent ON relations(parent)'
+]
+
 
 def create_database(path: str = 'default.jurnldb') -> None:
     """Creates a jurnldb database from the supplied path. If the path points to a file, a database will be created
@@ -24,8 +38,8 @@ def create_database(path: str = 'default.jurnldb') -> None:
     connection = connect(database=path)
     cursor = connection.cursor()
     cursor.execute('CREATE TABLE bodies(entry_id INTEGER PRIMARY KEY, body TEXT)')
-    cursor.execute('CREATE TABLE dates(entry_id INTEGER PRIMARY KEY, created TIMESTAMP, edited TIMESTAMP, '
-                   'accessed TIMESTAMP, FOREIGN KEY(entry_id) REFERENCES bodies(entry_id))')
+    cursor.execute('CREATE TABLE dates(entry_id INTEGER PRIMARY KEY, created TIMESTAMP, last_edit TIMESTAMP, '
+                   'last_access TIMESTAMP, FOREIGN KEY(entry_id) REFERENCES bodies(entry_id))')
     cursor.execute('CREATE TABLE attachments(att_id INTEGER PRIMARY KEY, entry_id INTEGER NOT NULL, '
                    'filename TEXT NOT NULL, file BLOB NOT NULL, added TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, '
                    'FOREIGN KEY(entry_id) REFERENCES bodies(entry_id))')
@@ -34,10 +48,24 @@ def create_database(path: str = 'default.jurnldb') -> None:
                    'FOREIGN KEY(parent) REFERENCES bodies(entry_id))')
     cursor.execute('CREATE TABLE tags(tag_id INTEGER PRIMARY KEY, entry_id INTEGER NOT NULL, tag TEXT '
                    'DEFAULT \'(UNTAGGED)\', FOREIGN KEY(entry_id) REFERENCES bodies(entry_id))')
+    create_indexes(connection)
+    install_stats_tables(connection)
+    install_trigram_index(connection)
     connection.close()
     add_database(path)
 
 
+def create_indexes(connection: Connection):
+    """Creates the indexes used by filter and reader queries: the date columns, and the foreign keys of the 'tags',
+    'attachments' and 'relations' tables. Indexes that already exist are left alone
+
+    :param connection: an sqlite connection to a jurnl database
+    """
+    for sql in INDEXES:
+        connection.execute(sql)
+    connection.commit()
+
+
 def is_database(path: str):
     """Checks whether the supplied path points to a journal database
 
@@ -56,7 +84,7 @@ def is_database(path: str):
         try:
             database = connect(path)
             names = set(database.execute('SELECT name FROM sqlite_master WHERE type=\'table\''))
-            if {('bodies',), ('dates',), ('attachments',), ('relations',), ('tags',)} == names:
+            if {('bodies',), ('dates',), ('attachments',), ('relations',), ('tags',)}.issubset(names):
                 is_ = True
                 message = ''
         except DatabaseError:
@@ -2,9 +2,136 @@
 from contextlib import closing
 from datetime import datetime
 from sqlite3 import connect, Connection
-from typing import Union, List
+from typing import Union, List, Dict, Tuple
 
 from database import default_database
+from stats_tables import has_stats_tables
+
+DATE_COLUMNS = {'creation': 'created', 'edit': 'last_edit', 'access': 'last_access'}
+
+
+def _to_datetime(value) -> Union[datetime, None]:
+    """Converts a timestamp returned by an aggregate query (which loses its declared type) back into a datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def _date_column(date_type: str) -> str:
+    try:
+        return DATE_COLUMNS[date_type]
+    except KeyError:
+        raise KeyError('\'{}\' is not a valid date type. Allowed types are {}'.format(date_type,
+                                                                                    list(DATE_COLUMNS.keys())))
+
+
+class JournalStats:
+    """Answers aggregate questions about a journal database using single aggregate queries. Results are memoized until
+    the database changes, which is detected through 'PRAGMA data_version' (commits by other connections) and the
+    connection's own change counter"""
+
+    def __init__(self, connection: Connection):
+        self._connection = connection
+        self._version = None
+        self._cache = {}
+
+    @property
+    def connection(self):
+        return self._connection
+
+    def _current_version(self) -> Tuple[int, int]:
+        data_version = self._connection.execute('PRAGMA data_version').fetchone()[0]
+        return data_version, self._connection.total_changes
+
+    def _memoized(self, key, compute):
+        version = self._current_version()
+        if version != self._version:
+            self._cache.clear()
+            self._version = version
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def invalidate(self):
+        """Drops all memoized results"""
+        self._cache.clear()
+        self._version = None
+
+    def _summary(self) -> dict:
+        row = self._connection.execute(
+            'SELECT MIN(created), MAX(created), MIN(last_edit), MAX(last_edit), MIN(last_access), MAX(last_access), '
+            'COUNT(*), (SELECT COUNT(DISTINCT tag) FROM tags WHERE tag != \'(UNTAGGED)\') FROM dates').fetchone()
+        return {
+            'oldest': {'creation': _to_datetime(row[0]), 'edit': _to_datetime(row[2]), 'access': _to_datetime(row[4])},
+            'newest': {'creation': _to_datetime(row[1]), 'edit': _to_datetime(row[3]), 'access': _to_datetime(row[5])},
+            'entries': row[6],
+            'tags': row[7]
+        }
+
+    def summary(self) -> dict:
+        """Gets the oldest and newest date of each date type, the number of entries and the number of distinct tags,
+        all in a single query
+
+        :return: a dict with the keys 'oldest', 'newest', 'entries' and 'tags'
+        """
+        return self._memoized('summary', self._summary)
+
+    def oldest(self, date_type: str = 'creation') -> Union[datetime, None]:
+        _date_column(date_type)
+        return self.summary()['oldest'][date_type]
+
+    def newest(self, date_type: str = 'creation') -> Union[datetime, None]:
+        _date_column(date_type)
+        return self.summary()['newest'][date_type]
+
+    def number_of_entries(self) -> int:
+        return self.summary()['entries']
+
+    def number_of_tags(self) -> int:
+        """Counts the distinct tags in the database, not including the '(UNTAGGED)' placeholder"""
+        return self.summary()['tags']
+
+    def year_range(self, date_type: str = 'creation') -> Union[Tuple[int, int], None]:
+        """Gets the years of the oldest and newest dates of the supplied type, or None if the database is empty"""
+        oldest, newest = self.oldest(date_type), self.newest(date_type)
+        if oldest is None:
+            return None
+        return oldest.year, newest.year
+
+    def per_year(self, date_type: str = 'creation') -> Dict[int, int]:
+        """Counts the entries in each year
+
+        :param date_type: one of 'creation', 'edit' or 'access'
+        :return: a dict of years and the number of entries in each
+        """
+        column = _date_column(date_type)
+        sql = 'SELECT CAST(strftime(\'%Y\', {0}) AS INTEGER), COUNT(*) FROM dates WHERE {0} IS NOT NULL ' \
+              'GROUP BY 1 ORDER BY 1'.format(column)
+        return self._memoized(('year', column), lambda: dict(self._connection.execute(sql).fetchall()))
+
+    def per_month(self, date_type: str = 'creation') -> Dict[Tuple[int, int], int]:
+        """Counts the entries in each month
+
+        :param date_type: one of 'creation', 'edit' or 'access'
+        :return: a dict of (year, month) pairs and the number of entries in each
+        """
+        column = _date_column(date_type)
+        sql = 'SELECT CAST(strftime(\'%Y\', {0}) AS INTEGER), CAST(strftime(\'%m\', {0}) AS INTEGER), COUNT(*) ' \
+              'FROM dates WHERE {0} IS NOT NULL GROUP BY 1, 2 ORDER BY 1, 2'.format(column)
+        return self._memoized(('month', column),
+                              lambda: {(y, m): n for y, m, n in self._connection.execute(sql).fetchall()})
+
+
+def get_database_path(connection: Connection) -> str:
+    """Gets the path of the file behind the connection's main database
+
+    :param connection: an sqlite connection to a jurnl database
+    :return: a str representing the path, or '' for an in-memory database
+    """
+    for _, name, path in connection.execute('PRAGMA database_list'):
+        if name == 'main':
+            return path
+    return ''
 
 
 def get_all_entry_ids(connection: Connection):
@@ -13,7 +140,7 @@ def get_all_entry_ids(connection: Connection):
 
 
 def get_all_tags(database: str = None):
-    """Gets all tags in the database
+    """Gets all tags in the database. Reads the 'tag_counts' summary table if it is installed
 
     :rtype: list
     :param database: a str representing the database that is being queried
@@ -21,8 +148,9 @@ def get_all_tags(database: str = None):
     """
     db = connect(database) if database else connect(default_database())
     with closing(db) as d:
-        t = set(d.execute('SELECT tag FROM tags ORDER BY tag').fetchall())
-        return [x[0] for x in t]
+        if has_stats_tables(d):
+            return [x[0] for x in d.execute('SELECT tag FROM tag_counts ORDER BY tag')]
+        return [x[0] for x in d.execute('SELECT DISTINCT tag FROM tags ORDER BY tag')]
 
 
 def get_all_creation_dates(connection: Connection) -> List[datetime]:
@@ -44,27 +172,17 @@ def get_all_access_dates(connection: Connection) -> List[datetime]:
 
 
 def get_oldest_date(connection: Connection, date_type: str = 'creation') -> Union[datetime, None]:
-    try:
-        if date_type == 'creation':
-            return get_all_creation_dates(connection)[0]
-        elif date_type == 'edit':
-            return get_all_edit_dates(connection)[0]
-        elif date_type == 'access':
-            return get_all_access_dates(connection)[0]
-    except IndexError:
+    if date_type not in DATE_COLUMNS:
         return None
+    sql = 'SELECT MIN({}) FROM dates'.format(DATE_COLUMNS[date_type])
+    return _to_datetime(connection.execute(sql).fetchone()[0])
 
 
 def get_newest_date(connection: Connection, date_type: str = 'creation') -> Union[datetime, None]:
-    try:
-        if date_type == 'creation':
-            return get_all_creation_dates(connection)[-1]
-        elif date_type == 'edit':
-            return get_all_edit_dates(connection)[-1]
-        elif date_type == 'access':
-            return get_all_access_dates(connection)[-1]
-    except IndexError:
+    if date_type not in DATE_COLUMNS:
         return None
+    sql = 'SELECT MAX({}) FROM dates'.format(DATE_COLUMNS[date_type])
+    return _to_datetime(connection.execute(sql).fetchone()[0])
 
 
 def get_all_children(database: str = None):
@@ -118,7 +236,8 @@ def get_number_of_entries(database: str = None):
 
 
 def get_years(database: str = None):
-    """Lists, in order, the years in which the database has entries
+    """Lists, in order, the years in which the database has entries. Reads the 'stats_by_day' summary table if it is
+    installed
 
     :rtype: list
     :param database: a Connection or str representing the database that is being queried
@@ -126,8 +245,11 @@ def get_years(database: str = None):
     """
     db = connect(database) if database else connect(default_database())
     with closing(db) as d:
-        years = list({x[0] for x in d.execute('SELECT year FROM dates')})
-        years.sort()
+        if has_stats_tables(d):
+            years = [x[0] for x in d.execute('SELECT DISTINCT year FROM stats_by_day ORDER BY year')]
+        else:
+            years = [x[0] for x in d.execute('SELECT DISTINCT CAST(strftime(\'%Y\', created) AS INTEGER) FROM dates '
+                                             'WHERE created IS NOT NULL ORDER BY 1')]
     return years
 
 
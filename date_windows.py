@@ -0,0 +1,152 @@
+"""A date filtering engine that loads one date column into a NumPy datetime64 array and evaluates date windows with
+vectorized comparisons, instead of running strftime on every row in sqlite"""
+from datetime import datetime
+from sqlite3 import Connection
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+from filter import FilterState, INTERVALS, DATE_SORT_TYPES, get_all_settings
+
+
+def window_mask(values: np.ndarray, low: int, high: int) -> np.ndarray:
+    """Tests each value against a window. If low is greater than high, the window wraps around (e.g. the hours 22
+    through 2)
+
+    :param values: an integer array
+    :param low: the lowest allowed value
+    :param high: the highest allowed value
+    :return: a bool array
+    """
+    if low <= high:
+        return (values >= low) & (values <= high)
+    return (values >= low) | (values <= high)
+
+
+class DateWindowIndex:
+    """Holds the entry ids and one date column of a database as NumPy arrays, sorted by entry id. The date components
+    (year, month, day, hour, minute and weekday) are computed on first use and cached. The arrays are reloaded when
+    the database changes"""
+
+    def __init__(self, connection: Connection, column: str = 'created'):
+        if column not in DATE_SORT_TYPES:
+            raise KeyError('\'{}\' is not a valid date column. Allowed columns are {}'.format(column,
+                                                                                            DATE_SORT_TYPES))
+        self._connection = connection
+        self._column = column
+        self._version = None
+        self._ids = np.array([], dtype=np.int64)
+        self._dates = np.array([], dtype='datetime64[us]')
+        self._components: Dict[str, np.ndarray] = {}
+        self.refresh()
+
+    @property
+    def column(self):
+        return self._column
+
+    @property
+    def ids(self) -> np.ndarray:
+        self.refresh()
+        return self._ids
+
+    @property
+    def dates(self) -> np.ndarray:
+        self.refresh()
+        return self._dates
+
+    def _current_version(self) -> Tuple[int, int]:
+        return self._connection.execute('PRAGMA data_version').fetchone()[0], self._connection.total_changes
+
+    def refresh(self, force: bool = False):
+        """Reloads the arrays if the database has changed since they were loaded
+
+        :param force: a bool indicating whether to reload even if nothing has changed
+        """
+        version = self._current_version()
+        if version == self._version and not force:
+            return
+        # Casting to TEXT stops PARSE_DECLTYPES connections from building a datetime object per row
+        rows = self._connection.execute('SELECT entry_id, CAST({0} AS TEXT) FROM dates WHERE {0} IS NOT NULL '
+                                        'ORDER BY entry_id'.format(self._column)).fetchall()
+        self._ids = np.fromiter((x[0] for x in rows), dtype=np.int64, count=len(rows))
+        self._dates = np.array([x[1] for x in rows], dtype='datetime64[us]')
+        self._components = {}
+        self._version = version
+
+    def component(self, name: str) -> np.ndarray:
+        """Gets one date component of every entry, computing it on first use. Weekdays follow sqlite's
+        strftime('%w'), in which 0 is Sunday
+
+        :param name: one of 'year', 'month', 'day', 'hour', 'minute' or 'weekday'
+        :return: an int64 array, aligned with 'ids'
+        """
+        self.refresh()
+        if name not in self._components:
+            dates = self._dates
+            if name == 'year':
+                values = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+            elif name == 'month':
+                values = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+            elif name == 'day':
+                values = (dates.astype('datetime64[D]') - dates.astype('datetime64[M]')).astype(np.int64) + 1
+            elif name == 'hour':
+                values = (dates - dates.astype('datetime64[D]')).astype('timedelta64[h]').astype(np.int64)
+            elif name == 'minute':
+                values = (dates - dates.astype('datetime64[h]')).astype('timedelta64[m]').astype(np.int64)
+            elif name == 'weekday':
+                # 1970-01-01 was a Thursday, which is 4 when Sunday is 0
+                values = (dates.astype('datetime64[D]').astype(np.int64) + 4) % 7
+            else:
+                raise KeyError('\'{}\' is not a date component'.format(name))
+            self._components[name] = values
+        return self._components[name]
+
+    def interval_mask(self, settings: dict) -> np.ndarray:
+        """Tests every entry against the 'low' and 'high' interval settings of each date component. Components whose
+        window covers every possible value are skipped
+
+        :param settings: a dict of filter settings
+        :return: a bool array, aligned with 'ids'
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        for name, _, lowest, highest in INTERVALS:
+            low, high = settings['low ' + name], settings['high ' + name]
+            if low == lowest and high == highest:
+                continue
+            mask &= window_mask(self.component(name), low, high)
+        return mask
+
+    def range_mask(self, lower: datetime, upper: datetime) -> np.ndarray:
+        """Tests every entry against a continuous date range, inclusive of both ends"""
+        dates = self.dates
+        return (dates >= np.datetime64(lower, 'us')) & (dates <= np.datetime64(upper, 'us'))
+
+    def settings_mask(self, settings: dict) -> np.ndarray:
+        """Tests every entry against the date settings, using a continuous range or intervals depending on the
+        'date range type' setting"""
+        if settings.get('date range type', 'continuous') == 'continuous':
+            lower = datetime(settings['low year'], settings['low month'], settings['low day'],
+                             settings['low hour'], settings['low minute'], 0, 0)
+            upper = datetime(settings['high year'], settings['high month'], settings['high day'],
+                             settings['high hour'], settings['high minute'], 59, 999999)
+            return self.range_mask(lower, upper)
+        return self.interval_mask(settings)
+
+    def select(self, mask: np.ndarray) -> np.ndarray:
+        """Gets the sorted entry ids selected by a mask. Sorted id arrays combine with other filters through
+        np.intersect1d(a, b, assume_unique=True), np.union1d or np.setdiff1d"""
+        return self.ids[mask]
+
+
+def from_dates(index: DateWindowIndex, state: Union[FilterState, dict] = None) -> np.ndarray:
+    """Evaluates the date filter of the filter state against the index
+
+    :param index: a DateWindowIndex over the column named by the 'date sort type' setting
+    :param state: a FilterState or a dict of filter settings. Defaults to the shared filter state
+    :return: an int64 array of matching entry ids, in ascending order
+    """
+    settings = state if isinstance(state, dict) else get_all_settings(state)
+    if settings['date sort type'] != index.column:
+        raise KeyError('The index is over \'{}\' but the filter sorts by \'{}\''.format(index.column,
+                                                                                      settings['date sort type']))
+    return index.select(index.settings_mask(settings))
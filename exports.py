@@ -0,0 +1,225 @@
+"""Functions for exporting entries to the exports location as '.mjef' files, a bulk ('.ndjson') file or a tar archive
+of '.mjef' files. The database is opened read-only and read in a single transaction, so an export is a consistent
+snapshot even while the journal is being written to. Entries are read in chunks and attachments one entry at a time,
+and at most a few chunks of files are waiting to be written, so memory use does not grow with the size of the
+journal"""
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime
+from io import BytesIO
+from json import dumps
+from os import makedirs
+from os.path import abspath, exists, join
+from pathlib import Path
+from sqlite3 import Connection, PARSE_DECLTYPES, connect
+from tarfile import TarFile, TarInfo
+from time import time
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from body_search import has_trigram_index
+from bulk_format import BULK_EXTENSION, encode_entry, header
+from configurations import exports_location
+from filter import FilterState
+from filter_compiler import compile_filter
+
+EXPORT_FORMATS = ['mjef', 'ndjson', 'tar']
+
+
+def _read_only(database: str) -> Connection:
+    return connect(Path(abspath(database)).as_uri() + '?mode=ro', uri=True, detect_types=PARSE_DECLTYPES)
+
+
+def _export_ids(connection: Connection, ids: Iterable[int] = None,
+                settings: Union[dict, FilterState] = None) -> List[int]:
+    if ids is not None:
+        return list(ids)
+    if settings is not None:
+        sql, params = compile_filter(settings, has_trigram_index(connection)).select()
+        return [x[0] for x in connection.execute(sql, params)]
+    return [x[0] for x in connection.execute('SELECT entry_id FROM dates ORDER BY created, entry_id')]
+
+
+def read_database_entries(connection: Connection, ids: List[int], chunk_size: int = 256) \
+        -> Iterator[Tuple[int, datetime, str, Tuple[str], List[Tuple[str, bytes]]]]:
+    """Reads entries in the given order. Dates, bodies and tags are read 'chunk_size' entries at a time, and
+    attachments are only read for the entry being yielded
+
+    :param connection: an sqlite connection to a jurnl database
+    :param ids: the entries to read. Ids that are not in the database are ignored
+    :param chunk_size: the number of entries read per query
+    :return: an iterator of (entry id, creation date, body, tags, (filename, bytes) attachments) tuples
+    """
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        marks = ','.join('?' * len(chunk))
+        rows = {x[0]: x[1:] for x in connection.execute(
+            'SELECT b.entry_id, d.created, b.body FROM bodies b LEFT JOIN dates d ON d.entry_id = b.entry_id '
+            'WHERE b.entry_id IN ({})'.format(marks), chunk)}
+        tags = {}
+        for journal_id, tag in connection.execute('SELECT entry_id, tag FROM tags WHERE entry_id IN ({}) '
+                                                  'ORDER BY tag'.format(marks), chunk):
+            if tag and tag != '(UNTAGGED)':
+                tags.setdefault(journal_id, []).append(tag)
+        attached = {x[0] for x in connection.execute('SELECT DISTINCT entry_id FROM attachments WHERE entry_id IN '
+                                                     '({})'.format(marks), chunk)}
+        for journal_id in chunk:
+            if journal_id not in rows:
+                continue
+            attachments = []
+            if journal_id in attached:
+                attachments = connection.execute('SELECT filename, file FROM attachments WHERE entry_id=? '
+                                                 'ORDER BY added, att_id', (journal_id,)).fetchall()
+            created, body = rows[journal_id]
+            yield journal_id, created, body or '', tuple(tags.get(journal_id, ())), attachments
+
+
+def encode_mjef(date, body: str, tags: Iterable[str], attachments: Iterable[str] = ()) -> bytes:
+    """Encodes an entry as the contents of a '.mjef' file
+
+    :param date: a datetime, written as an ISO 8601 str so that seconds and microseconds are kept, or None
+    :param body: the body of the entry
+    :param tags: the tags of the entry
+    :param attachments: the paths of the attachment files, relative to the '.mjef' file
+    :return: bytes
+    """
+    content = {'date': date.isoformat(sep=' ') if isinstance(date, datetime) else date or '', 'body': body,
+               'tags': '|'.join(tags), 'attachments': '|'.join(attachments)}
+    return dumps(content, ensure_ascii=False).encode('utf-8')
+
+
+def _attachment_names(stem: str, attachments: List[Tuple[str, bytes]]) -> List[str]:
+    """Places each attachment in the directory 'stem', numbering files that would have the same name"""
+    names, used = [], set()
+    for name, _ in attachments:
+        name = Path(name.replace('\\', '/')).name or 'attachment'
+        candidate, n = name, 1
+        while candidate in used:
+            n += 1
+            candidate = '{} ({}){}'.format(Path(name).stem, n, Path(name).suffix)
+        used.add(candidate)
+        names.append('{}/{}'.format(stem, candidate))
+    return names
+
+
+def _write_file(path: str, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_mjef(directory: str, stem: str, date, body: str, tags: Tuple[str], attachments: List[Tuple[str, bytes]]):
+    names = _attachment_names(stem, attachments)
+    if attachments:
+        makedirs(join(directory, stem), exist_ok=True)
+    for name, (_, data) in zip(names, attachments):
+        _write_file(join(directory, name), data)
+    _write_file(join(directory, stem + '.mjef'), encode_mjef(date, body, tags, names))
+
+
+def _drain(pending: deque, limit: int) -> List:
+    results = []
+    while len(pending) > limit:
+        results.append(pending.popleft().result())
+    return results
+
+
+def export_entries(database: str, export_format: str = 'mjef', ids: Iterable[int] = None,
+                   settings: Union[dict, FilterState] = None, destination: str = None, name: str = None,
+                   attachment_mode: str = 'base64', workers: int = 4, chunk_size: int = 256) -> Tuple[str, int]:
+    """Exports entries from the database. With the 'mjef' format, each entry becomes a numbered '.mjef' file in a new
+    directory, with its attachments in a subdirectory of the same name; the 'tar' format writes the same files to a
+    tar archive. The 'ndjson' format writes a single bulk file. Files are written by a pool of threads while the
+    database is read, except for tar archives, which can only be written in order
+
+    :param database: a str representing the location of the jurnl database
+    :param export_format: one of 'mjef', 'ndjson' or 'tar'
+    :param ids: the entries to export, in order
+    :param settings: a FilterState or a dict of filter settings whose results are exported, if 'ids' is not supplied.
+    If neither is supplied, every entry is exported, ordered by creation date
+    :param destination: the directory to export to. Defaults to the exports location
+    :param name: the name of the export, without an extension. Defaults to one based on the current time
+    :param attachment_mode: for the 'ndjson' format, 'base64' to embed attachments or 'sidecar' to write them as files
+    :param workers: the number of threads writing files
+    :param chunk_size: the number of entries read per query
+    :return: the path of the export and the number of entries exported
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise KeyError('\'{}\' is not a valid export format. Allowed formats are {}'.format(export_format,
+                                                                                          EXPORT_FORMATS))
+    destination = abspath(destination if destination else exports_location())
+    makedirs(destination, exist_ok=True)
+    name = name if name else 'jurnl-export-{}'.format(datetime.now().strftime('%Y%m%d-%H%M%S'))
+    path = join(destination, name)
+    if export_format == 'ndjson':
+        path += '.' + BULK_EXTENSION
+    elif export_format == 'tar':
+        path += '.tar'
+    if exists(path):
+        raise IOError('\'{}\' already exists'.format(path))
+
+    with closing(_read_only(database)) as connection:
+        connection.isolation_level = None
+        connection.execute('BEGIN')
+        try:
+            entries = read_database_entries(connection, _export_ids(connection, ids, settings), chunk_size)
+            if export_format == 'mjef':
+                count = _export_mjef(entries, path, workers, chunk_size)
+            elif export_format == 'ndjson':
+                count = _export_ndjson(entries, path, attachment_mode, workers, chunk_size)
+            else:
+                count = _export_tar(entries, path)
+        finally:
+            connection.execute('COMMIT')
+    return path, count
+
+
+def _export_mjef(entries: Iterator[tuple], directory: str, workers: int, chunk_size: int) -> int:
+    makedirs(directory)
+    count = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for count, (_, created, body, tags, attachments) in enumerate(entries, 1):
+            pending.append(pool.submit(_write_mjef, directory, '{:07d}'.format(count), created, body, tags,
+                                       attachments))
+            _drain(pending, chunk_size)
+        _drain(pending, 0)
+    return count
+
+
+def _export_ndjson(entries: Iterator[tuple], path: str, attachment_mode: str, workers: int, chunk_size: int) -> int:
+    sidecar = path + '.attachments'
+    count = 0
+    pending: deque = deque()
+    with open(path, 'w', encoding='utf-8', newline='\n') as file, ThreadPoolExecutor(max_workers=workers) as pool:
+        file.write(header() + '\n')
+        for journal_id, created, body, tags, attachments in entries:
+            future: Future = pool.submit(encode_entry, created, body, tags, attachments, attachment_mode, sidecar,
+                                         journal_id)
+            pending.append(future)
+            # Lines are written in order as they are encoded
+            for line in _drain(pending, chunk_size):
+                file.write(line + '\n')
+            count += 1
+        for line in _drain(pending, 0):
+            file.write(line + '\n')
+    return count
+
+
+def _add_file(archive: TarFile, name: str, data: bytes, mtime: float):
+    info = TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    archive.addfile(info, BytesIO(data))
+
+
+def _export_tar(entries: Iterator[tuple], path: str) -> int:
+    count = 0
+    now = time()
+    with TarFile(path, 'w') as archive:
+        for count, (_, created, body, tags, attachments) in enumerate(entries, 1):
+            stem = '{:07d}'.format(count)
+            names = _attachment_names(stem, attachments)
+            for name, (_, data) in zip(names, attachments):
+                _add_file(archive, name, data, now)
+            _add_file(archive, stem + '.mjef', encode_mjef(created, body, tags, names), now)
+    return count
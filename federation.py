@@ -0,0 +1,119 @@
+"""Classes and functions for running the same query against every registered database concurrently"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from heapq import merge
+from json import dumps
+from sqlite3 import Connection, connect, PARSE_DECLTYPES, PARSE_COLNAMES
+from threading import Lock
+from typing import Any, Callable, Dict, List, Tuple
+
+from database import all_databases, is_database
+from database_info import DATE_COLUMNS
+
+
+def _dates_for_ids(connection: Connection, ids: List[int], date_type: str) -> List[Tuple[datetime, int]]:
+    """Gets the date of the supplied type for each id, ordered by that date and then by id"""
+    column = DATE_COLUMNS[date_type]
+    sql = 'SELECT {0}, entry_id FROM dates WHERE entry_id IN (SELECT value FROM json_each(?)) ' \
+          'ORDER BY {0}, entry_id'.format(column)
+    return connection.execute(sql, (dumps(list(ids)),)).fetchall()
+
+
+class DatabaseFederation:
+    """Runs queries against a set of databases concurrently, keeping one connection per database. Each connection is
+    only ever used by one worker thread at a time
+
+    Queries are callables that take a Connection as their first argument, which is the convention used throughout
+    reader_functions, database_info and filter
+    """
+
+    def __init__(self, databases: Dict[str, str] = None, max_workers: int = None):
+        """
+        :param databases: a dict of database names and paths. Defaults to all referenced databases
+        :param max_workers: the number of worker threads. Defaults to one per database, up to 8
+        """
+        if databases is None:
+            databases = all_databases()
+        self._databases = {name: path for name, path in databases.items() if is_database(path)[0]}
+        self._connections: Dict[str, Connection] = {}
+        self._locks = {name: Lock() for name in self._databases.keys()}
+        workers = max_workers if max_workers else max(1, min(len(self._databases), 8))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='federation')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def databases(self):
+        return dict(self._databases)
+
+    def _connection(self, name: str) -> Connection:
+        if name not in self._connections:
+            self._connections[name] = connect(self._databases[name], detect_types=PARSE_DECLTYPES | PARSE_COLNAMES,
+                                              check_same_thread=False)
+        return self._connections[name]
+
+    def _run_one(self, name: str, query: Callable, args: tuple, kwargs: dict):
+        with self._locks[name]:
+            return query(self._connection(name), *args, **kwargs)
+
+    def run(self, query: Callable[..., Any], *args, **kwargs) -> Dict[str, Any]:
+        """Runs the query against every database concurrently
+
+        :param query: a callable taking a Connection as its first argument
+        :return: a dict of database names and the query's result for each
+        """
+        futures = {name: self._executor.submit(self._run_one, name, query, args, kwargs)
+                   for name in self._databases.keys()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def run_merged(self, query: Callable[..., Any], *args, **kwargs) -> List[Tuple[str, Any]]:
+        """Runs a query that returns a collection against every database and concatenates the results
+
+        :param query: a callable taking a Connection as its first argument and returning an iterable
+        :return: a list of (database name, item) pairs
+        """
+        results = self.run(query, *args, **kwargs)
+        return [(name, item) for name in results.keys() for item in results[name]]
+
+    def run_ordered(self, query: Callable[..., Any], *args, date_type: str = 'creation', reverse: bool = False,
+                    **kwargs) -> List[Tuple[str, int, datetime]]:
+        """Runs a query that returns entry ids against every database and merges the results into one list ordered
+        by date. Each database sorts its own ids in sqlite, and the sorted lists are merged without a global sort
+
+        :param query: a callable taking a Connection as its first argument and returning entry ids
+        :param date_type: one of 'creation', 'edit' or 'access'
+        :param reverse: a bool indicating whether the newest entries should come first
+        :return: a list of (database name, entry id, date) tuples
+        """
+        if date_type not in DATE_COLUMNS:
+            raise KeyError('\'{}\' is not a valid date type'.format(date_type))
+
+        def ordered(connection: Connection):
+            rows = _dates_for_ids(connection, query(connection, *args, **kwargs), date_type)
+            return rows[::-1] if reverse else rows
+
+        results = self.run(ordered)
+        streams = [[(date, name, entry_id) for date, entry_id in rows if date is not None]
+                   for name, rows in results.items()]
+        return [(name, entry_id, date) for date, name, entry_id in merge(*streams, reverse=reverse)]
+
+    def close(self):
+        """Waits for running queries to finish, then closes every connection"""
+        self._executor.shutdown(wait=True)
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
+
+
+def run_on_all_databases(query: Callable[..., Any], *args, **kwargs) -> Dict[str, Any]:
+    """Runs the query once against every referenced database
+
+    :param query: a callable taking a Connection as its first argument
+    :return: a dict of database names and the query's result for each
+    """
+    with DatabaseFederation() as federation:
+        return federation.run(query, *args, **kwargs)
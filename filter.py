@@ -1,58 +1,128 @@
 """Contains the classes and functions that allow for switch-type manipulation of filters"""
+from atexit import register
 from configparser import ConfigParser
 from datetime import datetime
-from os import makedirs
-from os.path import join, exists
+from os import makedirs, replace
+from os.path import join, exists, dirname
 from sqlite3 import Connection
-from typing import List
+from threading import Timer, RLock
+from typing import List, Tuple
 
-from database_info import get_all_entry_ids, get_all_creation_dates, get_all_edit_dates, get_all_access_dates
-from reader_functions import get_tags
+from body_search import substring_search
+from database_info import JournalStats
 
 FILTER_CFG_ROOT = '.config'
 FILTER_CFG_PATH = join(FILTER_CFG_ROOT, 'filters.conf')
 
+DATE_RANGE_TYPES = ['continuous', 'intervals']
+TAG_FILTER_TYPES = ['Contains One Of', 'Contains At Least', 'Contains Only', 'Untagged']
+DATE_SORT_TYPES = ['created', 'last_edit', 'last_access']
+
+# The options stored in each section of the filters configuration file
+SECTIONS = {
+    'Filters': ['date range type', 'tags filter type', 'date sort type'],
+    'Flags': ['has parent', 'has children', 'has attachments'],
+    'Datetimes': ['low year', 'high year', 'low month', 'high month', 'low day', 'high day', 'low hour', 'high hour',
+                  'low minute', 'high minute', 'low weekday', 'high weekday'],
+    'Strings': ['tags', 'body']
+}
+
+# The allowed range of each 'Datetimes' option, by the option's suffix
+_LIMITS = {'year': (1, 9999), 'month': (1, 12), 'day': (1, 31), 'hour': (0, 23), 'minute': (0, 59), 'weekday': (0, 6)}
+
+# The date components filtered by interval: (option suffix, strftime format, lowest value, highest value). Weekdays
+# follow sqlite's strftime('%w'), in which 0 is Sunday
+INTERVALS = [
+    ('year', '%Y', None, None),
+    ('month', '%m', 1, 12),
+    ('day', '%d', 1, 31),
+    ('hour', '%H', 0, 23),
+    ('minute', '%M', 0, 59),
+    ('weekday', '%w', 0, 6)
+]
+
+
+def _default_settings(connection: Connection = None) -> dict:
+    """Gets the default filter settings. The year range spans the entries in the database, if a connection is
+    supplied, and the current year otherwise"""
+    if connection:
+        l_year, h_year = get_years(connection)
+    else:
+        l_year = h_year = datetime.now().year
+    return {
+        'date range type': 'continuous',
+        'tags filter type': 'Contains One Of',
+        'date sort type': 'created',
+        'has parent': False,
+        'has children': False,
+        'has attachments': False,
+        'low year': l_year,
+        'high year': h_year,
+        'low month': 1,
+        'high month': 12,
+        'low day': 1,
+        'high day': 31,
+        'low hour': 0,
+        'high hour': 23,
+        'low minute': 0,
+        'high minute': 59,
+        'low weekday': 0,
+        'high weekday': 6,
+        'tags': [],
+        'body': ''
+    }
+
+
+def _write_settings(settings: dict, path: str = FILTER_CFG_PATH):
+    """Writes the settings to a temporary file and then moves it over the configuration file, so that the file is
+    never left partially written"""
+    parser = ConfigParser()
+    for section, options in SECTIONS.items():
+        parser.add_section(section)
+        for option in options:
+            value = settings[option]
+            if option == 'tags':
+                value = '||'.join(value)
+            elif section == 'Datetimes':
+                value = str(value) if option.endswith('year') or option.endswith('weekday') else f"{value:02d}"
+            parser.set(section, option, str(value))
+    directory = dirname(path)
+    if directory and not exists(directory):
+        makedirs(directory)
+    temp = path + '.tmp'
+    with(open(temp, 'w')) as file:
+        parser.write(file)
+        file.close()
+    replace(temp, path)
+
+
+def _read_settings(path: str = FILTER_CFG_PATH) -> dict:
+    """Reads the configuration file once. Options that are missing from the file keep their default values"""
+    settings = _default_settings()
+    parser = ConfigParser()
+    parser.read(path)
+    for section, options in SECTIONS.items():
+        if not parser.has_section(section):
+            continue
+        for option in options:
+            if not parser.has_option(section, option):
+                continue
+            if section == 'Flags':
+                settings[option] = parser.getboolean(section, option)
+            elif section == 'Datetimes':
+                settings[option] = parser.getint(section, option)
+            elif option == 'tags':
+                settings[option] = [x for x in parser.get(section, option).split('||') if x]
+            else:
+                settings[option] = parser.get(section, option)
+    return settings
+
 
 def _create_filters_config(connection: Connection = None):
     """Creates the config file which tracks filter settings
 
     """
-    parser = ConfigParser()
-    parser.add_section('Filters')
-    parser.set('Filters', 'date range type', 'continuous')
-    parser.set('Filters', 'tags filter type', 'Contains One Of')
-    parser.set('Filters', 'date sort type', 'created')
-
-    parser.add_section('Flags')
-    parser.set('Flags', 'has parent', 'False')
-    parser.set('Flags', 'has children', 'False')
-    parser.set('Flags', 'has attachments', 'False')
-
-    l_year, h_year = get_years(connection)
-    l_year = str(l_year)
-    h_year = str(h_year)
-
-    parser.add_section('Datetimes')
-    parser.set('Datetimes', 'low year', l_year)
-    parser.set('Datetimes', 'high year', h_year)
-    parser.set('Datetimes', 'low month', '01')
-    parser.set('Datetimes', 'high month', '12')
-    parser.set('Datetimes', 'low day', '01')
-    parser.set('Datetimes', 'high day', '31')
-    parser.set('Datetimes', 'low hour', '00')
-    parser.set('Datetimes', 'high hour', '23')
-    parser.set('Datetimes', 'low minute', '00')
-    parser.set('Datetimes', 'high minute', '59')
-    parser.set('Datetimes', 'low weekday', '0')
-    parser.set('Datetimes', 'high weekday', '6')
-
-    parser.add_section('Strings')
-    parser.set('Strings', 'tags', '')
-    parser.set('Strings', 'body', '')
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    _write_settings(_default_settings(connection))
 
 
 def check_vwm_config():
@@ -95,268 +165,243 @@ def _leap_year(year: int):
     return leap
 
 
-def set_date_range_type(rangetype: str):
-    check_vwm_config()
+def _validate(option: str, value):
+    """Checks that the value is allowed for the option and returns it in its stored form"""
+    if option == 'date range type':
+        allowed = DATE_RANGE_TYPES
+    elif option == 'tags filter type':
+        allowed = TAG_FILTER_TYPES
+    elif option == 'date sort type':
+        allowed = DATE_SORT_TYPES
+    elif option in SECTIONS['Flags']:
+        if type(value) not in [bool, int]:
+            raise TypeError('Argument is not of type bool.')
+        return bool(value)
+    elif option in SECTIONS['Datetimes']:
+        if type(value) != int:
+            raise TypeError('Argument is not of type int.')
+        low, high = _LIMITS[option.split(' ')[1]]
+        if not low <= value <= high:
+            raise ValueError('\'{}\' must be between {} and {}.'.format(option, low, high))
+        return value
+    elif option == 'tags':
+        if not all(isinstance(x, str) for x in value):
+            raise TypeError('Argument should be a collection of str.')
+        return list(dict.fromkeys(value))
+    elif option == 'body':
+        if type(value) != str:
+            raise TypeError('Argument is not of type str.')
+        return value
+    else:
+        raise KeyError('\'{}\' is not a filter setting.'.format(option))
+    if value not in allowed:
+        raise KeyError('\'{}\' is not a valid \'{}\'. Allowed values are {}'.format(value, option, allowed))
+    return value
+
+
+class FilterState:
+    """Holds every filter setting in memory. Changes are validated as they are made and written to the configuration
+    file once no further change has been made for 'delay' seconds, so that dragging a slider results in a single
+    write. Query functions take a FilterState instead of reading the file themselves"""
+
+    def __init__(self, settings: dict = None, path: str = FILTER_CFG_PATH, delay: float = 0.5):
+        """
+        :param settings: a dict of filter settings. Missing settings take their default values
+        :param path: a str representing the configuration file the state is saved to
+        :param delay: the number of seconds to wait after the last change before saving
+        """
+        self._settings = _default_settings()
+        self._path = path
+        self._delay = delay
+        self._timer = None
+        self._dirty = False
+        self._lock = RLock()
+        if settings:
+            for option, value in settings.items():
+                self._settings[option] = _validate(option, value)
+
+    @classmethod
+    def load(cls, path: str = FILTER_CFG_PATH, delay: float = 0.5) -> 'FilterState':
+        """Reads the state from a configuration file, creating the file if it does not exist
+
+        :param path: a str representing the configuration file
+        :param delay: the number of seconds to wait after the last change before saving
+        :return: a FilterState
+        """
+        if not exists(path):
+            _write_settings(_default_settings(), path)
+        return cls(_read_settings(path), path, delay)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def dirty(self):
+        """Whether there are changes that have not been saved yet"""
+        return self._dirty
+
+    @property
+    def settings(self) -> dict:
+        """A copy of every setting, in the form accepted by filter_compiler.compile_filter"""
+        with self._lock:
+            settings = dict(self._settings)
+        settings['tags'] = list(settings['tags'])
+        return settings
+
+    def __getitem__(self, option: str):
+        value = self._settings[option]
+        return list(value) if option == 'tags' else value
+
+    def set(self, option: str, value):
+        """Validates and changes one setting, then schedules a save
+
+        :param option: the name of the setting
+        :param value: the new value
+        """
+        self.update({option: value})
+
+    def update(self, values: dict):
+        """Validates and changes several settings at once, then schedules a save. If any value is invalid, none of
+        the settings are changed
+
+        :param values: a dict of setting names and values
+        """
+        validated = {option: _validate(option, value) for option, value in values.items()}
+        with self._lock:
+            self._settings.update(validated)
+            for side in ['low', 'high']:
+                if any(option.startswith(side) for option in validated.keys()):
+                    self._settings[side + ' day'] = _check_day_against_month(self._settings[side + ' day'],
+                                                                             self._settings[side + ' month'],
+                                                                             self._settings[side + ' year'])
+            self._dirty = True
+            self._schedule()
+
+    def _schedule(self):
+        if self._timer:
+            self._timer.cancel()
+        if self._delay <= 0:
+            self.save()
+        else:
+            self._timer = Timer(self._delay, self.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def save(self):
+        """Writes the settings to the configuration file immediately"""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            _write_settings(self._settings, self._path)
+            self._dirty = False
+
+    def flush(self):
+        """Saves the settings if there are unsaved changes"""
+        if self._dirty:
+            self.save()
+
+    def reset(self, connection: Connection = None):
+        """Restores the default settings. If a connection is supplied, the year range spans its entries"""
+        self.update(_default_settings(connection))
+
+
+_state = None
+
+
+def filter_state() -> FilterState:
+    """Gets the application's shared filter state, loading it from the configuration file the first time. Unsaved
+    changes are written when the interpreter exits
+
+    :return: a FilterState
+    """
+    global _state
+    if _state is None:
+        check_vwm_config()
+        _state = FilterState.load()
+        register(_state.flush)
+    return _state
 
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Filters', 'date range type', rangetype)
 
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+def set_date_range_type(rangetype: str):
+    filter_state().set('date range type', rangetype)
 
 
 def set_tags_filter_type(filtertype: str):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Filters', 'tags filter type', filtertype)
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('tags filter type', filtertype)
 
 
 def set_date_sort_type(sorttype: str):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Filters', 'date sort type', sorttype)
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('date sort type', sorttype)
 
 
 def set_child_flag(haschild: bool):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Flags', 'has child', str(haschild))
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('has children', haschild)
 
 
 def set_parent_flag(hasparent: bool):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Flags', 'has parent', str(hasparent))
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('has parent', hasparent)
 
 
 def set_attachments_flag(hasattachments: bool):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Flags', 'has attachments', str(hasattachments))
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('has attachments', hasattachments)
 
 
 def set_range_low_year(year: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    day = _check_day_against_month(parser.getint('Datetimes', 'low day'),
-                                   parser.getint('Datetimes', 'low month'),
-                                   year)
-    parser.set('Datetimes', 'high day', f"{day:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('low year', year)
 
 
 def set_range_high_year(year: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    day = _check_day_against_month(parser.getint('Datetimes', 'high day'),
-                                   parser.getint('Datetimes', 'high month'),
-                                   year)
-    parser.set('Datetimes', 'high day', f"{day:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('high year', year)
 
 
 def set_range_low_month(month: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    day = _check_day_against_month(parser.getint('Datetimes', 'low day'),
-                                   month,
-                                   parser.getint('Datetimes', 'low year'))
-    parser.set('Datetimes', 'high day', f"{day:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('low month', month)
 
 
 def set_range_high_month(month: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    day = _check_day_against_month(parser.getint('Datetimes', 'high day'),
-                                   month,
-                                   parser.getint('Datetimes', 'high year'))
-    parser.set('Datetimes', 'high day', f"{day:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('high month', month)
 
 
 def set_range_low_day(day: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    day = _check_day_against_month(day,
-                                   parser.getint('Datetimes', 'high month'),
-                                   parser.getint('Datetimes', 'high year'))
-    parser.set('Datetimes', 'high day', f"{day:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('low day', day)
 
 
 def set_range_high_day(day: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    day = _check_day_against_month(day,
-                                   parser.getint('Datetimes', 'high month'),
-                                   parser.getint('Datetimes', 'high year'))
-    parser.set('Datetimes', 'high day', f"{day:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('high day', day)
 
 
 def set_range_low_hour(hour: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Datetimes', 'low hour', f"{hour:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('low hour', hour)
 
 
 def set_range_high_hour(hour: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Datetimes', 'high hour', f"{hour:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('high hour', hour)
 
 
 def set_range_low_minute(minute: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Datetimes', 'low minute', f"{minute:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('low minute', minute)
 
 
 def set_range_high_minute(minute: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Datetimes', 'high minute', f"{minute:02d}")
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('high minute', minute)
 
 
 def set_range_low_weekday(weekday: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Datetimes', 'low weekday', str(weekday))
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('low weekday', weekday)
 
 
 def set_range_high_weekday(weekday: int):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Datetimes', 'high weekday', str(weekday))
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('high weekday', weekday)
 
 
 def set_filter_tags(tags: List[str]):
-    check_vwm_config()
-
-    try:
-        string = tags.pop(0)
-        for i in range(len(tags)):
-            string += '||'.join(tags[i])
-    except IndexError:
-        string = ''
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Strings', 'tags', string)
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('tags', tags)
 
 
 def set_filter_body(body: str):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    parser.set('Strings', 'body', body)
-
-    with(open(FILTER_CFG_PATH, 'w')) as file:
-        parser.write(file)
-        file.close()
+    filter_state().set('body', body)
 
 
 # TODO move to database_info.py
@@ -368,187 +413,167 @@ def get_years(connection: Connection, date_type: str = 'creation') -> [int, int]
     :param connection: an sqlite connection to a jurnl database
     :return:
     """
-    dates = None
+    if date_type not in ['creation', 'edit', 'access']:
+        date_type = 'creation'
     l_year = h_year = datetime.now().year
-    if date_type not in ['creation', 'edit', 'access'] or date_type == 'creation':
-        dates = get_all_creation_dates(connection)
-    elif date_type == 'edit':
-        dates = get_all_edit_dates(connection)
-    elif date_type == 'access':
-        dates = get_all_access_dates(connection)
-    if dates:
-        l_year = dates[0].year
-        h_year = dates[-1].year
+    years = JournalStats(connection).year_range(date_type)
+    if years:
+        l_year, h_year = years
     return l_year, h_year
 
 
-def get_filters_settings():
-    check_vwm_config()
+def _section_settings(section: str, state: FilterState = None) -> dict:
+    state = state if state else filter_state()
+    return {option: state[option] for option in SECTIONS[section]}
 
-    parser = ConfigParser()
-    filters = {}
-    for option in parser.options('Filters'):
-        filters[option] = parser.get('Filters', option)
-    return filters
 
+def get_filters_settings(state: FilterState = None):
+    return _section_settings('Filters', state)
 
-def get_flags_settings():
-    check_vwm_config()
 
-    parser = ConfigParser()
-    filters = {}
-    for option in parser.options('Flags'):
-        filters[option] = parser.getboolean('Flags', option)
-    return filters
+def get_flags_settings(state: FilterState = None):
+    return _section_settings('Flags', state)
 
 
-def get_datetimes_settings():
-    check_vwm_config()
+def get_datetimes_settings(state: FilterState = None):
+    return _section_settings('Datetimes', state)
 
-    parser = ConfigParser()
-    filters = {}
-    for option in parser.options('Datetimes'):
-        filters[option] = parser.getint('Datetimes', option)
-    return filters
 
+def get_strings_settings(state: FilterState = None):
+    return _section_settings('Strings', state)
 
-def get_strings_settings():
-    check_vwm_config()
 
-    parser = ConfigParser()
-    filters = {}
-    for option in parser.options('Strings'):
-        filters[option] = parser.getint('Strings', option)
-    return filters
+def interval_condition(expression: str, low: int, high: int) -> Tuple[str, list]:
+    """Builds an SQL condition for one date component. If low is greater than high, the window wraps around (e.g. the
+    hours 22 through 2)
+
+    :param expression: an SQL expression giving the component as an integer
+    :param low: the lowest allowed value
+    :param high: the highest allowed value
+    :return: the condition and its parameters
+    """
+    if low <= high:
+        return '{} BETWEEN ? AND ?'.format(expression), [low, high]
+    return '({0} >= ? OR {0} <= ?)'.format(expression), [low, high]
+
+
+def tag_conditions(expression: str, filtertype: str, tags: List[str],
+                   correlated: bool = False) -> Tuple[List[str], list]:
+    """Builds the SQL conditions for a tag filter. 'Contains One Of' matches entries with any of the tags, 'Contains
+    At Least' those with all of them, 'Contains Only' those with at least one of the tags and no others, and
+    'Untagged' those without any tags. An empty tag list matches every entry, except for 'Untagged'
+
+    :param expression: an SQL expression giving the entry id
+    :param filtertype: one of the tag filter types
+    :param tags: a list of str representing tags
+    :param correlated: a bool indicating whether to build correlated subqueries, which only read the tags of the
+    entry being tested, instead of uncorrelated IN subqueries, which read the tags of every entry once per query
+    :return: the conditions and their parameters
+    """
+    tags = list(dict.fromkeys(tags))
+    if correlated:
+        rows = 'SELECT 1 FROM tags t WHERE t.entry_id = {} AND '.format(expression)
+        untagged = 'NOT EXISTS ({}t.tag != \'(UNTAGGED)\')'.format(rows)
+        any_of = 'EXISTS ({}t.tag IN ({{}}))'.format(rows)
+        all_of = '(SELECT COUNT(DISTINCT t.tag) FROM tags t WHERE t.entry_id = {} AND t.tag IN ({{}})) = ?' \
+            .format(expression)
+        others = 'NOT EXISTS ({}t.tag NOT IN ({{}}) AND t.tag != \'(UNTAGGED)\')'.format(rows)
+    else:
+        untagged = '{} NOT IN (SELECT entry_id FROM tags WHERE tag != \'(UNTAGGED)\')'.format(expression)
+        any_of = '{} IN (SELECT entry_id FROM tags WHERE tag IN ({{}}))'.format(expression)
+        all_of = '{} IN (SELECT entry_id FROM tags WHERE tag IN ({{}}) GROUP BY entry_id ' \
+                 'HAVING COUNT(DISTINCT tag) = ?)'.format(expression)
+        others = '{} NOT IN (SELECT entry_id FROM tags WHERE tag NOT IN ({{}}) AND tag != \'(UNTAGGED)\')' \
+            .format(expression)
+    if filtertype == 'Untagged':
+        return [untagged], []
+    if filtertype not in TAG_FILTER_TYPES:
+        raise KeyError('\'{}\' is not a valid tags filter type. Allowed types are {}'.format(filtertype,
+                                                                                           TAG_FILTER_TYPES))
+    if not tags:
+        return [], []
+    marks = ','.join(['?'] * len(tags))
+    if filtertype == 'Contains One Of':
+        return [any_of.format(marks)], tags
+    if filtertype == 'Contains At Least':
+        return [all_of.format(marks)], tags + [len(tags)]
+    return [any_of.format(marks), others.format(marks)], tags + tags
 
 
-def from_continuous_range(connection: Connection):
-    check_vwm_config()
+def get_all_settings(state: FilterState = None) -> dict:
+    """Gets every filter setting, converted to its proper type
 
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    sorttype = parser.get('Filters', 'date sort type')
+    :param state: a FilterState. Defaults to the shared filter state
+    :return: a dict of option names and values. 'Flags' are bools, 'Datetimes' are ints, 'tags' is a list of str and
+    all other options are str
+    """
+    return (state if state else filter_state()).settings
+
+
+def from_continuous_range(connection: Connection, state: FilterState = None):
+    state = state if state else filter_state()
+    sorttype = state['date sort type']
 
     lower = datetime(
-        parser.getint('Datetimes', 'low year'),
-        parser.getint('Datetimes', 'low month'),
-        parser.getint('Datetimes', 'low day'),
-        parser.getint('Datetimes', 'low hour'),
-        parser.getint('Datetimes', 'low minute'),
+        state['low year'],
+        state['low month'],
+        state['low day'],
+        state['low hour'],
+        state['low minute'],
         0,
         0)
     upper = datetime(
-        parser.getint('Datetimes', 'high year'),
-        parser.getint('Datetimes', 'high month'),
-        parser.getint('Datetimes', 'high day'),
-        parser.getint('Datetimes', 'high hour'),
-        parser.getint('Datetimes', 'high minute'),
+        state['high year'],
+        state['high month'],
+        state['high day'],
+        state['high hour'],
+        state['high minute'],
         59,
         999999)
-    c = connection.execute('SELECT entry_id FROM dates WHERE ? BETWEEN ? AND ?', (sorttype, lower, upper)).fetchall()
+    sql = 'SELECT entry_id FROM dates WHERE {} BETWEEN ? AND ?'.format(sorttype)
+    c = connection.execute(sql, (lower, upper)).fetchall()
     return [x[0] for x in c]
 
 
-def from_intervals(connection: Connection):
-    check_vwm_config()
+def from_intervals(connection: Connection, state: FilterState = None):
+    state = state if state else filter_state()
+    sorttype = state['date sort type']
 
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    sorttype = parser.get('Filters', 'date sort type')
-
-    c = connection.execute('SELECT entry_id FROM dates'
-                           'WHERE (strftime("%Y", ?) BETWEEN ? AND ?)'
-                           'AND (strftime("%m", ?) BETWEEN ? AND ?)'
-                           'AND (strftime("%d", ?) BETWEEN ? AND ?)'
-                           'AND (strftime("%H", ?) BETWEEN ? AND ?)'
-                           'AND (strftime("%M", ?) BETWEEN ? AND ?)'
-                           'AND (strftime("%w", ?) BETWEEN ? AND ?)',
-                           (sorttype,
-                            parser.get('Datetimes', 'low year'),
-                            parser.get('Datetimes', 'high year'),
-                            sorttype,
-                            parser.get('Datetimes', 'low month'),
-                            parser.get('Datetimes', 'high month'),
-                            sorttype,
-                            parser.get('Datetimes', 'low day'),
-                            parser.get('Datetimes', 'high day'),
-                            sorttype,
-                            parser.get('Datetimes', 'low hour'),
-                            parser.get('Datetimes', 'high hour'),
-                            sorttype,
-                            parser.get('Datetimes', 'low minute'),
-                            parser.get('Datetimes', 'high minute'),
-                            sorttype,
-                            parser.get('Datetimes', 'low weekday'),
-                            parser.get('Datetimes', 'high weekday'))
-                           )
+    conditions, params = [], []
+    for name, fmt, _, _ in INTERVALS:
+        expression = 'CAST(strftime(\'{}\', {}) AS INTEGER)'.format(fmt, sorttype)
+        condition, values = interval_condition(expression, state['low ' + name], state['high ' + name])
+        conditions.append(condition)
+        params += values
+    c = connection.execute('SELECT entry_id FROM dates WHERE {}'.format(' AND '.join(conditions)), params)
     return [x[0] for x in c]
 
 
-def from_tags(connection: Connection):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    filtertype = parser.get('Filters', 'tags filter type')
-    tags = parser.get('Strings', 'tags')
-    tags = tags.split('||')
-
-    ids = []
-
-    if filtertype == 'Contains One Of':
-        if tags:
-            tag = tags.pop(0)
-            sql = 'SELECT entry_id FROM tags WHERE tag=?'
-            temp = set(connection.execute(sql, (tag,)).fetchall())
-            for tag in tags:
-                temp = temp.intersection(connection.execute(sql, (tag,)).fetchall())
-            ids = [i[0] for i in temp]
-
-    if filtertype == 'Contains At Least':
-        for entry in get_all_entry_ids(connection):
-            if len(get_tags(entry, connection)) == len(tags):
-                if set(get_tags(entry, connection)).intersection(tags) == set(tags):
-                    ids.append(entry)
-
-    if filtertype == 'Contains Only':
-        sql = 'SELECT entry_id FROM tags WHERE tag IN ({})'.format(','.join(['?'] * len(tags)))
-        ids = list({x[0] for x in connection.execute(sql, tags).fetchall()})
-
-    if filtertype == 'Untagged':
-        cmd = 'SELECT entry_id FROM tags WHERE tag=\'(UNTAGGED)\''
-        ids = [x[0] for x in connection.execute(cmd).fetchall()]
-
-    return ids
+def from_tags(connection: Connection, state: FilterState = None):
+    state = state if state else filter_state()
+    conditions, params = tag_conditions('entry_id', state['tags filter type'], state['tags'])
+    sql = 'SELECT entry_id FROM dates'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    c = connection.execute(sql + ' ORDER BY entry_id', params)
+    return [x[0] for x in c]
 
 
-def from_body(connection: Connection):
-    check_vwm_config()
-
-    parser = ConfigParser()
-    parser.read(FILTER_CFG_PATH)
-    sql = 'SELECT entry_id FROM bodies WHERE body LIKE ?'
-    params = (f"%{parser.get('Strings', 'body').lower()}%",)
-    c = connection.execute(sql, params)
-    return [x[0] for x in c]
+def from_body(connection: Connection, state: FilterState = None):
+    state = state if state else filter_state()
+    return substring_search(connection, state['body'])
 
 
 def filter_by_has_attachments(connection: Connection):
-    check_vwm_config()
-
     ids = [x[0] for x in connection.execute('SELECT entry_id FROM attachments').fetchall()]
     return ids
 
 
 def filter_by_has_children(connection: Connection):
-    check_vwm_config()
-
     ids = [x[0] for x in connection.execute('SELECT parent FROM relations').fetchall()]
     return ids
 
 
 def filter_by_has_parent(connection: Connection):
-    check_vwm_config()
-
     ids = [x[0] for x in connection.execute('SELECT child FROM relations').fetchall()]
     return ids
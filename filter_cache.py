@@ -0,0 +1,127 @@
+"""A bounded cache of filter results. Results are keyed by a canonical hash of the filter settings and are only reused
+while the database is unchanged, as reported by 'PRAGMA data_version' and the connection's own change counter. Both
+counters belong to a single connection, so a result is only reused on the connection that produced it"""
+from collections import OrderedDict
+from hashlib import sha1
+from json import dumps
+from sqlite3 import Connection
+from sys import getsizeof
+from typing import Callable, Dict, Tuple, Union
+
+from database_info import get_database_path
+from filter import FilterState, get_all_settings
+from filter_compiler import run_filter
+
+# The approximate size of an int object holding an entry id
+_INT_SIZE = 28
+
+
+def settings_hash(settings: dict) -> str:
+    """Hashes filter settings in a canonical form, so that equal settings always produce the same hash regardless of
+    key or tag order. Accepts the settings from filters.conf as well as any other mapping of settings, such as the
+    fields of a ReaderFileManager
+
+    :param settings: a dict of filter settings
+    :return: a str representing the hash
+    """
+    canonical = dict(settings)
+    if 'tags' in canonical:
+        canonical['tags'] = sorted(canonical['tags'])
+    return sha1(dumps(canonical, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _version(connection: Connection) -> Tuple[int, int]:
+    return connection.execute('PRAGMA data_version').fetchone()[0], connection.total_changes
+
+
+class FilterResultCache:
+    """Keeps the results of recently used filters, evicting the least recently used result when the number of results
+    or their estimated size exceeds its limits"""
+
+    def __init__(self, max_results: int = 32, max_bytes: int = None, on_lookup: Callable[[bool, str], None] = None):
+        """
+        :param max_results: the maximum number of results to keep
+        :param max_bytes: the maximum estimated size of all results, or None for no limit
+        :param on_lookup: a callable that receives whether each lookup was a hit, and the settings hash
+        """
+        self._max_results = max_results
+        self._max_bytes = max_bytes
+        self._on_lookup = on_lookup
+        self._results: 'OrderedDict[tuple, Tuple[Connection, Tuple[int, int], Tuple[int, ...], int]]' = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    @property
+    def memory_usage(self) -> int:
+        """The estimated size of all cached results, in bytes"""
+        return self._bytes
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Gets the cache's counters
+
+        :return: a dict with the number of hits, misses and evictions, the hit rate, and the number and estimated size
+        of the cached results
+        """
+        lookups = self._hits + self._misses
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'hit rate': self._hits / lookups if lookups else 0.0,
+            'results': len(self._results),
+            'bytes': self._bytes
+        }
+
+    def get(self, connection: Connection, state: Union[FilterState, dict] = None, descending: bool = False,
+            limit: int = None) -> Tuple[int, ...]:
+        """Gets the ids matching the filter, running it only if it is not cached for the current database version. A
+        result cached through a different connection is never reused, since the version counters are per connection
+
+        :param connection: an sqlite connection to a jurnl database
+        :param state: a FilterState or a dict of filter settings. Defaults to the shared filter state
+        :param descending: a bool indicating whether the newest entries should come first
+        :param limit: the maximum number of ids to return, or None for no limit
+        :return: a tuple of entry ids, ordered by the 'date sort type' setting
+        """
+        settings = state if isinstance(state, dict) else get_all_settings(state)
+        digest = settings_hash(settings)
+        key = (get_database_path(connection), digest, descending, limit)
+        version = _version(connection)
+        cached = self._results.get(key)
+        hit = cached is not None and cached[0] is connection and cached[1] == version
+        if hit:
+            self._hits += 1
+            self._results.move_to_end(key)
+            ids = cached[2]
+        else:
+            self._misses += 1
+            ids = tuple(run_filter(connection, settings, limit, descending))
+            self._store(key, connection, version, ids)
+        if self._on_lookup:
+            self._on_lookup(hit, digest)
+        return ids
+
+    def _store(self, key: tuple, connection: Connection, version: Tuple[int, int], ids: Tuple[int, ...]):
+        self._discard(key)
+        size = getsizeof(ids) + _INT_SIZE * len(ids)
+        self._results[key] = (connection, version, ids, size)
+        self._bytes += size
+        while len(self._results) > self._max_results or (self._max_bytes is not None and
+                                                           self._bytes > self._max_bytes and len(self._results) > 1):
+            oldest = next(iter(self._results))
+            self._discard(oldest)
+            self._evictions += 1
+
+    def _discard(self, key: tuple):
+        cached = self._results.pop(key, None)
+        if cached is not None:
+            self._bytes -= cached[3]
+
+    def clear(self):
+        self._results.clear()
+        self._bytes = 0
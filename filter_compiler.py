@@ -0,0 +1,223 @@
+"""Compiles the filter settings into a single parameterized SQL statement, so that sqlite can evaluate every filter in
+one pass using its indexes instead of materializing and intersecting an id list per filter"""
+from datetime import datetime
+from sqlite3 import Connection
+from typing import List, Optional, Tuple, Union
+
+from body_search import has_trigram_index, substring_condition
+from database_info import DATE_COLUMNS
+from filter import get_all_settings, interval_condition, tag_conditions, FilterState, INTERVALS, DATE_SORT_TYPES
+
+SORT_COLUMNS = {x: x for x in DATE_SORT_TYPES}
+SORT_COLUMNS.update(DATE_COLUMNS)
+
+
+def sort_column(settings: dict) -> str:
+    """Gets the 'dates' column named by the 'date sort type' setting
+
+    :param settings: a dict of filter settings
+    :return: a str representing a column of the 'dates' table
+    """
+    sorttype = settings.get('date sort type', 'created')
+    try:
+        return SORT_COLUMNS[sorttype]
+    except KeyError:
+        raise KeyError('\'{}\' is not a valid date sort type. Allowed types are {}'.format(sorttype,
+                                                                                         list(SORT_COLUMNS.keys())))
+
+
+def _date_bounds(settings: dict) -> Optional[Tuple[datetime, datetime]]:
+    if settings.get('date range type', 'continuous') != 'continuous':
+        return None
+    lower = datetime(settings['low year'], settings['low month'], settings['low day'],
+                     settings['low hour'], settings['low minute'], 0, 0)
+    upper = datetime(settings['high year'], settings['high month'], settings['high day'],
+                     settings['high hour'], settings['high minute'], 59, 999999)
+    return lower, upper
+
+
+def _date_conditions(settings: dict, column: str) -> Tuple[List[str], list]:
+    if settings.get('date range type', 'continuous') == 'continuous':
+        return [], []
+
+    conditions, params = [], []
+    for name, fmt, lowest, highest in INTERVALS:
+        low, high = settings['low ' + name], settings['high ' + name]
+        if low == lowest and high == highest:
+            continue
+        expression = 'CAST(strftime(\'{}\', d.{}) AS INTEGER)'.format(fmt, column)
+        condition, values = interval_condition(expression, low, high)
+        conditions.append(condition)
+        params += values
+    return conditions, params
+
+
+def _tag_conditions(settings: dict, correlated: bool = False) -> Tuple[List[str], list]:
+    return tag_conditions('d.entry_id', settings.get('tags filter type', 'Contains One Of'), settings.get('tags', []),
+                          correlated)
+
+
+# The table and column each flag looks the entry up in
+_FLAGS = [('has attachments', 'attachments', 'entry_id'), ('has children', 'relations', 'parent'),
+          ('has parent', 'relations', 'child')]
+
+
+def _flag_conditions(settings: dict, correlated: bool = False) -> List[str]:
+    conditions = []
+    for option, table, column in _FLAGS:
+        if settings.get(option):
+            if correlated:
+                conditions.append('EXISTS (SELECT 1 FROM {0} WHERE {0}.{1} = d.entry_id)'.format(table, column))
+            else:
+                conditions.append('d.entry_id IN (SELECT {} FROM {})'.format(column, table))
+    return conditions
+
+
+def _conditions(settings: dict, column: str, trigrams: bool, correlated: bool) -> Tuple[List[str], list]:
+    conditions, params = _date_conditions(settings, column)
+    c, p = _tag_conditions(settings, correlated)
+    conditions += c
+    params += p
+    body = settings.get('body', '')
+    if body:
+        c, p = substring_condition('d.entry_id', body, trigrams, correlated)
+        conditions.append(c)
+        params += p
+    conditions += _flag_conditions(settings, correlated)
+    return conditions, params
+
+
+class CompiledFilter:
+    """A filter compiled into the FROM and WHERE clauses of a query over the 'dates' table, aliased as 'd'"""
+
+    def __init__(self, column: str, joins: List[str], conditions: List[str], params: list,
+                 bounds: Tuple[datetime, datetime] = None, entry_conditions: List[str] = None,
+                 entry_params: list = None):
+        self._column = column
+        self._joins = joins
+        self._conditions = conditions
+        self._params = params
+        self._bounds = bounds
+        self._entry_conditions = entry_conditions if entry_conditions is not None else conditions
+        self._entry_params = entry_params if entry_params is not None else params
+
+    @property
+    def column(self):
+        """The 'dates' column that results are ordered by"""
+        return self._column
+
+    @property
+    def conditions(self):
+        return self._range()[0] + self._conditions
+
+    @property
+    def params(self):
+        return self._range()[1] + self._params
+
+    def _range(self, after: Tuple[str, int] = None, descending: bool = False) -> Tuple[List[str], list]:
+        column = 'd.{}'.format(self._column)
+        if after is None:
+            if self._bounds is None:
+                return [], []
+            return ['{} BETWEEN ? AND ?'.format(column)], list(self._bounds)
+        key, entry_id = after
+        conditions = ['({}, d.entry_id) {} (?, ?)'.format(column, '<' if descending else '>')]
+        params = [key, entry_id]
+        if self._bounds is not None:
+            # sqlite seeks the index with only one bound per side, so the position is folded into the date range
+            lower, upper = self._bounds
+            if descending:
+                conditions.insert(0, '{} BETWEEN ? AND min(?, ?)'.format(column))
+                params = [lower, upper, key] + params
+            else:
+                conditions.insert(0, '{} BETWEEN max(?, ?) AND ?'.format(column))
+                params = [lower, key, upper] + params
+        return conditions, params
+
+    def select(self, columns: str = 'd.entry_id', conditions: List[str] = None, params: list = None,
+               descending: bool = False, limit: int = None, ordered: bool = True,
+               after: Tuple[str, int] = None) -> Tuple[str, list]:
+        """Builds the full statement
+
+        :param columns: the result columns
+        :param conditions: extra conditions, combined with the filter's conditions using AND
+        :param params: the parameters of the extra conditions
+        :param descending: a bool indicating whether the newest entries should come first
+        :param limit: the maximum number of rows, or None for no limit
+        :param ordered: a bool indicating whether to add the ORDER BY clause
+        :param after: a (date, entry id) position; only rows that come after it in the chosen order are selected
+        :return: the SQL statement and its parameters
+        """
+        where, values = self._range(after, descending)
+        where += self._conditions + (conditions if conditions else [])
+        sql = 'SELECT {} FROM dates d'.format(columns)
+        if self._joins:
+            sql += ' ' + ' '.join(self._joins)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        values += self._params + (list(params) if params else [])
+        if ordered:
+            direction = 'DESC' if descending else 'ASC'
+            sql += ' ORDER BY d.{0} {1}, d.entry_id {1}'.format(self._column, direction)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            values.append(limit)
+        return sql, values
+
+    def count(self) -> Tuple[str, list]:
+        return self.select(columns='COUNT(*)', ordered=False)
+
+    def select_entry(self, entry_id: int, columns: str = 'd.entry_id') -> Tuple[str, list]:
+        """Builds a statement that tests a single entry. Tag, body and flag filters are correlated subqueries that only
+        read the rows of that entry, so the cost does not grow with the size of the journal
+
+        :param entry_id: the entry to test
+        :param columns: the result columns
+        :return: the SQL statement and its parameters; the statement returns one row if the entry matches
+        """
+        where, values = self._range()
+        where += ['d.entry_id = ?'] + self._entry_conditions
+        sql = 'SELECT {} FROM dates d'.format(columns)
+        if self._joins:
+            sql += ' ' + ' '.join(self._joins)
+        return sql + ' WHERE ' + ' AND '.join(where), values + [entry_id] + self._entry_params
+
+
+def compile_filter(settings: Union[dict, FilterState] = None, trigrams: bool = True) -> CompiledFilter:
+    """Compiles the filter settings into one query. Date, tag, body and flag filters are combined with AND; tag and
+    flag filters become uncorrelated IN subqueries, which sqlite evaluates once into an ephemeral index (or answers
+    from the foreign key indexes) rather than once per row
+
+    'Contains One Of' matches entries with any of the tags, 'Contains At Least' those with all of them, 'Contains Only'
+    those with at least one of the tags and no others, and 'Untagged' those without any tags
+
+    :param settings: a FilterState or a dict of filter settings. Defaults to the shared filter state
+    :param trigrams: a bool indicating whether the database has the trigram index, which body searches of three or
+    more characters use
+    :return: a CompiledFilter
+    """
+    if settings is None or isinstance(settings, FilterState):
+        settings = get_all_settings(settings)
+    column = sort_column(settings)
+    conditions, params = _conditions(settings, column, trigrams, False)
+    entry_conditions, entry_params = _conditions(settings, column, trigrams, True)
+    return CompiledFilter(column, [], conditions, params, _date_bounds(settings), entry_conditions, entry_params)
+
+
+def run_filter(connection: Connection, settings: Union[dict, FilterState] = None, limit: int = None,
+               descending: bool = False) -> List[int]:
+    """Runs the compiled filter and returns the matching entry ids, ordered by the 'date sort type' setting
+
+    :param connection: an sqlite connection to a jurnl database
+    :param settings: a FilterState or a dict of filter settings. Defaults to the shared filter state
+    :param limit: the maximum number of ids to return, or None for no limit
+    :param descending: a bool indicating whether the newest entries should come first
+    :return: a list of entry ids
+    """
+    sql, params = compile_filter(settings, has_trigram_index(connection)).select(descending=descending, limit=limit)
+    return [x[0] for x in connection.execute(sql, params)]
+
+
+def count_filter(connection: Connection, settings: Union[dict, FilterState] = None) -> int:
+    sql, params = compile_filter(settings, has_trigram_index(connection)).count()
+    return connection.execute(sql, params).fetchone()[0]
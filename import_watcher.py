@@ -0,0 +1,308 @@
+"""Classes for watching the imports directory and importing '.mjef' files as soon as they are dropped into it. On Linux
+the directory is watched with inotify; elsewhere it is polled, and only listed again when the modification time of the
+directory changes. A new file is imported once its size and modification time have stopped changing for 'settle'
+seconds (and, with inotify, once the writer has closed it), together with any other files that are ready, in a
+single transaction"""
+import sys
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from os import close, read, scandir, stat, strerror
+from os.path import abspath, isfile, join
+from select import select
+from sqlite3 import Connection, Error, PARSE_DECLTYPES, connect
+from struct import calcsize, unpack_from
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable, Dict, List, Set, Tuple, Union
+
+from imports import check_imports_config, import_parsed, imports_extension, imports_location, known_hashes, \
+    parse_import_file
+
+# inotify flags, from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_EVENT = 'iIII'
+_IN_EVENT_SIZE = calcsize(_IN_EVENT)
+
+
+class _InotifyWatch:
+    """Reports the files created in or moved into a directory, using inotify"""
+
+    def __init__(self, directory: str):
+        self._libc = CDLL(find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(get_errno(), strerror(get_errno()))
+        mask = _IN_CREATE | _IN_MOVED_TO | _IN_MODIFY | _IN_CLOSE_WRITE
+        if self._libc.inotify_add_watch(self._fd, directory.encode(), mask) < 0:
+            error = get_errno()
+            close(self._fd)
+            raise OSError(error, strerror(error), directory)
+        self._directory = directory
+
+    def wait(self, timeout: float) -> Tuple[Set[str], Set[str], Set[str]]:
+        """Waits up to 'timeout' seconds for events
+
+        :return: the names of new files, of files that were written to and of files that were closed after writing.
+        If events were lost, the first set contains every file in the directory
+        """
+        created, changed, closed = set(), set(), set()
+        if not select([self._fd], [], [], timeout)[0]:
+            return created, changed, closed
+        data = read(self._fd, 1 << 16)
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = unpack_from(_IN_EVENT, data, offset)
+            name = data[offset + _IN_EVENT_SIZE:offset + _IN_EVENT_SIZE + length].rstrip(b'\0').decode()
+            offset += _IN_EVENT_SIZE + length
+            if mask & _IN_Q_OVERFLOW:
+                with scandir(self._directory) as scan:
+                    created.update(x.name for x in scan)
+            elif mask & _IN_MOVED_TO:
+                created.add(name)
+                closed.add(name)
+            elif mask & _IN_CREATE:
+                created.add(name)
+                changed.add(name)
+            elif mask & _IN_CLOSE_WRITE:
+                closed.add(name)
+            elif name:
+                changed.add(name)
+        return created, changed, closed
+
+    def close(self):
+        close(self._fd)
+
+
+class _PollingWatch:
+    """Reports the files created in or moved into a directory by comparing listings. The directory is only listed when
+    its modification time changes, which happens whenever a file is added, renamed or removed"""
+
+    def __init__(self, directory: str, stopped: Event):
+        self._directory = directory
+        self._stopped = stopped
+        self._mtime = stat(directory).st_mtime_ns
+        with scandir(directory) as scan:
+            self._names = {x.name for x in scan}
+
+    def wait(self, timeout: float) -> Tuple[Set[str], Set[str], Set[str]]:
+        self._stopped.wait(timeout)
+        mtime = stat(self._directory).st_mtime_ns
+        if mtime == self._mtime:
+            return set(), set(), set()
+        self._mtime = mtime
+        with scandir(self._directory) as scan:
+            names = {x.name for x in scan}
+        created, self._names = names - self._names, names
+        return created, set(), set()
+
+    def close(self):
+        pass
+
+
+def inotify_available() -> bool:
+    """Checks whether the directory can be watched with inotify"""
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(CDLL(find_library('c') or 'libc.so.6'), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class ImportWatcher:
+    """Watches a directory and imports the '.mjef' files dropped into it. Files that are already in the directory when
+    the watcher starts are imported first; after that, only new files are looked at. Files are imported in batches of
+    up to 'batch_size' entries and recorded in the import ledger, so a file is never imported twice. A file that cannot
+    be decoded yet, or whose attachments have not arrived, is retried until 'retry_timeout' seconds after it was first
+    seen, as is a batch that could not be written because the database was locked"""
+
+    def __init__(self, database: str, directory: str = None, settle: float = 0.25, interval: float = 0.1,
+                 batch_size: int = 200, retry_timeout: float = 10.0, use_inotify: bool = None,
+                 on_import: Callable[[List[int]], None] = None,
+                 on_error: Callable[[str, str], None] = None):
+        """
+        :param database: a str representing the location of the jurnl database. The watcher opens its own connection
+        :param directory: the directory to watch. Defaults to the imports location
+        :param settle: the number of seconds a file must stay unchanged before it is imported
+        :param interval: the longest time in seconds between checks of the directory
+        :param batch_size: the largest number of files imported in one transaction
+        :param retry_timeout: the number of seconds to keep retrying a file that is incomplete or missing attachments
+        :param use_inotify: a bool indicating whether to use inotify. Defaults to using it where available
+        :param on_import: a callable that receives the ids of the entries created by each batch
+        :param on_error: a callable that receives the path and the error for each file that could not be imported
+        """
+        check_imports_config()
+        self._database = database
+        self._directory = abspath(directory if directory else imports_location())
+        self._extension = '.' + imports_extension()
+        self._settle = settle
+        self._interval = interval
+        self._batch_size = batch_size
+        self._retry_timeout = retry_timeout
+        self._use_inotify = inotify_available() if use_inotify is None else use_inotify
+        self._on_import = on_import
+        self._on_error = on_error
+        self._stopped = Event()
+        self._thread: Union[Thread, None] = None
+        # path -> [size, modification time, time of the last change, time first seen, open for writing]
+        self._pending: Dict[str, list] = {}
+        self.ids: List[int] = []
+        self.skipped: List[str] = []
+        self.failed: List[Tuple[str, str]] = []
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def pending(self) -> List[str]:
+        """The files that have been seen but not yet imported"""
+        return sorted(self._pending)
+
+    def start(self):
+        """Starts watching in a background thread"""
+        if self.running:
+            return
+        self._stopped.clear()
+        self._thread = Thread(target=self.run, name='ImportWatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stops watching. Files that are not ready yet are left in the directory. May be called from another thread
+
+        :param timeout: the number of seconds to wait for the watcher to stop
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def run(self):
+        """Watches the directory until stop is called"""
+        connection = connect(self._database, detect_types=PARSE_DECLTYPES)
+        watch = _InotifyWatch(self._directory) if self._use_inotify else _PollingWatch(self._directory, self._stopped)
+        try:
+            known = known_hashes(connection)
+            with scandir(self._directory) as scan:
+                self._track({x.name for x in scan}, set(), set())
+            while not self._stopped.is_set():
+                timeout = min(self._interval, self._settle) if self._pending else self._interval
+                self._track(*watch.wait(timeout))
+                ready = self._ready()
+                for i in range(0, len(ready), self._batch_size):
+                    self._import(connection, ready[i:i + self._batch_size], known)
+        finally:
+            watch.close()
+            connection.close()
+
+    def _track(self, created: Set[str], changed: Set[str], closed: Set[str]):
+        now = monotonic()
+        for name in created:
+            if name.endswith(self._extension):
+                path = join(self._directory, name)
+                if path not in self._pending:
+                    self._pending[path] = [-1, -1, now, now, False]
+        for name in changed:
+            path = join(self._directory, name)
+            if path in self._pending:
+                self._pending[path][2] = now
+                self._pending[path][4] = True
+        for name in closed:
+            path = join(self._directory, name)
+            if path in self._pending:
+                self._pending[path][4] = False
+
+    def _ready(self) -> List[str]:
+        """Finds the pending files that have not changed for 'settle' seconds"""
+        now = monotonic()
+        ready = []
+        for path, state in list(self._pending.items()):
+            try:
+                status = stat(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            if (status.st_size, status.st_mtime_ns) != tuple(state[:2]):
+                state[:3] = status.st_size, status.st_mtime_ns, now
+            elif not state[4] and now - state[2] >= self._settle:
+                ready.append(path)
+        return sorted(ready)
+
+    def _import(self, connection: Connection, paths: List[str], known: Set[str]):
+        entries = []
+        now = monotonic()
+        for path in paths:
+            try:
+                entries.append(parse_import_file(path))
+                continue
+            except (FileNotFoundError, ValueError) as error:
+                if isfile(path):
+                    if self._retry(path, now):
+                        # The file may still be being written, or an attachment has not arrived yet, so wait for
+                        # it to settle again
+                        continue
+                    self._fail(path, str(error))
+            except (OSError, AttributeError) as error:
+                self._fail(path, str(error))
+            del self._pending[path]
+        if not entries:
+            return
+        try:
+            ids, skipped = import_parsed(connection, entries, known)
+        except (Error, OSError) as error:
+            # The database may be locked by another writer, or an attachment was removed after the file was parsed.
+            # The transaction was rolled back, so the files are tried again until 'retry_timeout' has passed
+            for entry in entries:
+                path = entry['path']
+                if not (isfile(path) and self._retry(path, now)):
+                    self._fail(path, str(error))
+                    del self._pending[path]
+            return
+        for entry in entries:
+            del self._pending[entry['path']]
+        self.ids.extend(ids)
+        self.skipped.extend(skipped)
+        if ids and self._on_import:
+            self._on_import(ids)
+
+    def _retry(self, path: str, now: float) -> bool:
+        """Waits for a file to settle again, if it was first seen less than 'retry_timeout' seconds ago"""
+        if now - self._pending[path][3] < self._retry_timeout:
+            self._pending[path][2] = now
+            return True
+        return False
+
+    def _fail(self, path: str, error: str):
+        self.failed.append((path, error))
+        if self._on_error:
+            self._on_error(path, error)
+
+
+def watch_imports(database: str, directory: str = None, **kwargs) -> ImportWatcher:
+    """Starts an ImportWatcher in a background thread
+
+    :param database: a str representing the location of the jurnl database
+    :param directory: the directory to watch. Defaults to the imports location
+    :param kwargs: further arguments for ImportWatcher
+    :return: the running ImportWatcher, which should be stopped with its 'stop' method
+    """
+    watcher = ImportWatcher(database, directory, **kwargs)
+    watcher.start()
+    return watcher
@@ -1,15 +1,32 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from configparser import ConfigParser
 from datetime import datetime
+from hashlib import blake2b
 from json import loads
-from os import makedirs, scandir, remove, mkdir, chdir
-from os.path import exists, abspath, isdir, join
+from os import makedirs, scandir, remove, mkdir, cpu_count
+from os.path import exists, abspath, basename, getsize, isdir, isfile, join, dirname
 from sqlite3 import Connection
+from threading import Event
+from time import perf_counter
+from typing import Callable, Iterable, List, Set, Tuple, Union
 
-from writer_functions import create_new_entry, set_body, set_date, set_tags, set_attachments
+from bulk_format import decode_date, read_entries
+from writer_functions import create_entries
 
 IMPORTS_CFG_ROOT = '.config'
 IMPORTS_CFG_PATH = join(IMPORTS_CFG_ROOT, 'imports.conf')
 
+_LEDGER = [
+    'CREATE TABLE IF NOT EXISTS import_ledger(hash TEXT PRIMARY KEY, entry_id INTEGER NOT NULL, source TEXT, '
+    'imported TIMESTAMP NOT NULL) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS import_ledger_entry ON import_ledger(entry_id)',
+    'CREATE TRIGGER IF NOT EXISTS import_ledger_delete AFTER DELETE ON bodies '
+    'BEGIN DELETE FROM import_ledger WHERE entry_id = OLD.entry_id; END',
+    'CREATE TABLE IF NOT EXISTS import_checkpoints(directory TEXT PRIMARY KEY, last_path TEXT NOT NULL, '
+    'updated TIMESTAMP NOT NULL) WITHOUT ROWID'
+]
+
 
 def _create_imports_config():
     """Creates the config file which tracks imports data
@@ -17,7 +34,7 @@ def _create_imports_config():
     """
     parser = ConfigParser()
     parser.add_section('Settings')
-    settings = {'location': 'Imports', 'autodelete': False, 'file extension': 'mjef'}
+    settings = {'location': 'Imports', 'autodelete': 'False', 'file extension': 'mjef'}
     for option in settings.keys():
         parser.set('Settings', option, settings[option])
     if not exists('.config'):
@@ -34,58 +51,335 @@ def check_imports_config():
         _create_imports_config()
 
 
-def import_entries(connection: Connection):
-    """Imports journal entries ('.mjef' files) and their associated attachments and creates a new entry in the db.
-    Removes the entry and its attachments, if successful.
+def install_import_ledger(connection: Connection):
+    """Creates the ledger of imported files, which maps the content hash of each file and its attachments to the entry
+    it was imported as, and the table of import checkpoints. Deleting the entry removes it from the ledger, so the
+    file can be imported again
 
+    :param connection: an sqlite connection to a jurnl database
     """
-    check_imports_config()
+    for sql in _LEDGER:
+        connection.execute(sql)
+    connection.commit()
 
-    autodelete = autodelete_imports()
 
-    chdir(imports_location())
-    scan = scandir()
+def known_hashes(connection: Connection) -> Set[str]:
+    """Reads every hash in the import ledger, creating the ledger if needed
 
-    for entry in scan:
-        if '.mjef' in entry.name:
-            with open(entry.path, 'r') as file:
-                string = file.read()
-                file.close()
-                content: dict = loads(string)
-            try:
-                date = content['date']
-                try:
-                    date = datetime.strptime(date, '%Y%m%d%H%M')
-                except ValueError:
-                    date = None
-
-                body = content['body']
+    :param connection: an sqlite connection to a jurnl database
+    :return: a set of str
+    """
+    install_import_ledger(connection)
+    return {x[0] for x in connection.execute('SELECT hash FROM import_ledger')}
 
-                tags = content['tags']
-                tags = tuple(tags.split('|'))
 
-                attachments = content['attachments']
-                attachments = attachments.split('|')
-                for i in range(len(attachments)):
-                    try:
-                        attachments[i] = abspath(attachments)
-                    except FileNotFoundError:
-                        pass
-                attachments = tuple(attachments)
+def _record_imports(entries: List[dict]) -> Callable[[Connection, List[int]], None]:
+    def record(connection: Connection, ids: List[int]):
+        now = datetime.now()
+        connection.executemany('INSERT OR REPLACE INTO import_ledger(hash, entry_id, source, imported) '
+                               'VALUES(?,?,?,?)', [(e['hash'], i, e.get('path'), now) for e, i in zip(entries, ids)])
+    return record
 
-                index = create_new_entry(connection)
-                set_date(index, connection, date)
-                set_body(index, body, connection)
-                set_tags(index, connection, tags)
-                set_attachments(index, attachments, connection)
 
-                if autodelete:
-                    remove(entry.path)
-                    for a in attachments:
-                        remove(a)
+def content_hash(data: bytes, attachments: Iterable[Union[str, Tuple[str, bytes]]] = ()) -> str:
+    """Hashes an import file together with its attachments, so that the same entry always has the same hash however
+    often it is exported or wherever its files are placed
 
-            except IndexError as error:
-                print(error)
+    :param data: the contents of the import file, or of one line of a bulk file
+    :param attachments: paths to attachment files, or (filename, bytes) tuples
+    :return: a str representing the hash
+    """
+    hasher = blake2b(data, digest_size=20)
+    for attachment in attachments:
+        if isinstance(attachment, tuple):
+            hasher.update(b'\0' + attachment[0].encode() + b'\0')
+            hasher.update(attachment[1])
+            continue
+        hasher.update(b'\0' + basename(attachment).encode() + b'\0')
+        with open(attachment, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(block)
+    return hasher.hexdigest()
+
+
+def parse_import_file(path: str) -> dict:
+    """Reads and decodes one '.mjef' file and hashes it. Attachment paths are resolved against the directory of the
+    file
+
+    :param path: a str representing the location of the file
+    :return: a dict with the keys 'path', 'hash', 'size' (of the file and its attachments, in bytes), 'date' (a
+    datetime or None), 'body', 'tags' and 'attachments'
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    content: dict = loads(data.decode('utf-8'))
+    try:
+        date = decode_date(content.get('date'))
+    except (TypeError, ValueError):
+        date = None
+    tags = tuple(x for x in (content.get('tags') or '').split('|') if x)
+    attachments = []
+    for name in (content.get('attachments') or '').split('|'):
+        if name:
+            attachment = abspath(join(dirname(path), name))
+            if not isfile(attachment):
+                raise FileNotFoundError('Attachment \'{}\' of \'{}\' does not exist'.format(name, path))
+            attachments.append(attachment)
+    return {'path': path, 'hash': content_hash(data, attachments), 'size': len(data) + sum(map(getsize, attachments)),
+            'date': date, 'body': content.get('body') or '', 'tags': tags, 'attachments': tuple(attachments)}
+
+
+def parse_import_files(paths: List[str]) -> List[Union[dict, Tuple[str, str]]]:
+    """Parses a batch of '.mjef' files. Files that cannot be parsed are returned as (path, error) tuples
+
+    :param paths: a list of str representing the locations of the files
+    :return: a list with a dict or a tuple for each path
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append(parse_import_file(path))
+        except (OSError, ValueError, AttributeError) as error:
+            results.append((path, str(error)))
+    return results
+
+
+def import_parsed(connection: Connection, entries: List[dict], known: Set[str] = None,
+                  autodelete: bool = None) -> Tuple[List[int], List[str]]:
+    """Inserts entries returned by parse_import_file in one transaction and records them in the import ledger. Entries
+    whose hash is already known are skipped
+
+    :param connection: an sqlite connection to a jurnl database
+    :param entries: a list of dicts returned by parse_import_file
+    :param known: the hashes in the ledger, which is updated with the new hashes once they are committed. Read from
+    the ledger if not supplied
+    :param autodelete: a bool indicating whether to remove the files once imported or skipped. Defaults to the setting
+    :return: the ids of the new entries and the paths of the skipped files
+    """
+    known = known if known is not None else known_hashes(connection)
+    autodelete = autodelete if autodelete is not None else autodelete_imports()
+    batch, skipped, hashes = [], [], set()
+    for entry in entries:
+        if entry['hash'] in known or entry['hash'] in hashes:
+            skipped.append(entry['path'])
+        else:
+            hashes.add(entry['hash'])
+            batch.append(entry)
+    ids = create_entries(batch, connection, _record_imports(batch)) if batch else []
+    # Only once the entries are committed, so that a failed batch can be imported again
+    known.update(hashes)
+    if autodelete:
+        for entry in entries:
+            remove(entry['path'])
+            for attachment in entry['attachments']:
+                if exists(attachment):
+                    remove(attachment)
+    return ids, skipped
+
+
+class ImportProgress:
+    """A snapshot of the progress of an ImportJob"""
+
+    def __init__(self, files_total: int, files_done: int, entries: int, skipped: int, failed: int, size: int,
+                 elapsed: float):
+        self.files_total = files_total
+        self.files_done = files_done
+        self.entries = entries
+        self.skipped = skipped
+        self.failed = failed
+        self.bytes = size
+        self.elapsed = elapsed
+
+    @property
+    def entries_per_second(self) -> float:
+        return self.entries / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        """The rate at which import files and their attachments are read, in MB per second"""
+        return self.bytes / 1000000 / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def eta(self) -> Union[float, None]:
+        """The estimated number of seconds left, or None before any file has been processed"""
+        if not self.files_done or not self.elapsed:
+            return None
+        return (self.files_total - self.files_done) * self.elapsed / self.files_done
+
+    def __repr__(self):
+        eta = '{:.0f}s'.format(self.eta) if self.eta is not None else '?'
+        return '{}/{} files, {} entries, {:.0f} entries/s, {:.1f} MB/s, ETA {}'.format(
+            self.files_done, self.files_total, self.entries, self.entries_per_second, self.mb_per_second, eta)
+
+
+class ImportJob:
+    """Imports a directory of '.mjef' files in batches. Files are parsed and hashed by a pool of processes, while this
+    process inserts the parsed entries in transactions of 'batch_size' entries. After each batch, the last file that
+    was processed is saved as a checkpoint in the same transaction, so a job that crashes or is cancelled resumes after
+    that file when it is run again. Files whose hash is already in the import ledger are skipped. The working
+    directory is never changed"""
+
+    def __init__(self, connection: Connection, directory: str = None, workers: int = None, batch_size: int = 1000,
+                 chunk_size: int = 64, progress: Callable[[ImportProgress], None] = None):
+        """
+        :param connection: an sqlite connection to a jurnl database
+        :param directory: the directory to import from. Defaults to the imports location
+        :param workers: the number of parsing processes. Defaults to the number of processors
+        :param batch_size: the number of entries inserted per transaction
+        :param chunk_size: the number of files handed to a worker at a time
+        :param progress: a callable that receives an ImportProgress after each chunk of files
+        """
+        check_imports_config()
+        self._connection = connection
+        self._directory = abspath(directory if directory else imports_location())
+        self._workers = workers if workers else cpu_count() or 1
+        self._batch_size = batch_size
+        self._chunk_size = chunk_size
+        self._progress = progress
+        self._cancelled = Event()
+        self.ids: List[int] = []
+        self.skipped: List[str] = []
+        self.failed: List[Tuple[str, str]] = []
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def checkpoint(self) -> Union[str, None]:
+        """Gets the last file processed by an unfinished run of this job, or None if there is no unfinished run"""
+        install_import_ledger(self._connection)
+        row = self._connection.execute('SELECT last_path FROM import_checkpoints WHERE directory=?',
+                                       (self._directory,)).fetchone()
+        return row[0] if row else None
+
+    def reset(self):
+        """Forgets the checkpoint, so that the next run starts from the first file"""
+        install_import_ledger(self._connection)
+        with self._connection:
+            self._connection.execute('DELETE FROM import_checkpoints WHERE directory=?', (self._directory,))
+
+    def cancel(self):
+        """Stops the job after the file being processed. Entries that have already been parsed are committed and
+        checkpointed first. May be called from another thread"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def _paths(self) -> List[str]:
+        extension = '.' + imports_extension()
+        with scandir(self._directory) as scan:
+            paths = sorted(x.path for x in scan if x.is_file() and x.name.endswith(extension))
+        last = self.checkpoint()
+        if last is not None:
+            paths = [x for x in paths if x > last]
+        return paths
+
+    def run(self) -> Tuple[List[int], List[str], List[Tuple[str, str]]]:
+        """Runs the job until every file is processed or the job is cancelled
+
+        :return: the ids of the new entries, the paths of the skipped files, and a (path, error) tuple for each file
+        that could not be imported
+        """
+        self._cancelled.clear()
+        autodelete = autodelete_imports()
+        paths = self._paths()
+        chunks = iter([paths[i:i + self._chunk_size] for i in range(0, len(paths), self._chunk_size)])
+        known = known_hashes(self._connection)
+        start = perf_counter()
+        state = {'done': 0, 'size': 0, 'last': None}
+        batch = []
+
+        def discard(entry: dict):
+            remove(entry['path'])
+            for attachment in entry['attachments']:
+                if exists(attachment):
+                    remove(attachment)
+
+        def record(connection: Connection, ids: List[int]):
+            _record_imports(batch)(connection, ids)
+            self._save_checkpoint(connection, state['last'])
+
+        def write():
+            if batch:
+                self.ids.extend(create_entries(batch, self._connection, record))
+            else:
+                with self._connection:
+                    self._save_checkpoint(self._connection, state['last'])
+            if autodelete:
+                for entry in batch:
+                    discard(entry)
+            batch.clear()
+
+        def report():
+            if self._progress:
+                self._progress(ImportProgress(len(paths), state['done'], len(self.ids), len(self.skipped),
+                                              len(self.failed), state['size'], perf_counter() - start))
+
+        with ProcessPoolExecutor(max_workers=self._workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(parse_import_files, chunk))
+                if len(pending) >= 2 * self._workers:
+                    break
+            while pending:
+                results = pending.popleft().result()
+                chunk = next(chunks, None) if not self.cancelled else None
+                if chunk is not None:
+                    pending.append(pool.submit(parse_import_files, chunk))
+                for result in results:
+                    state['done'] += 1
+                    if isinstance(result, tuple):
+                        self.failed.append(result)
+                        state['last'] = result[0]
+                        continue
+                    state['size'] += result['size']
+                    state['last'] = result['path']
+                    if result['hash'] in known:
+                        self.skipped.append(result['path'])
+                        if autodelete:
+                            discard(result)
+                        continue
+                    known.add(result['hash'])
+                    batch.append(result)
+                    if len(batch) >= self._batch_size:
+                        write()
+                report()
+                if self.cancelled:
+                    for future in pending:
+                        future.cancel()
+                    break
+        if state['last'] is not None:
+            write()
+            report()
+        if not self.cancelled:
+            self.reset()
+        return self.ids, self.skipped, self.failed
+
+    def _save_checkpoint(self, connection: Connection, last: str):
+        connection.execute('INSERT INTO import_checkpoints(directory, last_path, updated) VALUES(?,?,?) '
+                           'ON CONFLICT(directory) DO UPDATE SET last_path=excluded.last_path, '
+                           'updated=excluded.updated', (self._directory, last, datetime.now()))
+
+
+def import_entries(connection: Connection, directory: str = None, workers: int = None, batch_size: int = 1000,
+                   chunk_size: int = 64, progress: Callable[[ImportProgress], None] = None) \
+        -> Tuple[List[int], List[str], List[Tuple[str, str]]]:
+    """Imports journal entries ('.mjef' files) and their associated attachments and creates a new entry in the db for
+    each, resuming an unfinished import of the same directory. See ImportJob. If autodelete is enabled, the files and
+    their attachments are removed once their entries have been committed, or when they are skipped
+
+    :param connection: an sqlite connection to a jurnl database
+    :param directory: the directory to import from. Defaults to the imports location
+    :param workers: the number of parsing processes. Defaults to the number of processors
+    :param batch_size: the number of entries inserted per transaction
+    :param chunk_size: the number of files handed to a worker at a time
+    :param progress: a callable that receives an ImportProgress after each chunk of files
+    :return: the ids of the new entries, the paths of the skipped files, and a (path, error) tuple for each file that
+    could not be imported
+    """
+    return ImportJob(connection, directory, workers, batch_size, chunk_size, progress).run()
 
 
 def delete_imports():
@@ -113,10 +407,10 @@ def imports_location(path: str = None):
     p = ConfigParser()
     p.read(IMPORTS_CFG_PATH)
     if path is None:
-        v = p['Filesystem']['imports']
+        v = p['Settings']['location']
         return abspath(v)
     elif exists(path) and isdir(path):
-        p['Filesystem']['imports'] = abspath(path)
+        p['Settings']['location'] = abspath(path)
         with open(IMPORTS_CFG_PATH, 'w') as f:
             p.write(f)
             f.close()
@@ -135,10 +429,75 @@ def autodelete_imports(value: bool = None):
     p = ConfigParser()
     p.read(IMPORTS_CFG_PATH)
     if value is None:
-        v = p.getboolean('Settings', 'autodelete imports')
+        v = p.getboolean('Settings', 'autodelete')
         return v
     else:
-        p['Settings']['imports'] = str(value)
+        p['Settings']['autodelete'] = str(value)
         with open(IMPORTS_CFG_PATH, 'w') as f:
             p.write(f)
             f.close()
+
+
+def imports_extension() -> str:
+    """Gets the extension of the files that are imported as entries
+
+    :return: a str, without the leading '.'
+    """
+    check_imports_config()
+
+    p = ConfigParser()
+    p.read(IMPORTS_CFG_PATH)
+    return p.get('Settings', 'file extension', fallback='mjef').lstrip('.')
+
+
+def import_bulk_file(connection: Connection, path: str,
+                     batch_size: int = 1000) -> Tuple[List[int], List[int], List[Tuple[int, str]]]:
+    """Imports the entries of a bulk ('.ndjson') file. The file is streamed one line at a time and the entries are
+    inserted in transactions of 'batch_size' entries, so files of any size can be imported. Lines whose hash is
+    already in the import ledger are skipped
+
+    :param connection: an sqlite connection to a jurnl database
+    :param path: a str representing the location of the file
+    :param batch_size: the number of entries inserted per transaction
+    :return: the ids of the new entries, the line numbers of the skipped lines, and a (line number, error) tuple for
+    each line that could not be imported
+    """
+    ids, skipped, failed, batch, numbers = [], [], [], [], []
+    known = known_hashes(connection)
+
+    def write():
+        try:
+            ids.extend(create_entries(batch, connection, _record_imports(batch)))
+        except OSError:
+            # A missing sidecar file fails the whole transaction, so retry the entries one at a time
+            for number, entry in zip(numbers, batch):
+                try:
+                    ids.extend(create_entries([entry], connection, _record_imports([entry])))
+                except OSError as error:
+                    failed.append((number, str(error)))
+        batch.clear()
+        numbers.clear()
+
+    source = abspath(path)
+    with open(path, 'r', encoding='utf-8') as file:
+        for number, line, entry in read_entries(file, dirname(source), lines=True):
+            if isinstance(entry, Exception):
+                failed.append((number, str(entry)))
+                continue
+            try:
+                entry['hash'] = content_hash(line.strip().encode('utf-8'), entry['attachments'])
+            except OSError as error:
+                failed.append((number, str(error)))
+                continue
+            if entry['hash'] in known:
+                skipped.append(number)
+                continue
+            known.add(entry['hash'])
+            entry['path'] = '{}:{}'.format(source, number)
+            batch.append(entry)
+            numbers.append(number)
+            if len(batch) >= batch_size:
+                write()
+    if batch:
+        write()
+    return ids, skipped, failed
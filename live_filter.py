@@ -0,0 +1,104 @@
+"""A filter result that stays current as entries are written. After the filter has been run once, each write reported
+by writer_functions re-tests only the entry that was touched and moves it into or out of the ordered result"""
+from bisect import bisect_left, insort
+from sqlite3 import Connection
+from typing import Dict, Iterator, List, Tuple, Union
+
+from body_search import has_trigram_index
+from database_info import get_database_path
+from filter import FilterState, get_all_settings
+from filter_compiler import compile_filter, CompiledFilter
+from writer_functions import add_write_listener, remove_write_listener
+
+
+class LiveFilterResult:
+    """The ordered ids of the entries matching a filter. Call 'subscribe' to have writes made through writer_functions
+    update the result in place, at a cost proportional to the number of entries written rather than to the size of the
+    journal. Writes made by other means are picked up by 'refresh'"""
+
+    def __init__(self, connection: Connection, state: Union[FilterState, dict] = None, descending: bool = False):
+        """
+        :param connection: an sqlite connection to a jurnl database
+        :param state: a FilterState or a dict of filter settings. Defaults to the shared filter state
+        :param descending: a bool indicating whether the newest entries should come first
+        """
+        self._connection = connection
+        self._database = get_database_path(connection)
+        self._descending = descending
+        self._settings = None
+        self._compiled: CompiledFilter = None
+        self._keys: List[Tuple[str, int]] = []
+        self._positions: Dict[int, Tuple[str, int]] = {}
+        self.reset(state)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, entry_id: int):
+        return entry_id in self._positions
+
+    def __iter__(self) -> Iterator[int]:
+        keys = reversed(self._keys) if self._descending else self._keys
+        return (entry_id for _, entry_id in keys)
+
+    @property
+    def ids(self) -> List[int]:
+        """The matching entry ids, ordered by the 'date sort type' setting"""
+        return list(self)
+
+    @property
+    def settings(self) -> dict:
+        return dict(self._settings)
+
+    def _columns(self) -> str:
+        # Keys are compared as text, which orders the same way as the stored timestamps
+        return 'd.entry_id, IFNULL(CAST(d.{} AS TEXT), \'\')'.format(self._compiled.column)
+
+    def reset(self, state: Union[FilterState, dict] = None):
+        """Changes the filter and evaluates it over the whole journal
+
+        :param state: a FilterState or a dict of filter settings. Defaults to the shared filter state
+        """
+        self._settings = state if isinstance(state, dict) else get_all_settings(state)
+        self._compiled = compile_filter(self._settings, has_trigram_index(self._connection))
+        self.refresh()
+
+    def refresh(self):
+        """Evaluates the filter over the whole journal"""
+        sql, params = self._compiled.select(columns=self._columns())
+        self._keys = [(key, entry_id) for entry_id, key in self._connection.execute(sql, params)]
+        self._positions = {entry_id: (key, entry_id) for key, entry_id in self._keys}
+
+    def _remove(self, entry_id: int):
+        key = self._positions.pop(entry_id, None)
+        if key is not None:
+            del self._keys[bisect_left(self._keys, key)]
+
+    def update_entry(self, entry_id: int):
+        """Re-tests one entry against the filter and moves it into, within or out of the result
+
+        :param entry_id: the entry that changed
+        """
+        sql, params = self._compiled.select_entry(entry_id, columns=self._columns())
+        row = self._connection.execute(sql, params).fetchone()
+        if row is None:
+            self._remove(entry_id)
+            return
+        key = (row[1], entry_id)
+        if self._positions.get(entry_id) == key:
+            return
+        self._remove(entry_id)
+        insort(self._keys, key)
+        self._positions[entry_id] = key
+
+    def _on_write(self, table: str, entry_id: int, connection: Connection):
+        if connection is not self._connection and get_database_path(connection) != self._database:
+            return
+        self.update_entry(entry_id)
+
+    def subscribe(self):
+        """Keeps the result current by listening to writes made through writer_functions"""
+        add_write_listener(self._on_write)
+
+    def unsubscribe(self):
+        remove_write_listener(self._on_write)
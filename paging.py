@@ -0,0 +1,115 @@
+"""Functions for browsing filter results one page at a time. Pages are located with keyset cursors of the form
+(date, entry id) rather than OFFSET, so fetching a page deep into the journal costs the same as fetching the first"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from json import dumps, loads
+from sqlite3 import Connection
+from typing import List, Tuple, Union
+
+from body_search import has_trigram_index
+from filter import FilterState, get_all_settings
+from filter_cache import settings_hash
+from filter_compiler import compile_filter
+
+
+class Page:
+    """One page of filter results"""
+
+    def __init__(self, ids: List[int], next_token: str = None, previous_token: str = None, total: int = None,
+                 total_exact: bool = True):
+        self._ids = ids
+        self._next_token = next_token
+        self._previous_token = previous_token
+        self._total = total
+        self._total_exact = total_exact
+
+    @property
+    def ids(self):
+        """The entry ids on the page, in display order"""
+        return self._ids
+
+    @property
+    def next_token(self):
+        """A token for the following page, or None if this is the last page"""
+        return self._next_token
+
+    @property
+    def previous_token(self):
+        """A token for the preceding page, or None if this is the first page"""
+        return self._previous_token
+
+    @property
+    def total(self):
+        """The number of matching entries, if it was requested. If 'total_exact' is False, it is a lower bound"""
+        return self._total
+
+    @property
+    def total_exact(self):
+        return self._total_exact
+
+
+def _encode_token(key: str, entry_id: int, direction: str, digest: str) -> str:
+    data = dumps([key, entry_id, direction, digest], separators=(',', ':')).encode()
+    return urlsafe_b64encode(data).decode()
+
+
+def _decode_token(token: str, digest: str) -> Tuple[str, int, str]:
+    try:
+        key, entry_id, direction, token_digest = loads(urlsafe_b64decode(token.encode()))
+    except (DecodeError, ValueError, TypeError):
+        raise ValueError('Not a valid page token')
+    if token_digest != digest:
+        raise ValueError('The page token belongs to a different filter')
+    return key, entry_id, direction
+
+
+def get_page(connection: Connection, state: Union[FilterState, dict] = None, size: int = 20, token: str = None,
+             descending: bool = False, with_total: bool = False, total_limit: int = 10000) -> Page:
+    """Gets one page of the entries matching the filter, ordered by the 'date sort type' setting and then by id
+
+    :param connection: an sqlite connection to a jurnl database
+    :param state: a FilterState or a dict of filter settings. Defaults to the shared filter state
+    :param size: the number of entries per page
+    :param token: a next or previous token from an earlier page, or None for the first page
+    :param descending: a bool indicating whether the newest entries should come first
+    :param with_total: a bool indicating whether to count the matching entries
+    :param total_limit: the most entries to count; larger totals are reported as this number and marked inexact
+    :return: a Page
+    """
+    if size < 1:
+        raise ValueError('Page size must be at least 1')
+    settings = state if isinstance(state, dict) else get_all_settings(state)
+    digest = settings_hash(dict(settings, descending=descending))
+    compiled = compile_filter(settings, has_trigram_index(connection))
+    column = 'd.{}'.format(compiled.column)
+
+    direction, after = 'next', None
+    if token:
+        key, entry_id, direction = _decode_token(token, digest)
+        after = (key, entry_id)
+    # Pages before the cursor are read in the opposite order and then reversed
+    reverse = direction == 'prev'
+
+    sql, values = compiled.select(columns='d.entry_id, CAST({} AS TEXT)'.format(column),
+                                  descending=descending != reverse, limit=size + 1, after=after)
+    rows = connection.execute(sql, values).fetchall()
+    more = len(rows) > size
+    rows = rows[:size]
+    if reverse:
+        rows.reverse()
+
+    next_token = previous_token = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if more or reverse:
+            next_token = _encode_token(last[1], last[0], 'next', digest)
+        if (token and not reverse) or (reverse and more):
+            previous_token = _encode_token(first[1], first[0], 'prev', digest)
+
+    total, exact = None, True
+    if with_total:
+        sql, values = compiled.select(columns='1', ordered=False, limit=total_limit + 1)
+        total = connection.execute('SELECT COUNT(*) FROM ({})'.format(sql), values).fetchone()[0]
+        if total > total_limit:
+            total, exact = total_limit, False
+    return Page([x[0] for x in rows], next_token, previous_token, total, exact)
@@ -0,0 +1,345 @@
+"""Diagnostics for the queries made against a jurnl database. A DiagnosticConnection captures the EXPLAIN QUERY PLAN
+of each distinct statement the first time it runs, estimates the rows each step examines, flags full scans of large
+tables, and records which functions ran the statement. Run this module with a database to get a report covering the
+filter, reader and database info functions"""
+import sqlite3
+from contextlib import contextmanager
+from re import compile as compile_regex, IGNORECASE
+from sys import _getframe, argv, modules
+from threading import RLock
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Tables with at least this many rows are reported when a plan scans them
+LARGE_TABLE = 1000
+
+# The modules whose 'connect' is replaced while diagnostics are enabled
+PATCHED_MODULES = ('database', 'database_info', 'federation', 'stats_tables', 'tempfiles', 'virtualinterface')
+
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+_STEP = compile_regex(r'^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\w+)(?:\s+AS\s+(\w+))?(.*)$')
+_INDEX = compile_regex(r'USING\s+(?:COVERING\s+)?INDEX\s+(\w+)|USING\s+(INTEGER PRIMARY KEY)')
+_CONSTRAINTS = compile_regex(r'\(([^()]*)\)\s*$')
+_ALIAS = compile_regex(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', IGNORECASE)
+_KEYWORDS = {'WHERE', 'ON', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'NATURAL', 'GROUP', 'ORDER', 'LIMIT', 'USING',
+             'UNION', 'EXCEPT', 'INTERSECT', 'WINDOW', 'HAVING', 'SET', 'VALUES', 'AND', 'OR', 'NOT'}
+
+
+def _aliases(sql: str) -> Dict[str, str]:
+    """Maps the table aliases of a statement to their tables"""
+    aliases = {}
+    for table, alias in _ALIAS.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in _KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def _caller() -> str:
+    frame = _getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__ and frame.f_code.co_name != '<module>':
+        frame = frame.f_back
+    if frame is None:
+        return '<unknown>'
+    code = frame.f_code
+    return '{}.{}'.format(frame.f_globals.get('__name__', '?'), getattr(code, 'co_qualname', code.co_name))
+
+
+class PlanStep:
+    """One line of a query plan"""
+
+    def __init__(self, depth: int, detail: str, table: str = None, index: str = None, scan: bool = False,
+                 virtual: bool = False, rows: int = None, large: bool = False):
+        self.depth = depth
+        self.detail = detail
+        self.table = table
+        self.index = index
+        self.scan = scan
+        self.virtual = virtual
+        self.rows = rows
+        self.large = large
+
+    @property
+    def flagged(self) -> bool:
+        """Whether the step reads every row of a large table"""
+        return self.scan and self.large and not self.virtual
+
+
+class StatementPlan:
+    """The plan of one distinct statement, and the functions that ran it"""
+
+    def __init__(self, sql: str, steps: List[PlanStep], error: str = None):
+        self.sql = sql
+        self.steps = steps
+        self.error = error
+        self.callers: Dict[str, int] = {}
+
+    @property
+    def indexes(self) -> List[str]:
+        return sorted({x.index for x in self.steps if x.index})
+
+    @property
+    def estimated_rows(self) -> Optional[int]:
+        """The estimated number of rows examined by the most expensive step"""
+        rows = [x.rows for x in self.steps if x.rows is not None]
+        return max(rows) if rows else None
+
+    @property
+    def flagged(self) -> bool:
+        return any(x.flagged for x in self.steps)
+
+
+class PlanRecorder:
+    """Collects the plans of the statements run on one or more DiagnosticConnections"""
+
+    def __init__(self, large_table: int = LARGE_TABLE):
+        """
+        :param large_table: the number of rows at which a scanned table is flagged
+        """
+        self.large_table = large_table
+        self._plans: Dict[str, StatementPlan] = {}
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._plans)
+
+    @property
+    def plans(self) -> List[StatementPlan]:
+        with self._lock:
+            return list(self._plans.values())
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def record(self, connection: sqlite3.Connection, sql: str, params, caller: str):
+        """Counts one execution of the statement, explaining it if it has not been seen before"""
+        with self._lock:
+            plan = self._plans.get(sql)
+            if plan is None:
+                plan = self._explain(connection, sql, params)
+                self._plans[sql] = plan
+            plan.callers[caller] = plan.callers.get(caller, 0) + 1
+
+    def _explain(self, connection: sqlite3.Connection, sql: str, params) -> StatementPlan:
+        try:
+            rows = sqlite3.Cursor(connection).execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        except sqlite3.Error as e:
+            return StatementPlan(sql, [], str(e))
+        aliases = _aliases(sql)
+        depths, steps = {0: -1}, []
+        for node, parent, _, detail in rows:
+            depths[node] = depths.get(parent, -1) + 1
+            steps.append(self._step(connection, depths[node], detail, aliases))
+        return StatementPlan(sql, steps)
+
+    def _step(self, connection: sqlite3.Connection, depth: int, detail: str, aliases: Dict[str, str]) -> PlanStep:
+        match = _STEP.match(detail)
+        if not match:
+            return PlanStep(depth, detail)
+        operation, name, alias, rest = match.groups()
+        table = name if alias else aliases.get(name, name)
+        index = _INDEX.search(rest)
+        index = (index.group(1) or index.group(2)) if index else None
+        virtual = 'VIRTUAL TABLE' in rest
+        total = _table_rows(connection, table) if not virtual else None
+        scan = operation == 'SCAN'
+        rows = total
+        if not scan and total is not None:
+            rows = _search_rows(connection, total, index, rest)
+        return PlanStep(depth, detail, table, index, scan, virtual, rows,
+                        total is not None and total >= self.large_table)
+
+
+def _table_rows(connection: sqlite3.Connection, table: str) -> Optional[int]:
+    """Reads the row count from sqlite_stat1 when ANALYZE has been run, otherwise counts the rows"""
+    try:
+        stat = sqlite3.Cursor(connection).execute('SELECT stat FROM sqlite_stat1 WHERE tbl=? LIMIT 1',
+                                                  (table,)).fetchone()
+    except sqlite3.Error:
+        stat = None
+    if stat:
+        return int(stat[0].split()[0])
+    try:
+        return sqlite3.Cursor(connection).execute('SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()[0]
+    except sqlite3.Error:
+        return None
+
+
+def _search_rows(connection: sqlite3.Connection, total: int, index: Optional[str], detail: str) -> int:
+    """Estimates the rows visited by an index search the way sqlite does without statistics: one row for a rowid
+    lookup or a MIN/MAX seek, the average rows per key from sqlite_stat1 (or ten) for equality, and a quarter of the
+    table per range bound"""
+    constraints = _CONSTRAINTS.search(detail)
+    terms = [x.strip() for x in constraints.group(1).split(' AND ')] if constraints else []
+    if not terms:
+        return 1
+    if index == 'INTEGER PRIMARY KEY' and any(x.startswith('rowid=') for x in terms):
+        return 1
+    equalities = [x for x in terms if '=' in x and not any(op in x for op in '<>')]
+    ranges = [x for x in terms if any(op in x for op in '<>')]
+    rows = total
+    if equalities:
+        rows = min(total, 10)
+        if index and index != 'INTEGER PRIMARY KEY':
+            try:
+                stat = sqlite3.Cursor(connection).execute('SELECT stat FROM sqlite_stat1 WHERE idx=?',
+                                                          (index,)).fetchone()
+            except sqlite3.Error:
+                stat = None
+            if stat:
+                values = stat[0].split()
+                if len(values) > len(equalities):
+                    rows = int(values[len(equalities)])
+    for _ in ranges:
+        rows = max(rows // 4, 1)
+    return rows
+
+
+class DiagnosticCursor(sqlite3.Cursor):
+    """A cursor that reports every statement it runs to its connection's PlanRecorder"""
+
+    def execute(self, sql: str, parameters=()):
+        self._record(sql, parameters)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        rows = list(seq_of_parameters)
+        if rows:
+            self._record(sql, rows[0])
+        return super().executemany(sql, rows)
+
+    def _record(self, sql: str, parameters):
+        recorder = getattr(self.connection, 'recorder', None)
+        keyword = sql.lstrip()[:7].split(None, 1)
+        if recorder is not None and keyword and keyword[0].upper() in _EXPLAINABLE:
+            recorder.record(self.connection, sql, parameters, _caller())
+
+
+class DiagnosticConnection(sqlite3.Connection):
+    """A connection whose statements, including those run through Connection.execute, are recorded by 'recorder'"""
+
+    recorder: PlanRecorder = None
+
+    def cursor(self, factory=DiagnosticCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(database: str, recorder: PlanRecorder = None, **kwargs) -> DiagnosticConnection:
+    """Opens a DiagnosticConnection
+
+    :param database: a str representing the database file
+    :param recorder: the PlanRecorder that receives the plans. A new one is created if not supplied
+    :param kwargs: any other arguments accepted by sqlite3.connect
+    :return: a DiagnosticConnection
+    """
+    connection = sqlite3.connect(database, factory=DiagnosticConnection, **kwargs)
+    connection.recorder = recorder if recorder is not None else PlanRecorder()
+    return connection
+
+
+@contextmanager
+def diagnostics(recorder: PlanRecorder = None) -> Iterator[PlanRecorder]:
+    """Enables diagnostics mode: while the context is active, connections opened by the modules in PATCHED_MODULES
+    are DiagnosticConnections reporting to the recorder. Connections passed in by the caller are not affected
+
+    :param recorder: the PlanRecorder that receives the plans. A new one is created if not supplied
+    :return: the PlanRecorder
+    """
+    recorder = recorder if recorder is not None else PlanRecorder()
+    patched = []
+
+    def _connect(database, **kwargs):
+        return connect(database, recorder, **kwargs)
+
+    for name in PATCHED_MODULES:
+        module = modules.get(name)
+        if module is not None and getattr(module, 'connect', None) is sqlite3.connect:
+            module.connect = _connect
+            patched.append(module)
+    try:
+        yield recorder
+    finally:
+        for module in patched:
+            module.connect = sqlite3.connect
+
+
+def by_function(recorder: PlanRecorder) -> Dict[str, List[Tuple[StatementPlan, int]]]:
+    """Groups the recorded plans by the functions that ran them
+
+    :param recorder: a PlanRecorder
+    :return: a dict mapping each function to a list of (plan, number of executions)
+    """
+    functions: Dict[str, List[Tuple[StatementPlan, int]]] = {}
+    for plan in recorder.plans:
+        for caller, count in plan.callers.items():
+            functions.setdefault(caller, []).append((plan, count))
+    return dict(sorted(functions.items()))
+
+
+def report(recorder: PlanRecorder) -> str:
+    """Formats the recorded plans, grouped by function. Full scans of large tables are marked with '!'
+
+    :param recorder: a PlanRecorder
+    :return: a str
+    """
+    lines = []
+    flagged = sum(1 for x in recorder.plans if x.flagged)
+    lines.append('{} statements, {} with full scans of tables of {} rows or more'.format(len(recorder), flagged,
+                                                                                        recorder.large_table))
+    for function, plans in by_function(recorder).items():
+        lines.append('')
+        lines.append(function)
+        for plan, count in plans:
+            lines.append('  {} {}'.format('!' if plan.flagged else '-', ' '.join(plan.sql.split())))
+            if plan.error:
+                lines.append('      error: {}'.format(plan.error))
+                continue
+            lines.append('      runs: {}, estimated rows: {}, indexes: {}'.format(
+                count, plan.estimated_rows if plan.estimated_rows is not None else '?',
+                ', '.join(plan.indexes) if plan.indexes else 'none'))
+            for step in plan.steps:
+                lines.append('      {}{}{}'.format('  ' * step.depth, step.detail, '  <-- full scan' if step.flagged
+                                                   else ''))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from os.path import isfile
+
+    import database_info
+    import filter
+    import reader_functions
+    from database import get_database
+
+    path = argv[1] if len(argv) > 1 and isfile(argv[1]) else get_database(argv[1] if len(argv) > 1 else None)
+    if not path:
+        raise KeyError('\'{}\' is not listed as a database'.format(argv[1]))
+    with diagnostics() as recorder:
+        db = connect(path, recorder, detect_types=sqlite3.PARSE_DECLTYPES)
+        state = filter.FilterState(filter._default_settings(db))
+        for function in [filter.from_continuous_range, filter.from_intervals, filter.from_tags, filter.from_body]:
+            function(db, state)
+        for function in [filter.filter_by_has_attachments, filter.filter_by_has_children, filter.filter_by_has_parent,
+                         database_info.get_all_entry_ids, database_info.get_all_creation_dates,
+                         database_info.get_all_edit_dates, database_info.get_all_access_dates,
+                         database_info.get_oldest_date, database_info.get_newest_date]:
+            function(db)
+        for function in [database_info.get_all_tags, database_info.get_all_children, database_info.get_all_parents,
+                         database_info.get_all_relations, database_info.get_number_of_entries,
+                         database_info.get_years]:
+            function(path)
+        entry = db.execute('SELECT MAX(entry_id) FROM dates').fetchone()[0]
+        if entry is not None:
+            for function in [reader_functions.get_date, reader_functions.get_date_last_edit,
+                             reader_functions.get_date_last_access, reader_functions.get_body,
+                             reader_functions.get_tags, reader_functions.get_attachment_ids,
+                             reader_functions.get_children, reader_functions.get_parent]:
+                function(entry, db)
+        db.close()
+    print(report(recorder))
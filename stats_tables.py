@@ -0,0 +1,146 @@
+"""Functions for maintaining summary tables of journal statistics. The tables are kept up to date by SQL triggers on
+the 'dates', 'tags' and 'attachments' tables, so reading them costs O(distinct keys) rather than O(entries)"""
+from contextlib import closing
+from sqlite3 import Connection, connect
+from sys import argv
+from typing import Dict, Tuple
+
+STATS_TABLES = ('stats_by_day', 'tag_counts', 'attachment_totals')
+
+_TABLES = [
+    'CREATE TABLE IF NOT EXISTS stats_by_day(day TEXT PRIMARY KEY, year INTEGER NOT NULL, month INTEGER NOT NULL, '
+    'weekday INTEGER NOT NULL, entries INTEGER NOT NULL) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS stats_by_day_year ON stats_by_day(year, month)',
+    'CREATE TABLE IF NOT EXISTS tag_counts(tag TEXT PRIMARY KEY, entries INTEGER NOT NULL) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS attachment_totals(total_id INTEGER PRIMARY KEY CHECK(total_id = 0), '
+    'attachments INTEGER NOT NULL, bytes INTEGER NOT NULL)'
+]
+
+_ADD_DAY = 'INSERT INTO stats_by_day(day, year, month, weekday, entries) ' \
+           'VALUES(date(NEW.created), CAST(strftime(\'%Y\', NEW.created) AS INTEGER), ' \
+           'CAST(strftime(\'%m\', NEW.created) AS INTEGER), CAST(strftime(\'%w\', NEW.created) AS INTEGER), 1) ' \
+           'ON CONFLICT(day) DO UPDATE SET entries = entries + 1;'
+_REMOVE_DAY = 'UPDATE stats_by_day SET entries = entries - 1 WHERE day = date(OLD.created); ' \
+              'DELETE FROM stats_by_day WHERE day = date(OLD.created) AND entries <= 0;'
+_ADD_TAG = 'INSERT INTO tag_counts(tag, entries) VALUES(NEW.tag, 1) ' \
+           'ON CONFLICT(tag) DO UPDATE SET entries = entries + 1;'
+_REMOVE_TAG = 'UPDATE tag_counts SET entries = entries - 1 WHERE tag = OLD.tag; ' \
+              'DELETE FROM tag_counts WHERE tag = OLD.tag AND entries <= 0;'
+_ADD_ATTACHMENT = 'INSERT INTO attachment_totals(total_id, attachments, bytes) VALUES(0, 1, length(NEW.file)) ' \
+                  'ON CONFLICT(total_id) DO UPDATE SET attachments = attachments + 1, ' \
+                  'bytes = bytes + length(NEW.file);'
+_REMOVE_ATTACHMENT = 'UPDATE attachment_totals SET attachments = attachments - 1, bytes = bytes - length(OLD.file) ' \
+                     'WHERE total_id = 0;'
+
+_TRIGGERS = {
+    'stats_dates_insert': 'AFTER INSERT ON dates WHEN NEW.created IS NOT NULL BEGIN {} END'.format(_ADD_DAY),
+    'stats_dates_delete': 'AFTER DELETE ON dates WHEN OLD.created IS NOT NULL BEGIN {} END'.format(_REMOVE_DAY),
+    'stats_dates_update_old': 'AFTER UPDATE OF created ON dates '
+                              'WHEN OLD.created IS NOT NULL AND date(OLD.created) IS NOT date(NEW.created) '
+                              'BEGIN {} END'.format(_REMOVE_DAY),
+    'stats_dates_update_new': 'AFTER UPDATE OF created ON dates '
+                              'WHEN NEW.created IS NOT NULL AND date(OLD.created) IS NOT date(NEW.created) '
+                              'BEGIN {} END'.format(_ADD_DAY),
+    'stats_tags_insert': 'AFTER INSERT ON tags WHEN NEW.tag IS NOT NULL BEGIN {} END'.format(_ADD_TAG),
+    'stats_tags_delete': 'AFTER DELETE ON tags WHEN OLD.tag IS NOT NULL BEGIN {} END'.format(_REMOVE_TAG),
+    'stats_tags_update_old': 'AFTER UPDATE OF tag ON tags WHEN OLD.tag IS NOT NULL AND OLD.tag IS NOT NEW.tag '
+                             'BEGIN {} END'.format(_REMOVE_TAG),
+    'stats_tags_update_new': 'AFTER UPDATE OF tag ON tags WHEN NEW.tag IS NOT NULL AND OLD.tag IS NOT NEW.tag '
+                             'BEGIN {} END'.format(_ADD_TAG),
+    'stats_attachments_insert': 'AFTER INSERT ON attachments BEGIN {} END'.format(_ADD_ATTACHMENT),
+    'stats_attachments_delete': 'AFTER DELETE ON attachments BEGIN {} END'.format(_REMOVE_ATTACHMENT),
+    'stats_attachments_update': 'AFTER UPDATE OF file ON attachments BEGIN {} {} END'.format(_REMOVE_ATTACHMENT,
+                                                                                           _ADD_ATTACHMENT)
+}
+
+
+def has_stats_tables(connection: Connection) -> bool:
+    """Checks whether the summary tables and their triggers have been installed in the database
+
+    :param connection: an sqlite connection to a jurnl database
+    :return: True if all summary tables and triggers exist, else False
+    """
+    names = {x[0] for x in connection.execute('SELECT name FROM sqlite_master WHERE type IN (\'table\', \'trigger\')')}
+    return names.issuperset(STATS_TABLES) and names.issuperset(_TRIGGERS.keys())
+
+
+def install_stats_tables(connection: Connection):
+    """Creates the summary tables and the triggers that maintain them, then fills the tables from the existing data.
+    Does nothing if they are already installed
+
+    :param connection: an sqlite connection to a jurnl database
+    """
+    if has_stats_tables(connection):
+        return
+    for sql in _TABLES:
+        connection.execute(sql)
+    for name, body in _TRIGGERS.items():
+        connection.execute('CREATE TRIGGER IF NOT EXISTS {} {}'.format(name, body))
+    rebuild_stats_tables(connection)
+
+
+def rebuild_stats_tables(connection: Connection):
+    """Recomputes the contents of the summary tables from the 'dates', 'tags' and 'attachments' tables
+
+    :param connection: an sqlite connection to a jurnl database
+    """
+    with connection:
+        connection.execute('DELETE FROM stats_by_day')
+        connection.execute('INSERT INTO stats_by_day(day, year, month, weekday, entries) '
+                           'SELECT date(created), CAST(strftime(\'%Y\', created) AS INTEGER), '
+                           'CAST(strftime(\'%m\', created) AS INTEGER), CAST(strftime(\'%w\', created) AS INTEGER), '
+                           'COUNT(*) FROM dates WHERE created IS NOT NULL GROUP BY date(created)')
+        connection.execute('DELETE FROM tag_counts')
+        connection.execute('INSERT INTO tag_counts(tag, entries) '
+                           'SELECT tag, COUNT(*) FROM tags WHERE tag IS NOT NULL GROUP BY tag')
+        connection.execute('DELETE FROM attachment_totals')
+        connection.execute('INSERT INTO attachment_totals(total_id, attachments, bytes) '
+                           'SELECT 0, COUNT(*), IFNULL(SUM(length(file)), 0) FROM attachments')
+
+
+def entries_per_year(connection: Connection) -> Dict[int, int]:
+    return dict(connection.execute('SELECT year, SUM(entries) FROM stats_by_day GROUP BY year ORDER BY year'))
+
+
+def entries_per_month(connection: Connection) -> Dict[Tuple[int, int], int]:
+    c = connection.execute('SELECT year, month, SUM(entries) FROM stats_by_day GROUP BY year, month '
+                           'ORDER BY year, month')
+    return {(year, month): n for year, month, n in c}
+
+
+def entries_per_weekday(connection: Connection) -> Dict[int, int]:
+    """Counts the entries created on each weekday, where 0 is Sunday (as in sqlite's strftime('%w'))"""
+    return dict(connection.execute('SELECT weekday, SUM(entries) FROM stats_by_day GROUP BY weekday '
+                                   'ORDER BY weekday'))
+
+
+def entries_per_day(connection: Connection) -> Dict[str, int]:
+    return dict(connection.execute('SELECT day, entries FROM stats_by_day ORDER BY day'))
+
+
+def tag_frequencies(connection: Connection) -> Dict[str, int]:
+    return dict(connection.execute('SELECT tag, entries FROM tag_counts ORDER BY tag'))
+
+
+def attachment_totals(connection: Connection) -> Tuple[int, int]:
+    """Gets the total number of attachments and their combined size
+
+    :param connection: an sqlite connection to a jurnl database
+    :return: a tuple of ints representing the number of attachments and their size in bytes
+    """
+    row = connection.execute('SELECT attachments, bytes FROM attachment_totals WHERE total_id = 0').fetchone()
+    return tuple(row) if row else (0, 0)
+
+
+if __name__ == '__main__':
+    from database import get_database
+
+    path = get_database(argv[1] if len(argv) > 1 else None)
+    if not path:
+        raise KeyError('\'{}\' is not listed as a database'.format(argv[1]))
+    with closing(connect(path)) as db:
+        if has_stats_tables(db):
+            rebuild_stats_tables(db)
+        else:
+            install_stats_tables(db)
+        db.commit()
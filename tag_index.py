@@ -0,0 +1,194 @@
+"""A tag filter engine that keeps one bitmap per tag over entry ids. Bitmaps are Python ints in which bit n is set
+when entry n has the tag, so every tag filter reduces to a few bitwise AND, OR and AND NOT operations"""
+from sqlite3 import Connection
+from typing import Dict, Iterable, List, Set
+
+from database_info import get_database_path
+from filter import FilterState, TAG_FILTER_TYPES, get_all_settings
+from reader_functions import get_tags
+from writer_functions import add_write_listener, remove_write_listener
+
+UNTAGGED = '(UNTAGGED)'
+
+
+def _bitmap(ids: Iterable[int]) -> int:
+    """Builds a bitmap from entry ids in one pass over a bytearray, rather than one big-int operation per id"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buffer[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def bitmap_to_ids(bitmap: int) -> List[int]:
+    """Lists the entry ids set in a bitmap, in ascending order
+
+    :param bitmap: an int bitmap
+    :return: a list of ints representing entries
+    """
+    ids = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        if byte:
+            base = index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    ids.append(base + bit)
+    return ids
+
+
+class TagBitmapIndex:
+    """Holds a bitmap of entry ids for every tag in a database. Call 'subscribe' to keep the index current as tags are
+    changed through writer_functions"""
+
+    def __init__(self, connection: Connection):
+        self._connection = connection
+        self._database = get_database_path(connection)
+        self._bitmaps: Dict[str, int] = {}
+        self._entry_tags: Dict[int, Set[str]] = {}
+        self._entries = 0
+        self._tagged = 0
+        self.rebuild()
+
+    @property
+    def tags(self) -> List[str]:
+        return sorted(self._bitmaps.keys())
+
+    @property
+    def entries(self) -> int:
+        """A bitmap of every entry in the database"""
+        return self._entries
+
+    def rebuild(self):
+        """Reads the 'tags' and 'dates' tables and rebuilds every bitmap"""
+        by_tag: Dict[str, List[int]] = {}
+        self._entry_tags = {}
+        rows = self._connection.execute('SELECT entry_id, tag FROM tags WHERE tag IS NOT NULL AND tag != ?', (UNTAGGED,))
+        for entry_id, tag in rows:
+            by_tag.setdefault(tag, []).append(entry_id)
+            self._entry_tags.setdefault(entry_id, set()).add(tag)
+        self._bitmaps = {tag: _bitmap(ids) for tag, ids in by_tag.items()}
+        self._entries = _bitmap(x[0] for x in self._connection.execute('SELECT entry_id FROM dates'))
+        self._tagged = _bitmap(self._entry_tags.keys())
+
+    def update_entry(self, entry_id: int, tags: Iterable[str] = None, exists: bool = True):
+        """Updates the bitmaps for one entry
+
+        :param entry_id: the entry that changed
+        :param tags: the entry's current tags. Read from the database if not supplied
+        :param exists: False if the entry was deleted
+        """
+        if tags is None:
+            tags = get_tags(entry_id, self._connection) if exists else ()
+        new = {x for x in tags if x and x != UNTAGGED}
+        old = self._entry_tags.get(entry_id, set())
+        bit = 1 << entry_id
+        for tag in old - new:
+            bitmap = self._bitmaps[tag] & ~bit
+            if bitmap:
+                self._bitmaps[tag] = bitmap
+            else:
+                del self._bitmaps[tag]
+        for tag in new - old:
+            self._bitmaps[tag] = self._bitmaps.get(tag, 0) | bit
+        if new:
+            self._entry_tags[entry_id] = new
+            self._tagged |= bit
+        else:
+            self._entry_tags.pop(entry_id, None)
+            self._tagged &= ~bit
+        if exists:
+            self._entries |= bit
+        else:
+            self._entries &= ~bit
+
+    def _on_write(self, table: str, entry_id: int, connection: Connection):
+        if table not in ['tags', 'entries']:
+            return
+        if connection is not self._connection and get_database_path(connection) != self._database:
+            return
+        exists = connection.execute('SELECT 1 FROM dates WHERE entry_id=?', (entry_id,)).fetchone() is not None
+        self.update_entry(entry_id, get_tags(entry_id, connection) if exists else (), exists)
+
+    def subscribe(self):
+        """Keeps the index current by listening to writes made through writer_functions"""
+        add_write_listener(self._on_write)
+
+    def unsubscribe(self):
+        remove_write_listener(self._on_write)
+
+    def bitmap(self, tag: str) -> int:
+        return self._bitmaps.get(tag, 0)
+
+    def any_of(self, tags: Iterable[str]) -> int:
+        """Entries with at least one of the tags"""
+        result = 0
+        for tag in tags:
+            result |= self._bitmaps.get(tag, 0)
+        return result
+
+    def all_of(self, tags: Iterable[str]) -> int:
+        """Entries with every one of the tags"""
+        tags = list(tags)
+        if not tags:
+            return self._entries
+        result = self._entries
+        for tag in tags:
+            result &= self._bitmaps.get(tag, 0)
+            if not result:
+                break
+        return result
+
+    def only(self, tags: Iterable[str]) -> int:
+        """Entries with at least one of the tags and no other tags"""
+        tags = set(tags)
+        result = self.any_of(tags)
+        for tag, bitmap in self._bitmaps.items():
+            if not result:
+                break
+            if tag not in tags:
+                result &= ~bitmap
+        return result
+
+    def untagged(self) -> int:
+        """Entries without any tags"""
+        return self._entries & ~self._tagged
+
+    def evaluate(self, filtertype: str, tags: Iterable[str]) -> int:
+        """Evaluates a tag filter. 'Contains One Of' matches entries with any of the tags, 'Contains At Least' those
+        with all of them, 'Contains Only' those with at least one of the tags and no others, and 'Untagged' those
+        without any tags. An empty tag list matches every entry, except for 'Untagged'
+
+        :param filtertype: one of the tag filter types
+        :param tags: a collection of str representing tags
+        :return: an int bitmap of matching entries
+        """
+        tags = list(tags)
+        if filtertype == 'Untagged':
+            return self.untagged()
+        if filtertype not in TAG_FILTER_TYPES:
+            raise KeyError('\'{}\' is not a valid tags filter type. Allowed types are {}'.format(filtertype,
+                                                                                               TAG_FILTER_TYPES))
+        if not tags:
+            return self._entries
+        if filtertype == 'Contains One Of':
+            return self.any_of(tags)
+        if filtertype == 'Contains At Least':
+            return self.all_of(tags)
+        return self.only(tags)
+
+    def matches(self, entry_id: int, filtertype: str, tags: Iterable[str]) -> bool:
+        return bool(self.evaluate(filtertype, tags) >> entry_id & 1)
+
+
+def match_tags(index: TagBitmapIndex, state: FilterState = None) -> List[int]:
+    """Evaluates the tag filter of the filter state against the index
+
+    :param index: a TagBitmapIndex
+    :param state: a FilterState. Defaults to the shared filter state
+    :return: a list of matching entry ids, in ascending order
+    """
+    settings = get_all_settings(state)
+    return bitmap_to_ids(index.evaluate(settings['tags filter type'], settings['tags']))
@@ -2,14 +2,16 @@
 closed """
 from ast import literal_eval
 from configparser import ConfigParser
+from contextlib import closing
 from datetime import datetime
 
 from os import makedirs, remove, scandir, getcwd
 from os.path import exists, join, isfile
+from sqlite3 import connect, PARSE_DECLTYPES
 from typing import Tuple, Dict
 
 from database import create_database
-from database_info import get_oldest_date, get_newest_date
+from database_info import JournalStats
 
 
 def _parse_datestring(date: str):
@@ -19,6 +21,21 @@ def _parse_datestring(date: str):
         return datetime.strptime(date, '%Y-%m-%d %H:%M:%S.%f')
 
 
+def _year_range(database: str) -> Tuple[int, int]:
+    """Gets the years of the oldest and newest entries in the database. If the database is empty, returns the current
+    year for both
+
+    :param database: a str representing the path to the database
+    :return: a tuple of ints representing the lowest and highest years
+    """
+    with closing(connect(database, detect_types=PARSE_DECLTYPES)) as connection:
+        years = JournalStats(connection).year_range()
+    if not years:
+        year = datetime.now().year
+        years = year, year
+    return years
+
+
 def _get_file_id(directory: str):
     """Searches for and returns the next available tempfile filename
 
@@ -247,9 +264,15 @@ class ReaderFileManager(_GenericFileManager):
             'tags': '()',
             'body': ''
         }
+        if not self.database:
+            db = join(getcwd(), 'jurnl.sqlite')
+            if not exists(db):
+                create_database(db)
+            self.database = db
+        low_year, high_year = _year_range(self.database)
         self.parser['Dates'] = {
-            'low year': str(get_oldest_date().year),
-            'high year': str(get_newest_date().year),
+            'low year': str(low_year),
+            'high year': str(high_year),
             'low month': '1',
             'high month': '12',
             'low day': '01',
@@ -261,11 +284,6 @@ class ReaderFileManager(_GenericFileManager):
             'low weekday': '0',
             'high weekday': '6'
         }
-        if not self.database:
-            db = join(getcwd(), 'jurnl.sqlite')
-            if not exists(db):
-                create_database(db)
-            self.database = db
 
     def load_parser(self):
         if self._file_path and exists(self._file_path):
@@ -288,9 +306,10 @@ class ReaderFileManager(_GenericFileManager):
         self.reset_dates()
 
     def reset_dates(self):
+        low_year, high_year = _year_range(self.database)
         self.dates = {
-            'low year': str(get_oldest_date().year),
-            'high year': str(get_newest_date().year),
+            'low year': str(low_year),
+            'high year': str(high_year),
             'low month': '1',
             'high month': '12',
             'low day': '01',
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+from sqlite3 import connect, PARSE_DECLTYPES
+
+import pytest
+
+from database import create_database
+from writer_functions import create_entries
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Creates an empty journal database in a temporary directory, which also holds the '.config' directory"""
+    monkeypatch.chdir(tmp_path)
+    # _create_database_config recurses through scan_for_databases, so the config is written up front
+    (tmp_path / '.config').mkdir()
+    (tmp_path / '.config' / 'databases.conf').write_text('[Databases]\n\n[Default]\n\n')
+    path = str(tmp_path / 'test.jurnldb')
+    create_database(path)
+    return path
+
+
+@pytest.fixture
+def connection(database):
+    db = connect(database, detect_types=PARSE_DECLTYPES)
+    yield db
+    db.close()
+
+
+def add_entries(connection, count: int, start: datetime = datetime(2020, 1, 1, 8, 0), step: timedelta = None,
+                body=None, tags=None):
+    """Adds entries one 'step' apart. 'body' and 'tags' are callables receiving the index of the entry"""
+    step = step if step else timedelta(hours=7)
+    return create_entries([{'date': start + step * i,
+                            'body': body(i) if body else 'entry {}'.format(i),
+                            'tags': tags(i) if tags else ()} for i in range(count)], connection)
@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta
+from os import remove, stat, urandom, utime
+from os.path import basename, join
+from sqlite3 import connect
+
+import pytest
+
+import backup
+from backup import (_BLOCK_SIZE, CHANGES_NAME, CODECS, _directory_state, _read_index, _write_changes, backup_catalog,
+                    backup_location, backup_required, backup_skips, backup_time, compress_backup, compression,
+                    database_changes, database_hash, growth_threshold, hash_changes, list_backups, number_of_backups,
+                    plan_retention, restore_backup, run_backup)
+from backup_verify import restore_verified, verify_backups
+from conftest import add_entries
+
+real_hash = database_hash
+
+
+def test_backup_time_parses_old_and_new_names():
+    assert backup_time('db', 'db_2021-03-04-05-06-07-000123.gz') == datetime(2021, 3, 4, 5, 6, 7, 123)
+    assert backup_time('db', 'db_2021-03-04-05-06-07') == datetime(2021, 3, 4, 5, 6, 7)
+    assert backup_time('db', 'db_2021-3-4-5-6-7.xz') == datetime(2021, 3, 4, 5, 6, 7)
+    assert backup_time('db', 'db_manual') is None
+
+
+def test_forced_backups_in_the_same_second_do_not_collide(database):
+    assert run_backup(force=True) == 1
+    assert run_backup(force=True) == 1
+    backups = list_backups('test')
+    assert len(backups) == 2
+    catalog = backup_catalog('test')
+    assert sorted(x['file'] for x in catalog) == sorted(basename(x) for x in backups)
+
+
+def test_index_stays_current_across_record_writes(database):
+    run_backup(force=True)
+    index = _read_index()['test']
+    assert index['state'] == _directory_state(join(backup_location(), 'test'))
+    _write_changes('test', {})
+    assert _read_index()['test']['state'] == _directory_state(join(backup_location(), 'test'))
+
+
+def test_index_sees_backup_added_in_the_same_tick(database):
+    run_backup(force=True)
+    db_directory = join(backup_location(), 'test')
+    mtime = stat(db_directory).st_mtime_ns
+    added = join(db_directory, 'test_2020-01-01-00-00-00-000000')
+    open(added, 'wb').close()
+    utime(db_directory, ns=(mtime, mtime))
+    assert added in list_backups('test')
+
+
+def _times(*hours):
+    start = datetime(2021, 6, 7, 12)
+    return {'b{:03d}'.format(i): (start - timedelta(hours=h)).timestamp() for i, h in enumerate(hours)}
+
+
+def test_plan_retention_keeps_last():
+    backups = _times(0, 1, 2, 3, 4)
+    keep, delete = plan_retention(backups, 2, {})
+    assert keep == ['b000', 'b001']
+    assert delete == ['b002', 'b003', 'b004']
+
+
+def test_plan_retention_always_keeps_newest():
+    keep, delete = plan_retention(_times(0, 1), 0, {})
+    assert keep == ['b000']
+
+
+def test_plan_retention_keeps_newest_of_each_period():
+    # Backups every 12 hours for four days, newest first: 2021-06-07 12:00, 00:00, 06-06 12:00, ...
+    backups = _times(*range(0, 96, 12))
+    keep, delete = plan_retention(backups, 1, {'daily': 3})
+    assert keep == ['b000', 'b002', 'b004']
+    assert len(keep) + len(delete) == len(backups)
+
+
+def test_plan_retention_tiers_overlap():
+    # One backup a day for sixty days; 2021-06-07 is a Monday
+    backups = _times(*range(0, 24 * 60, 24))
+    keep, _ = plan_retention(backups, 1, {'daily': 2, 'weekly': 3, 'monthly': 3})
+    times = sorted((datetime.fromtimestamp(backups[x]) for x in keep), reverse=True)
+    # Daily keeps 06-07 and 06-06, weekly adds 05-30 (the Sunday before), monthly adds 05-31 and 04-30
+    assert [x.strftime('%m-%d') for x in times] == ['06-07', '06-06', '05-31', '05-30', '04-30']
+
+
+def test_run_backup_prunes_to_number_of_backups(database):
+    number_of_backups(2)
+    for _ in range(4):
+        run_backup(force=True)
+    backups = list_backups('test')
+    assert len(backups) == 2
+    assert sorted(x['file'] for x in backup_catalog('test')) == sorted(basename(x) for x in backups)
+
+
+def test_unchanged_database_is_skipped(database):
+    run_backup()
+    run_backup()
+    assert len(list_backups('test')) == 1
+    assert backup_skips('test')['skipped'] == 1
+
+
+def test_touched_database_is_only_hashed_once(database, monkeypatch):
+    hash_changes('yes')
+    run_backup()
+    status = stat(database)
+    utime(database, ns=(status.st_atime_ns, status.st_mtime_ns + 10 ** 9))
+    hashed = []
+    monkeypatch.setattr(backup, 'database_hash', lambda path: hashed.append(path) or real_hash(path))
+    run_backup()
+    run_backup()
+    assert len(list_backups('test')) == 1
+    assert backup_skips('test')['skipped'] == 2
+    assert len(hashed) == 1
+
+
+def test_missing_change_record_is_a_baseline(database):
+    growth_threshold(1)
+    run_backup()
+    remove(join(backup_location(), 'test', CHANGES_NAME))
+    assert backup_required() is False
+    assert database_changes('test', database)['changed'] is True
+    connection = connect(database)
+    connection.execute('INSERT INTO bodies(body) VALUES(?)', ('x' * 4096,))
+    connection.commit()
+    connection.close()
+    assert backup_required() is True
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'bz2', 'lzma'])
+def test_compressed_file_round_trips(codec, tmp_path):
+    # Larger than one block, so the files are read and written in several pieces
+    data = urandom(_BLOCK_SIZE) + b'jurnl' * 1000
+    (tmp_path / 'source').write_bytes(data)
+    compressed = str(tmp_path / ('source' + CODECS[codec][0]))
+    compress_backup(str(tmp_path / 'source'), compressed, codec)
+    restore_backup(compressed, str(tmp_path / 'restored'))
+    assert (tmp_path / 'restored').read_bytes() == data
+
+
+@pytest.mark.parametrize('codec', ['none', 'gzip', 'bz2', 'lzma'])
+def test_backup_restores_with_each_codec(database, connection, codec, tmp_path):
+    add_entries(connection, 3)
+    compression(codec)
+    assert run_backup(force=True) == 1
+    path, = list_backups('test')
+    assert backup_catalog('test')[0]['codec'] == codec
+    restored = str(tmp_path / 'restored.jurnldb')
+    restore_backup(path, restored)
+    copy = connect(restored)
+    assert [x[0] for x in copy.execute('SELECT body FROM bodies ORDER BY entry_id')] == \
+           ['entry 0', 'entry 1', 'entry 2']
+    copy.close()
+
+
+def test_restore_verified_refuses_unverified_backup(database, tmp_path):
+    run_backup(force=True)
+    path, = list_backups('test')
+    destination = str(tmp_path / 'restored.jurnldb')
+    with pytest.raises(FileNotFoundError):
+        restore_verified('test', destination=destination)
+    with pytest.raises(ValueError):
+        restore_verified('test', path, destination)
+    verify_backups(['test'], workers=1)
+    assert restore_verified('test', destination=destination) == path
+    assert (tmp_path / 'restored.jurnldb').exists()
+
+
+def test_restore_verified_refuses_backup_changed_since_verification(database, tmp_path):
+    run_backup(force=True)
+    path, = list_backups('test')
+    verify_backups(['test'], workers=1)
+    with open(path, 'ab') as f:
+        f.write(b'\0' * 512)
+    destination = str(tmp_path / 'restored.jurnldb')
+    with pytest.raises(ValueError):
+        restore_verified('test', path, destination)
+    with pytest.raises(FileNotFoundError):
+        restore_verified('test', destination=destination)
+    assert not (tmp_path / 'restored.jurnldb').exists()
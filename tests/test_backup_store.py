@@ -0,0 +1,35 @@
+from os.path import exists
+
+import pytest
+
+from backup_store import _chunk_path, restore_snapshot, snapshot_database, store_location
+from conftest import add_entries
+
+
+@pytest.fixture
+def snapshot(database, connection):
+    add_entries(connection, 50, body=lambda i: 'body {} '.format(i) * 50)
+    connection.close()
+    return snapshot_database('test', database, chunk_size=1 << 12)
+
+
+def test_restore_matches_database(database, snapshot, tmp_path):
+    restored = str(tmp_path / 'restored.jurnldb')
+    restore_snapshot(snapshot, restored)
+    with open(database, 'rb') as a, open(restored, 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_unchanged_database_stores_no_new_chunks(database, snapshot):
+    assert snapshot_database('test', database, chunk_size=1 << 12).new_bytes == 0
+
+
+def test_corrupt_chunk_is_rejected(snapshot, tmp_path):
+    with open(_chunk_path(store_location(), snapshot.chunks[-1]), 'r+b') as f:
+        f.write(b'corrupt')
+    destination = tmp_path / 'restored.jurnldb'
+    destination.write_bytes(b'original')
+    with pytest.raises(IOError):
+        restore_snapshot(snapshot, str(destination))
+    assert destination.read_bytes() == b'original'
+    assert not exists(str(destination) + '.part')
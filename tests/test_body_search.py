@@ -0,0 +1,66 @@
+import pytest
+
+import body_search
+from body_search import has_trigram_index, required_literals, substring_search
+from conftest import add_entries
+from filter import FilterState, _default_settings, from_body
+from filter_compiler import run_filter
+
+BODIES = ['Coffee at 5% off', 'coffee_time', 'A cup of tea', 'Tea or coffee?', 'nothing here', '50 percent']
+
+
+@pytest.fixture
+def bodies(connection):
+    add_entries(connection, len(BODIES), body=lambda i: BODIES[i])
+    return connection
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('coffee', [1, 2, 4]),
+    ('COFFEE', [1, 2, 4]),
+    ('5%', [1]),
+    ('%', [1]),
+    ('e_t', [2]),
+    ('_', [2]),
+    ('tea', [3, 4]),
+    ('missing', []),
+])
+def test_substring_search(bodies, text, expected):
+    assert substring_search(bodies, text) == expected
+
+
+@pytest.mark.parametrize('text', ['coffee', '5%', '%', 'e_t', '_', 'of', 'tea', 'missing'])
+def test_compiled_filter_matches_from_body(bodies, text):
+    state = FilterState(dict(_default_settings(bodies), body=text), path='filters.conf')
+    assert sorted(run_filter(bodies, state)) == from_body(bodies, state)
+
+
+def test_compiled_filter_without_trigram_index(bodies):
+    bodies.execute('DROP TABLE body_trigrams')
+    state = FilterState(dict(_default_settings(bodies), body='coffee'), path='filters.conf')
+    assert sorted(run_filter(bodies, state)) == from_body(bodies, state) == [1, 2, 4]
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('coffee', ['coffee']),
+    ('coff?ee', ['cof', 'ee']),
+    (r'cup\.of tea', ['cup.of tea']),
+    ('a(b|c)def', ['a', 'def']),
+    ('tea|coffee', []),
+    ('[abc]+xyz', ['xyz']),
+    ('(?x)a b', []),
+])
+def test_required_literals(pattern, expected):
+    assert required_literals(pattern) == expected
+
+
+@pytest.fixture
+def old_sqlite(monkeypatch):
+    monkeypatch.setattr(body_search, 'sqlite_version_info', (3, 31, 1))
+
+
+def test_database_without_trigram_support(old_sqlite, connection):
+    assert not has_trigram_index(connection)
+    add_entries(connection, len(BODIES), body=lambda i: BODIES[i])
+    state = FilterState(dict(_default_settings(connection), body='coffee'), path='filters.conf')
+    assert sorted(run_filter(connection, state)) == from_body(connection, state) == [1, 2, 4]
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from glob import glob
+from json import dumps
+from os.path import join
+from tarfile import TarFile
+
+import pytest
+
+from bulk_format import decode_date, decode_entry, dump_entries, header, read_entries
+from conftest import add_entries
+from exports import export_entries
+from imports import parse_import_file
+
+START = datetime(2022, 5, 17, 9, 41, 27, 123456)
+
+
+@pytest.fixture
+def entries(connection):
+    add_entries(connection, 3, start=START, step=timedelta(seconds=1, microseconds=1),
+                body=lambda i: 'body {}'.format(i), tags=lambda i: ('t{}'.format(i),))
+    return [START + timedelta(seconds=i, microseconds=i) for i in range(3)]
+
+
+def test_mjef_export_keeps_full_dates(database, entries, tmp_path):
+    path, count = export_entries(database, 'mjef', destination=str(tmp_path / 'out'), name='export')
+    assert count == 3
+    parsed = [parse_import_file(x) for x in sorted(glob(join(path, '*.mjef')))]
+    assert [x['date'] for x in parsed] == entries
+    assert [x['body'] for x in parsed] == ['body 0', 'body 1', 'body 2']
+    assert [x['tags'] for x in parsed] == [('t0',), ('t1',), ('t2',)]
+
+
+def test_tar_export_keeps_full_dates(database, entries, tmp_path):
+    path, count = export_entries(database, 'tar', destination=str(tmp_path / 'out'), name='export')
+    with TarFile(path) as archive:
+        archive.extractall(str(tmp_path / 'extracted'), filter='data')
+    parsed = [parse_import_file(x) for x in sorted(glob(join(str(tmp_path / 'extracted'), '**', '*.mjef'),
+                                                         recursive=True))]
+    assert count == 3
+    assert [x['date'] for x in parsed] == entries
+
+
+def test_decode_date_accepts_old_mjef_dates():
+    assert decode_date('202205170941') == datetime(2022, 5, 17, 9, 41)
+    assert decode_date('2022-05-17 09:41:27.123456') == START
+    assert decode_date('') is None
+
+
+def test_sidecar_attachments_are_read_back(connection, tmp_path):
+    ids = add_entries(connection, 1)
+    connection.execute('INSERT INTO attachments(entry_id,filename,file,added) VALUES (?,?,?,?)',
+                       (ids[0], 'note.txt', b'attached', START))
+    connection.commit()
+    path = str(tmp_path / 'journal.ndjson')
+    dump_entries(connection, path, mode='sidecar')
+    with open(path, encoding='utf-8') as file:
+        (_, entry), = read_entries(file, str(tmp_path))
+    with open(entry['attachments'][0], 'rb') as f:
+        assert f.read() == b'attached'
+
+
+def test_sidecar_paths_outside_the_sidecar_directory_are_refused(tmp_path):
+    (tmp_path / 'secret.txt').write_text('secret')
+    (tmp_path / 'journal.ndjson.attachments').mkdir()
+    path = tmp_path / 'journal.ndjson'
+    path.write_text('\n'.join([
+        header(),
+        dumps({'body': 'a', 'attachments': [{'name': 'x', 'path': 'journal.ndjson.attachments/../secret.txt'}]}),
+        dumps({'body': 'b', 'attachments': ['secret.txt']}),
+        dumps({'body': 'c', 'attachments': ['../' + tmp_path.name + '/journal.ndjson.attachments/ok.txt']})]))
+    with open(str(path), encoding='utf-8') as file:
+        results = [entry for _, entry in read_entries(file, str(tmp_path))]
+    assert [type(x) for x in results[:2]] == [ValueError, ValueError]
+    assert results[2]['attachments'] == (str(tmp_path / 'journal.ndjson.attachments' / 'ok.txt'),)
+    with pytest.raises(ValueError):
+        decode_entry(dumps({'attachments': ['../secret.txt']}), str(tmp_path / 'journal.ndjson.attachments'))
@@ -0,0 +1,59 @@
+from sqlite3 import connect, PARSE_DECLTYPES
+
+from conftest import add_entries
+from filter import _default_settings
+from filter_cache import FilterResultCache, settings_hash
+from writer_functions import delete_entry
+
+
+def test_settings_hash_ignores_tag_order():
+    assert settings_hash({'tags': ['a', 'b'], 'body': ''}) == settings_hash({'body': '', 'tags': ['b', 'a']})
+    assert settings_hash({'tags': ['a']}) != settings_hash({'tags': ['b']})
+
+
+def test_hit_until_own_write(connection):
+    add_entries(connection, 10)
+    settings = _default_settings(connection)
+    cache = FilterResultCache()
+    first = cache.get(connection, settings)
+    assert cache.get(connection, settings) == first
+    assert cache.stats()['hits'] == 1
+    delete_entry(first[0], connection)
+    assert cache.get(connection, settings) == first[1:]
+    assert cache.stats()['misses'] == 2
+
+
+def test_miss_after_write_by_other_connection(database, connection):
+    add_entries(connection, 200)
+    settings = _default_settings(connection)
+    cache = FilterResultCache()
+    assert len(cache.get(connection, settings)) == 200
+    other = connect(database, detect_types=PARSE_DECLTYPES)
+    delete_entry(1, other)
+    other.close()
+    assert len(cache.get(connection, settings)) == 199
+
+
+def test_result_is_not_reused_on_another_connection(database, connection):
+    add_entries(connection, 200)
+    settings = _default_settings(connection)
+    cache = FilterResultCache()
+    first, second, third = [connect(database, detect_types=PARSE_DECLTYPES) for _ in range(3)]
+    try:
+        assert len(cache.get(first, settings)) == 200
+        delete_entry(1, second)
+        # a fresh connection starts with the same data_version and change count the first one had
+        assert len(cache.get(third, settings)) == 199
+    finally:
+        for db in [first, second, third]:
+            db.close()
+
+
+def test_evicts_least_recently_used(connection):
+    add_entries(connection, 5)
+    settings = _default_settings(connection)
+    cache = FilterResultCache(max_results=2)
+    for body in ['entry 1', 'entry 2', 'entry 3']:
+        cache.get(connection, dict(settings, body=body))
+    assert len(cache) == 2
+    assert cache.stats()['evictions'] == 1
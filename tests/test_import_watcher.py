@@ -0,0 +1,87 @@
+from json import dumps
+from sqlite3 import OperationalError, connect
+from time import monotonic
+
+import pytest
+
+from import_watcher import ImportWatcher
+from imports import import_parsed, known_hashes, parse_import_file
+
+
+@pytest.fixture
+def mjef(tmp_path):
+    directory = tmp_path / 'incoming'
+    directory.mkdir()
+    path = directory / 'entry.mjef'
+    path.write_text(dumps({'date': '2021-01-02 03:04:05', 'body': 'imported', 'tags': 'a|b', 'attachments': ''}))
+    return str(path)
+
+
+@pytest.fixture
+def ledger(database):
+    """Creates the import ledger, as ImportWatcher.run does before watching"""
+    connection = connect(database)
+    known_hashes(connection)
+    connection.close()
+    return database
+
+
+@pytest.fixture
+def locked(ledger):
+    database = ledger
+    locker = connect(database)
+    locker.execute('BEGIN IMMEDIATE')
+    yield database
+    locker.rollback()
+    locker.close()
+
+
+def _watcher(database, mjef, retry_timeout):
+    watcher = ImportWatcher(database, str(mjef).rsplit('/', 1)[0], retry_timeout=retry_timeout, use_inotify=False)
+    now = monotonic()
+    watcher._pending[mjef] = [-1, -1, now, now, False]
+    return watcher
+
+
+def test_failed_batch_is_not_recorded_as_known(locked, mjef):
+    connection = connect(locked, timeout=0)
+    known = set()
+    with pytest.raises(OperationalError):
+        import_parsed(connection, [parse_import_file(mjef)], known, autodelete=False)
+    assert known == set()
+    connection.close()
+
+
+def test_locked_database_requeues_files(locked, mjef):
+    watcher = _watcher(locked, mjef, 60)
+    connection = connect(locked, timeout=0)
+    known = set()
+    watcher._import(connection, [mjef], known)
+    assert watcher.pending == [mjef]
+    assert watcher.failed == [] and watcher.ids == [] and known == set()
+    connection.close()
+
+
+def test_locked_database_fails_files_after_retry_timeout(locked, mjef):
+    watcher = _watcher(locked, mjef, 0)
+    connection = connect(locked, timeout=0)
+    watcher._import(connection, [mjef], set())
+    assert watcher.pending == []
+    assert [x[0] for x in watcher.failed] == [mjef]
+    connection.close()
+
+
+def test_requeued_file_is_imported_once_unlocked(ledger, mjef):
+    database = ledger
+    watcher = _watcher(database, mjef, 60)
+    locker = connect(database)
+    locker.execute('BEGIN IMMEDIATE')
+    connection = connect(database, timeout=0)
+    known = set()
+    watcher._import(connection, [mjef], known)
+    locker.rollback()
+    locker.close()
+    watcher._import(connection, [mjef], known)
+    assert len(watcher.ids) == 1 and watcher.pending == [] and watcher.failed == []
+    assert known == known_hashes(connection)
+    connection.close()
@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import add_entries
+from filter import TAG_FILTER_TYPES, _default_settings
+from filter_compiler import compile_filter, run_filter
+from live_filter import LiveFilterResult
+from writer_functions import (add_write_listener, create_new_entry, delete_entry, remove_write_listener, set_body,
+                              set_relation, set_tags)
+
+
+@pytest.fixture
+def journal(connection):
+    add_entries(connection, 12, body=lambda i: 'body {}'.format(i), tags=lambda i: [(), ('a',), ('a', 'b')][i % 3])
+    return connection
+
+
+@pytest.fixture
+def writes():
+    seen = []
+
+    def listener(table, entry_id, connection):
+        seen.append((table, entry_id))
+
+    add_write_listener(listener)
+    yield seen
+    remove_write_listener(listener)
+
+
+def test_create_new_entry_notifies_once(connection, writes):
+    journal_id = create_new_entry(connection)
+    assert writes == [('entries', journal_id)]
+
+
+@pytest.mark.parametrize('filtertype', TAG_FILTER_TYPES)
+@pytest.mark.parametrize('extra', [{}, {'body': 'body 1'}, {'body': 'y'}, {'has children': True}])
+def test_live_result_follows_writes(journal, filtertype, extra):
+    settings = dict(_default_settings(journal), **{'tags filter type': filtertype, 'tags': ['a']}, **extra)
+    live = LiveFilterResult(journal, settings)
+    live.subscribe()
+    try:
+        set_tags(3, journal, ('a',))
+        set_tags(2, journal, ('c',))
+        set_body(4, 'body 10 changed', journal)
+        set_relation(1, 5, journal)
+        delete_entry(6, journal)
+        new = create_new_entry(journal)
+        set_tags(new, journal, ('a',))
+        assert live.ids == run_filter(journal, settings)
+    finally:
+        live.unsubscribe()
+
+
+def test_select_entry_does_not_scan(journal):
+    settings = dict(_default_settings(journal), **{'tags filter type': 'Contains Only', 'tags': ['a'],
+                                                   'body': 'body', 'has attachments': True})
+    sql, params = compile_filter(settings).select_entry(1)
+    plan = [x[3] for x in journal.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+    assert not [x for x in plan if x.startswith('SCAN') or 'LIST SUBQUERY' in x]
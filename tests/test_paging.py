@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import add_entries
+from filter import _default_settings
+from filter_compiler import run_filter
+from paging import get_page
+
+
+@pytest.fixture
+def settings(connection):
+    add_entries(connection, 15, step=timedelta(days=1))
+    # Entries that share a date are ordered by id
+    add_entries(connection, 10, start=datetime(2020, 1, 5, 8, 0), step=timedelta(0))
+    return _default_settings(connection)
+
+
+def _walk(connection, settings, size, descending=False):
+    pages, token = [], None
+    while True:
+        page = get_page(connection, settings, size, token, descending)
+        pages.append(page)
+        token = page.next_token
+        if token is None:
+            return pages
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_cover_results_in_order(connection, settings, descending):
+    pages = _walk(connection, settings, 7, descending)
+    assert [len(x.ids) for x in pages] == [7, 7, 7, 4]
+    assert [i for x in pages for i in x.ids] == run_filter(connection, settings, descending=descending)
+    assert pages[0].previous_token is None
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_previous_tokens_walk_back(connection, settings, descending):
+    pages = _walk(connection, settings, 7, descending)
+    page = pages[-1]
+    for expected in reversed(pages[:-1]):
+        page = get_page(connection, settings, 7, page.previous_token, descending)
+        assert page.ids == expected.ids
+    assert page.previous_token is None
+    assert get_page(connection, settings, 7, page.next_token, descending).ids == pages[1].ids
+
+
+def test_pages_within_date_range(connection, settings):
+    settings = dict(settings, **{'low month': 1, 'low day': 3, 'high month': 1, 'high day': 10})
+    pages = _walk(connection, settings, 4)
+    ids = [i for x in pages for i in x.ids]
+    assert ids == run_filter(connection, settings)
+    assert len(ids) == 18
+
+
+def test_total(connection, settings):
+    page = get_page(connection, settings, 5, with_total=True)
+    assert (page.total, page.total_exact) == (25, True)
+    page = get_page(connection, settings, 5, with_total=True, total_limit=10)
+    assert (page.total, page.total_exact) == (10, False)
+
+
+def test_token_from_another_filter_is_rejected(connection, settings):
+    token = get_page(connection, settings, 5).next_token
+    with pytest.raises(ValueError):
+        get_page(connection, dict(settings, body='entry'), 5, token)
+    with pytest.raises(ValueError):
+        get_page(connection, settings, 5, 'not a token')
@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import add_entries
+from filter import FilterState, TAG_FILTER_TYPES, _default_settings, from_tags
+from filter_compiler import run_filter
+from tag_index import TagBitmapIndex, match_tags
+
+TAGS = [(), ('a',), ('b',), ('a', 'b'), ('a', 'c'), ('a', 'b', 'c'), ('c',)]
+
+
+@pytest.fixture
+def tagged(connection):
+    add_entries(connection, len(TAGS), tags=lambda i: TAGS[i])
+    return connection
+
+
+@pytest.mark.parametrize('filtertype, tags, expected', [
+    ('Contains One Of', ['a', 'b'], [2, 3, 4, 5, 6]),
+    ('Contains At Least', ['a', 'b'], [4, 6]),
+    ('Contains Only', ['a', 'b'], [2, 3, 4]),
+    ('Untagged', [], [1]),
+    ('Contains One Of', [], [1, 2, 3, 4, 5, 6, 7]),
+])
+def test_from_tags(tagged, filtertype, tags, expected):
+    state = FilterState(dict(_default_settings(tagged), **{'tags filter type': filtertype, 'tags': tags}),
+                        path='filters.conf')
+    assert from_tags(tagged, state) == expected
+
+
+@pytest.mark.parametrize('filtertype', TAG_FILTER_TYPES)
+@pytest.mark.parametrize('tags', [[], ['a'], ['c', 'a'], ['a', 'b', 'c'], ['missing']])
+def test_every_path_agrees(tagged, filtertype, tags):
+    state = FilterState(dict(_default_settings(tagged), **{'tags filter type': filtertype, 'tags': tags}),
+                        path='filters.conf')
+    expected = from_tags(tagged, state)
+    assert sorted(run_filter(tagged, state)) == expected
+    assert match_tags(TagBitmapIndex(tagged), state) == expected
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from conftest import add_entries
+from timeseries import calendar_heatmap, daily_activity
+
+
+def test_words_ignore_repeated_whitespace(connection):
+    add_entries(connection, 200, step=timedelta(minutes=1), body=lambda i: 'one  two\r\nthree\t\tfour   five  ')
+    daily = daily_activity(connection)
+    assert daily['entries'].sum() == 200
+    assert daily['words'].sum() == 1000
+
+
+def test_empty_bodies_have_no_words(connection):
+    add_entries(connection, 3, body=lambda i: ['', '   ', 'word'][i])
+    assert daily_activity(connection)['words'].sum() == 1
+
+
+def test_days_without_entries_are_zero(connection):
+    add_entries(connection, 3, start=datetime(2021, 3, 1, 12), step=timedelta(days=2), body=lambda i: 'a b')
+    daily = daily_activity(connection)
+    assert list(daily['days']) == list(np.arange('2021-03-01', '2021-03-06', dtype='datetime64[D]'))
+    assert list(daily['entries']) == [1, 0, 1, 0, 1]
+    assert list(daily['words']) == [2, 0, 2, 0, 2]
+
+
+def test_invalid_date_type(connection):
+    with pytest.raises(KeyError):
+        daily_activity(connection, 'published')
+
+
+def test_calendar_heatmap_starts_on_monday():
+    # 2021-03-03 was a Wednesday
+    days = np.arange('2021-03-03', '2021-03-10', dtype='datetime64[D]')
+    start, grid = calendar_heatmap(days, np.arange(1, 8))
+    assert start == np.datetime64('2021-03-01')
+    assert grid.tolist() == [[0, 0, 1, 2, 3, 4, 5], [6, 7, 0, 0, 0, 0, 0]]
@@ -0,0 +1,139 @@
+"""Functions for building dense NumPy time series of journal activity. Binning is done in sqlite with GROUP BY, so
+only one row per bin crosses into Python; the rows are then scattered into dense arrays with vectorized indexing"""
+from sqlite3 import Connection
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from database_info import _date_column
+
+
+def _words(body: Optional[str]) -> int:
+    return len(body.split()) if body else 0
+
+
+def register_words(connection: Connection):
+    """Registers a WORDS function on the connection, which counts the whitespace-separated words of a text the same
+    way str.split does
+
+    :param connection: an sqlite connection
+    """
+    connection.create_function('WORDS', 1, _words, deterministic=True)
+
+
+def daily_activity(connection: Connection, date_type: str = 'creation') -> Dict[str, np.ndarray]:
+    """Counts the entries and words written on each day between the oldest and newest entries. Days without entries
+    are included with counts of zero
+
+    :param connection: an sqlite connection to a jurnl database
+    :param date_type: one of 'creation', 'edit' or 'access'
+    :return: a dict of equal-length arrays: 'days' (datetime64[D]), 'entries' (int64) and 'words' (int64)
+    """
+    column = _date_column(date_type)
+    register_words(connection)
+    rows = connection.execute('SELECT date(d.{0}), COUNT(*), IFNULL(SUM(WORDS(b.body)), 0) FROM dates d '
+                              'LEFT JOIN bodies b ON b.entry_id = d.entry_id WHERE d.{0} IS NOT NULL '
+                              'GROUP BY 1 ORDER BY 1'.format(column)).fetchall()
+    if not rows:
+        return {'days': np.array([], dtype='datetime64[D]'), 'entries': np.array([], dtype=np.int64),
+                'words': np.array([], dtype=np.int64)}
+    bins = np.array([x[0] for x in rows], dtype='datetime64[D]')
+    days = np.arange(bins[0], bins[-1] + 1, dtype='datetime64[D]')
+    index = (bins - bins[0]).astype(np.int64)
+    entries = np.zeros(len(days), dtype=np.int64)
+    words = np.zeros(len(days), dtype=np.int64)
+    entries[index] = [x[1] for x in rows]
+    words[index] = [x[2] for x in rows]
+    return {'days': days, 'entries': entries, 'words': words}
+
+
+def calendar_heatmap(days: np.ndarray, values: np.ndarray) -> Tuple[np.datetime64, np.ndarray]:
+    """Folds a daily series into a grid of weeks, suitable for drawing a calendar heatmap. Rows are weeks starting on
+    Monday and columns are the days Monday through Sunday. Cells outside the series are zero
+
+    :param days: a contiguous datetime64[D] array, as returned by daily_activity
+    :param values: an array of the same length as days
+    :return: the date of the Monday of the first row and a (weeks, 7) array
+    """
+    if len(days) == 0:
+        return np.datetime64('NaT', 'D'), np.zeros((0, 7), dtype=values.dtype)
+    # 1970-01-01 was a Thursday, so shifting by 3 makes Monday weekday 0
+    offset = int((days[0].astype(np.int64) + 3) % 7)
+    start = days[0] - offset
+    padded = np.zeros(-(-(offset + len(days)) // 7) * 7, dtype=values.dtype)
+    padded[offset:offset + len(days)] = values
+    return start, padded.reshape(-1, 7)
+
+
+def hour_by_weekday(connection: Connection, date_type: str = 'creation') -> np.ndarray:
+    """Counts the entries written in each hour of each weekday
+
+    :param connection: an sqlite connection to a jurnl database
+    :param date_type: one of 'creation', 'edit' or 'access'
+    :return: a (7, 24) int64 array indexed by weekday (0 is Sunday, as in sqlite's strftime('%w')) and hour
+    """
+    column = _date_column(date_type)
+    rows = connection.execute('SELECT CAST(strftime(\'%w\', {0}) AS INTEGER), CAST(strftime(\'%H\', {0}) AS INTEGER), '
+                              'COUNT(*) FROM dates WHERE {0} IS NOT NULL GROUP BY 1, 2'.format(column)).fetchall()
+    grid = np.zeros((7, 24), dtype=np.int64)
+    if rows:
+        table = np.array(rows, dtype=np.int64)
+        grid[table[:, 0], table[:, 1]] = table[:, 2]
+    return grid
+
+
+def edit_latency(connection: Connection) -> Dict[str, np.ndarray]:
+    """Gets the time between the creation and the last edit of every entry
+
+    :param connection: an sqlite connection to a jurnl database
+    :return: a dict of equal-length arrays: 'entry_ids' (int64) and 'seconds' (float64)
+    """
+    rows = connection.execute('SELECT entry_id, (julianday(last_edit) - julianday(created)) * 86400.0 FROM dates '
+                              'WHERE created IS NOT NULL AND last_edit IS NOT NULL ORDER BY entry_id').fetchall()
+    table = np.array(rows, dtype=np.float64).reshape(-1, 2)
+    return {'entry_ids': table[:, 0].astype(np.int64), 'seconds': table[:, 1]}
+
+
+def activity_arrays(connection: Connection, date_type: str = 'creation') -> Dict[str, np.ndarray]:
+    """Builds every activity series for the database
+
+    :param connection: an sqlite connection to a jurnl database
+    :param date_type: one of 'creation', 'edit' or 'access'
+    :return: a dict of arrays, keyed by name
+    """
+    daily = daily_activity(connection, date_type)
+    heatmap_start, heatmap = calendar_heatmap(daily['days'], daily['entries'])
+    latency = edit_latency(connection)
+    return {
+        'days': daily['days'],
+        'entries': daily['entries'],
+        'words': daily['words'],
+        'heatmap_start': np.array(heatmap_start),
+        'heatmap': heatmap,
+        'hour_by_weekday': hour_by_weekday(connection, date_type),
+        'latency_entry_ids': latency['entry_ids'],
+        'latency_seconds': latency['seconds']
+    }
+
+
+def save_arrays(path: str, arrays: Dict[str, np.ndarray], compressed: bool = True):
+    """Saves a dict of arrays to an '.npz' file
+
+    :param path: a str representing the file to write
+    :param arrays: a dict of arrays, keyed by name
+    :param compressed: a bool indicating whether the archive should be compressed
+    """
+    if compressed:
+        np.savez_compressed(path, **arrays)
+    else:
+        np.savez(path, **arrays)
+
+
+def export_activity(connection: Connection, path: str, date_type: str = 'creation'):
+    """Builds every activity series for the database and saves them to an '.npz' file
+
+    :param connection: an sqlite connection to a jurnl database
+    :param path: a str representing the file to write
+    :param date_type: one of 'creation', 'edit' or 'access'
+    """
+    save_arrays(path, activity_arrays(connection, date_type))
@@ -2,32 +2,66 @@
 from datetime import datetime
 from os.path import basename
 from sqlite3 import Connection
-from typing import Tuple, Any
+from typing import Tuple, Any, Callable, Iterable, List
 
 from reader_functions import get_tags, get_attachment_ids
 
+"""---------------------------------Write Events----------------------------------"""
+
+_listeners: List[Callable[[str, int, Connection], None]] = []
+
+
+def add_write_listener(listener: Callable[[str, int, Connection], None]):
+    """Registers a callable that is called after every committed write made through this module. It receives the name
+    of the table that changed ('dates', 'bodies', 'tags', 'attachments', 'relations', or 'entries' when an entry is
+    created or deleted), the id of the entry and the connection that made the write
+
+    :param listener: a callable taking a str, an int and a Connection
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_write_listener(listener: Callable[[str, int, Connection], None]):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def _notify(table: str, journal_id: int, connection: Connection):
+    for listener in list(_listeners):
+        listener(table, journal_id, connection)
+
+
 """---------------------------------Date Methods----------------------------------"""
 
 
-def set_date(journal_id: int, connection: Connection, date: datetime = None):
+def _write_date(journal_id: int, connection: Connection, date: datetime = None):
     if not date:
         date = datetime.now()
     connection.execute('INSERT INTO dates(created,last_edit,last_access,entry_id) VALUES(?,?,?,?) '
-                       'ON CONFLICT(entry_id) DO UPDATE SET created=?, last_edit=?, last_access=? WHERE entry_id=?',
+                       'ON CONFLICT(entry_id) DO UPDATE SET created=excluded.created, last_edit=excluded.last_edit, '
+                       'last_access=excluded.last_access',
                        (date, date, date, journal_id))
+
+
+def set_date(journal_id: int, connection: Connection, date: datetime = None):
+    _write_date(journal_id, connection, date)
     connection.commit()
+    _notify('dates', journal_id, connection)
 
 
 def set_last_edit(journal_id: int, connection: Connection):
     now = datetime.now()
     connection.execute('UPDATE dates SET last_edit=?, last_access=? WHERE entry_id=?', (now, now, journal_id))
     connection.commit()
+    _notify('dates', journal_id, connection)
 
 
 def set_last_access(journal_id: int, connection: Connection):
     now = datetime.now()
     connection.execute('UPDATE dates SET last_access=? WHERE entry_id=?', (now, journal_id))
     connection.commit()
+    _notify('dates', journal_id, connection)
 
 
 """---------------------------------Body Methods----------------------------------"""
@@ -36,12 +70,13 @@ def set_last_access(journal_id: int, connection: Connection):
 def set_body(journal_id: int, body: str, connection: Connection):
     connection.execute('UPDATE bodies SET body=? WHERE entry_id=?', (body.strip(), journal_id))
     connection.commit()
+    _notify('bodies', journal_id, connection)
 
 
 """---------------------------------Tags Methods----------------------------------"""
 
 
-def set_tags(journal_id: int, connection: Connection, tags: Tuple[str] = None):
+def _write_tags(journal_id: int, connection: Connection, tags: Tuple[str] = None):
     if not tags:
         connection.execute('INSERT INTO tags(entry_id) VALUES(?)', (journal_id,))
     else:
@@ -52,7 +87,12 @@ def set_tags(journal_id: int, connection: Connection, tags: Tuple[str] = None):
         removed = set(old).difference(tags)
         removed = [(journal_id, tag) for tag in removed]
         connection.executemany('DELETE FROM tags WHERE entry_id=? AND tag=?', removed)
+
+
+def set_tags(journal_id: int, connection: Connection, tags: Tuple[str] = None):
+    _write_tags(journal_id, connection, tags)
     connection.commit()
+    _notify('tags', journal_id, connection)
 
 
 """---------------------------------Attachments Methods----------------------------------"""
@@ -73,6 +113,7 @@ def set_attachments(journal_id: int, attachments: Tuple[Any], connection: Connec
     removed = [(att_id,) for att_id in removed]
     connection.executemany('DELETE FROM attachments WHERE att_id=?', removed)
     connection.commit()
+    _notify('attachments', journal_id, connection)
 
 
 """---------------------------------Relations Methods----------------------------------"""
@@ -82,20 +123,63 @@ def set_relation(parent: int, child: int, connection: Connection):
     if (child,) not in connection.execute('SELECT child FROM relations WHERE parent=?', (parent,)).fetchall():
         connection.execute('INSERT INTO relations(child,parent) VALUES (?,?)', (child, parent))
     connection.commit()
+    _notify('relations', parent, connection)
+    _notify('relations', child, connection)
 
 
 """---------------------------------Entry Methods----------------------------------"""
 
 
 def create_new_entry(connection: Connection):
-    cursor = connection.execute('INSERT INTO bodies(body) VALUE(?)', ('',))
+    cursor = connection.execute('INSERT INTO bodies(body) VALUES(?)', ('',))
     journal_id = cursor.lastrowid
-    set_date(journal_id, connection)
-    set_tags(journal_id, connection)
+    # The date and tags are written in the same transaction, so listeners are only notified once
+    _write_date(journal_id, connection)
+    _write_tags(journal_id, connection)
     connection.commit()
+    _notify('entries', journal_id, connection)
     return cursor.lastrowid
 
 
+def create_entries(entries: Iterable[dict], connection: Connection,
+                   after_insert: Callable[[Connection, List[int]], None] = None) -> List[int]:
+    """Creates many entries in a single transaction. Each entry is a dict with the keys 'date' (a datetime, or None
+    for now), 'body', 'tags' and 'attachments' (paths to files, or (filename, bytes) tuples). Write listeners are
+    notified once per entry after the transaction commits
+
+    :param entries: an iterable of dicts, one per entry
+    :param connection: an sqlite connection to a jurnl database
+    :param after_insert: a callable that receives the connection and the new ids before the transaction commits, so
+    that related rows are committed together with the entries
+    :return: a list of the new entry ids, in the order of the entries
+    """
+    ids, dates, tags, attachments = [], [], [], []
+    now = datetime.now()
+    with connection:
+        for entry in entries:
+            journal_id = connection.execute('INSERT INTO bodies(body) VALUES(?)',
+                                            ((entry.get('body') or '').strip(),)).lastrowid
+            ids.append(journal_id)
+            date = entry.get('date') or now
+            dates.append((journal_id, date, date, date))
+            entry_tags = [x for x in dict.fromkeys(entry.get('tags') or ()) if x]
+            tags += [(journal_id, tag) for tag in entry_tags] if entry_tags else [(journal_id, '(UNTAGGED)')]
+            for attachment in entry.get('attachments') or ():
+                if isinstance(attachment, tuple):
+                    attachments.append((journal_id, attachment[0], attachment[1], now))
+                    continue
+                with open(attachment, 'rb') as f:
+                    attachments.append((journal_id, basename(attachment), f.read(), now))
+        connection.executemany('INSERT INTO dates(entry_id,created,last_edit,last_access) VALUES(?,?,?,?)', dates)
+        connection.executemany('INSERT INTO tags(entry_id,tag) VALUES(?,?)', tags)
+        connection.executemany('INSERT INTO attachments(entry_id,filename,file,added) VALUES (?,?,?,?)', attachments)
+        if after_insert:
+            after_insert(connection, ids)
+    for journal_id in ids:
+        _notify('entries', journal_id, connection)
+    return ids
+
+
 def delete_entry(journal_id, connection: Connection):
     connection.execute('DELETE FROM bodies WHERE entry_id=?', (journal_id,))
     connection.execute('DELETE FROM dates WHERE entry_id=?', (journal_id,))
@@ -103,3 +187,4 @@ def delete_entry(journal_id, connection: Connection):
     connection.execute('DELETE FROM attachments WHERE entry_id=?', (journal_id,))
     connection.execute('DELETE FROM relations WHERE child=? OR parent=?', (journal_id, journal_id))
     connection.commit()
+    _notify('entries', journal_id, connection)